@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Benchmark of the scan of the scheduling orders saved by the agent.
+
+Orders to start Job Instances at a later date are saved both in the
+recovery journal and in the former layout of one file per order. The
+time needed to read them back, as the agent does when it restarts, is
+reported as JSON along with the cost of appending to the journal and
+of compacting it.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'openbach-agent'))
+import openbach_agent
+
+
+ARGUMENTS = '-i 1 -c 10 192.168.1.2'
+
+
+def write_files(folder, instances, date):
+    """Save orders the way former versions of the agent did"""
+    for instance in range(instances):
+        filename = os.path.join(folder, 'fping{}.start'.format(instance))
+        with open(filename, 'w') as order:
+            print('fping', instance, 1, 1, date, ARGUMENTS, sep='\n', file=order)
+
+
+def scan_files(folder):
+    """Read orders the way former versions of the agent did"""
+    orders = []
+    for root, _, filenames in os.walk(folder):
+        for filename in sorted(filenames):
+            with open(os.path.join(root, filename)) as f:
+                orders.append(f.readlines())
+    return orders
+
+
+def main(instances):
+    date = time.time() + 3600
+    with tempfile.TemporaryDirectory() as folder:
+        files_folder = os.path.join(folder, 'files')
+        os.mkdir(files_folder)
+        start = time.perf_counter()
+        write_files(files_folder, instances, date)
+        files_write = time.perf_counter() - start
+        start = time.perf_counter()
+        files_scanned = len(scan_files(files_folder))
+        files_scan = time.perf_counter() - start
+
+        openbach_agent.INSTANCES_FOLDER = folder
+        journal = openbach_agent.RecoveryJournal()
+        start = time.perf_counter()
+        for instance in range(instances):
+            journal.record_start('fping', str(instance), '1', '1', date, ARGUMENTS)
+        journal_write = time.perf_counter() - start
+        journal_size = os.path.getsize(journal.path)
+
+        start = time.perf_counter()
+        journal_scanned = len(journal.replay())
+        journal_scan = time.perf_counter() - start
+
+        start = time.perf_counter()
+        journal.compact()
+        compaction = time.perf_counter() - start
+
+    return {
+            'configuration': {
+                'pending_instances': instances,
+                'python': platform.python_version(),
+            },
+            'one_file_per_order': {
+                'orders_read': files_scanned,
+                'write_per_order_us': files_write / instances * 1e6,
+                'scan_time': files_scan,
+            },
+            'journal': {
+                'orders_read': journal_scanned,
+                'size': journal_size,
+                'append_per_order_us': journal_write / instances * 1e6,
+                'scan_time': journal_scan,
+                'compaction_time': compaction,
+            },
+            'speedup': files_scan / journal_scan,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-n', '--instances', type=int, default=10000,
+            help='amount of Job Instances pending at restart')
+    parser.add_argument(
+            '-o', '--output', type=argparse.FileType('w'), default=sys.stdout,
+            help='file to write the JSON results to')
+    args = parser.parse_args()
+    results = main(args.instances)
+    json.dump(results, args.output, indent=4)
+    args.output.write('\n')
@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Load generator and benchmark of the rstats daemon.
+
+Start an rstats server in a child process, routing statistics to a
+stub logstash listening locally on both TCP and UDP, then drive it
+with concurrent synthetic clients speaking the same text requests
+than collect_agent (create_stat, send_stat and remove_stat). Report
+the throughput, the request latencies, the CPU used by rstats per
+message and the amount of messages lost, as JSON.
+
+Everything runs on the local machine and no OpenBACH installation
+is needed.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import argparse
+import tempfile
+import platform
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'collect-agent'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rstats'))
+import rstats
+
+
+CLIENT_TIMEOUT = 5
+DRAIN_TIMEOUT = 10
+STATISTICS = {'rtt': 12.345, 'sent_packets': 1024, 'lost_packets': 3, 'congested': 'false'}
+
+
+class StubLogstash:
+    """Count the newline-delimited messages received
+    on both a TCP and an UDP socket.
+    """
+
+    def __init__(self):
+        self.received = 0
+        self._mutex = threading.Lock()
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**23)
+        self.udp.bind(('127.0.0.1', 0))
+        self.port = self.udp.getsockname()[1]
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind(('127.0.0.1', self.port))
+        self.tcp.listen(8)
+        threading.Thread(target=self._serve_udp, daemon=True).start()
+        threading.Thread(target=self._serve_tcp, daemon=True).start()
+
+    def _count(self, data):
+        with self._mutex:
+            self.received += data.count(b'\n')
+
+    def _serve_udp(self):
+        while True:
+            self._count(self.udp.recv(2**16))
+
+    def _serve_tcp(self):
+        while True:
+            connection, _ = self.tcp.accept()
+            threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+    def _serve_connection(self, connection):
+        with connection:
+            while True:
+                data = connection.recv(2**16)
+                if not data:
+                    return
+                self._count(data)
+
+
+def serve(folder, port, asyncio_server, workers):
+    """Run an rstats server configured to send
+    statistics to the stub logstash in `folder`.
+    """
+    rstats.COLLECTOR_CONFIG_FILE = os.path.join(folder, 'collector.yml')
+    rstats.RSTATS_CONFIG_FILE = os.path.join(folder, 'rstats.yml')
+    rstats.DEFAULT_LOG_PATH = os.path.join(folder, 'stats')
+    rstats.OpenStatsFiles().writer_options = {}
+    rstats.StatsFilesFlusher(rstats.STORAGE_FLUSH_INTERVAL).start()
+    if asyncio_server:
+        server = rstats.AsyncRstatsServer(('127.0.0.1', port), rstats.RstatsRequestHandler, workers)
+    else:
+        server = rstats.RstatsServer(('127.0.0.1', port), rstats.RstatsRequestHandler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        rstats.get_statistics_sender().close()
+
+
+def client(index, port, folder, messages, rate, results):
+    """Synthetic job sending `messages` statistics, at most
+    `rate` per second if not 0, and recording the latency of
+    each request.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(CLIENT_TIMEOUT)
+    address = ('127.0.0.1', port)
+
+    def request(message):
+        start = time.perf_counter()
+        try:
+            sock.sendto(message.encode(), address)
+            response = sock.recv(2048).decode()
+        except socket.timeout:
+            return None, None
+        return response, time.perf_counter() - start
+
+    response, _ = request('1 {} "benchmark" {} 1 0 "benchmark" 1'.format(
+            shlex.quote(os.path.join(folder, 'none.conf')), index + 1))
+    if not response.startswith('OK'):
+        raise RuntimeError('cannot register to rstats: {}'.format(response))
+    connection_id = int(response.split()[1].rstrip('\0'))
+
+    statistics = ' '.join(shlex.quote(str(v)) for item in STATISTICS.items() for v in item)
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for sent in range(messages):
+        timestamp = int(time.time() * 1000)
+        response, latency = request('2 {} {} {} eth0'.format(connection_id, timestamp, statistics))
+        if response is None or not response.startswith('OK'):
+            errors += 1
+        else:
+            latencies.append(latency)
+        if rate:
+            delay = start + (sent + 1) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    request('4 {}'.format(connection_id))
+    results.put((latencies, errors))
+
+
+def cpu_time(pid):
+    with open('/proc/{}/stat'.format(pid)) as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def percentile(values, rank):
+    if not values:
+        return None
+    return values[min(int(rank * len(values)), len(values) - 1)]
+
+
+def main(clients, messages, rate, mode, asyncio_server, workers, batch_size, port):
+    stub = StubLogstash()
+    with tempfile.TemporaryDirectory() as folder:
+        with open(os.path.join(folder, 'collector.yml'), 'w') as config:
+            json.dump({'address': '127.0.0.1', 'stats': {'port': stub.port}}, config)
+        with open(os.path.join(folder, 'rstats.yml'), 'w') as config:
+            json.dump({'logstash': {'mode': mode, 'batch': {'size': batch_size}}}, config)
+        server = multiprocessing.Process(target=serve, args=(folder, port, asyncio_server, workers), daemon=True)
+        server.start()
+        time.sleep(0.5)
+        server_cpu = cpu_time(server.pid)
+
+        results = multiprocessing.Queue()
+        processes = [
+                multiprocessing.Process(target=client, args=(index, port, folder, messages, rate, results))
+                for index in range(clients)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        elapsed = time.perf_counter() - start
+        for process in processes:
+            process.join()
+
+        latencies = sorted(latency for client_latencies, _ in outcomes for latency in client_latencies)
+        errors = sum(client_errors for _, client_errors in outcomes)
+        acknowledged = len(latencies)
+        deadline = time.perf_counter() + DRAIN_TIMEOUT
+        while stub.received < acknowledged and time.perf_counter() < deadline:
+            time.sleep(0.1)
+        server_cpu = cpu_time(server.pid) - server_cpu
+        server.terminate()
+        server.join()
+
+    return {
+            'configuration': {
+                'clients': clients,
+                'messages_per_client': messages,
+                'rate_per_client': rate,
+                'mode': mode,
+                'server': 'asyncio' if asyncio_server else 'threaded',
+                'workers': workers,
+                'batch_size': batch_size,
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+            },
+            'messages': clients * messages,
+            'acknowledged': acknowledged,
+            'errors': errors,
+            'received_by_logstash': stub.received,
+            'dropped': clients * messages - stub.received,
+            'duration': elapsed,
+            'throughput': acknowledged / elapsed,
+            'latency_p50_ms': None if not latencies else percentile(latencies, 0.5) * 1000,
+            'latency_p99_ms': None if not latencies else percentile(latencies, 0.99) * 1000,
+            'latency_max_ms': None if not latencies else latencies[-1] * 1000,
+            'server_cpu_per_message_us': server_cpu / max(acknowledged, 1) * 1e6,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-c', '--clients', type=int, default=4,
+            help='amount of concurrent synthetic jobs')
+    parser.add_argument(
+            '-n', '--messages', type=int, default=5000,
+            help='amount of statistics sent by each job')
+    parser.add_argument(
+            '-r', '--rate', type=float, default=0,
+            help='maximal amount of statistics sent per second '
+            'by each job, 0 meaning as fast as possible')
+    parser.add_argument(
+            '-m', '--mode', choices=('udp', 'tcp'), default='udp',
+            help='transport used by rstats to reach logstash')
+    parser.add_argument(
+            '-a', '--asyncio', action='store_true',
+            help='benchmark the asyncio server instead of the threaded one')
+    parser.add_argument(
+            '-w', '--workers', type=int, default=1,
+            help='amount of threads executing requests in asyncio mode')
+    parser.add_argument(
+            '-b', '--batch-size', type=int, default=rstats.BATCH_SIZE,
+            help='amount of statistics sent at once to logstash')
+    parser.add_argument(
+            '-p', '--port', type=int, default=11111,
+            help='port rstats listens on during the benchmark')
+    parser.add_argument(
+            '-o', '--output', type=argparse.FileType('w'), default=sys.stdout,
+            help='file to write the JSON results to')
+    args = parser.parse_args()
+    results = main(
+            args.clients, args.messages, args.rate, args.mode,
+            args.asyncio, args.workers, args.batch_size, args.port)
+    json.dump(results, args.output, indent=4)
+    args.output.write('\n')
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Benchmark of the socket and shared-memory transports between
+collect_agent and a running rstats daemon.
+
+Statistics are sent at a fixed target rate using each transport in
+turn and the achieved rate, the CPU cost on the job side and the
+amount of statistics actually processed by rstats are reported.
+Statistics are neither stored on the collector nor broadcast.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+
+sys.path.insert(0, '/opt/openbach/agent/collect_agent/')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'collect-agent'))
+import collect_agent
+
+
+PACING_PERIOD = 0.01
+DRAIN_TIMEOUT = 10
+
+
+def rstats_counters():
+    response = collect_agent._rstats_messager(b'11')
+    status, _, content = response.partition(' ')
+    if status != 'OK':
+        raise ConnectionError('rstats does not report its statistics: {}'.format(response))
+    return json.loads(content)
+
+
+def process_time(pid):
+    """CPU time, in seconds, used by the given process"""
+    if pid is None:
+        return None
+    with open('/proc/{}/stat'.format(pid)) as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def run(transport, filter_file, rate, duration, ring_size, rstats_pid):
+    ring_buffer_size = ring_size if transport == 'shared memory' else 0
+    if not collect_agent.register_collect(filter_file, new=True, ring_buffer_size=ring_buffer_size):
+        raise ConnectionError('cannot communicate with rstats')
+    if ring_buffer_size and collect_agent._ring_buffer is None:
+        raise ConnectionError('rstats refused the ring buffer')
+    connection_id = str(collect_agent._connection_id.value)
+
+    per_period = max(1, int(rate * PACING_PERIOD))
+    amount = int(rate * duration)
+    rstats_cpu = process_time(rstats_pid)
+    cpu = time.process_time()
+    start = time.perf_counter()
+    sent = 0
+    while sent < amount:
+        for _ in range(min(per_period, amount - sent)):
+            collect_agent.send_stat(int(time.time() * 1000), seq=sent, rtt=12.5, cwnd=10)
+            sent += 1
+        delay = start + sent / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    # Wait for rstats to process everything we sent
+    deadline = time.perf_counter() + DRAIN_TIMEOUT
+    while True:
+        received = rstats_counters()['connections'][connection_id]['messages_received']
+        if received >= sent or time.perf_counter() > deadline:
+            break
+        time.sleep(0.1)
+    drained = time.perf_counter() - start - elapsed
+    if rstats_cpu is not None:
+        rstats_cpu = process_time(rstats_pid) - rstats_cpu
+    collect_agent.remove_stat()
+
+    return {
+            'transport': transport,
+            'target_rate': rate,
+            'sent': sent,
+            'achieved_rate': sent / elapsed,
+            'job_cpu_per_sample_us': cpu / sent * 1e6,
+            'received_by_rstats': received,
+            'drain_time': drained,
+            'rstats_cpu_per_sample_us': None if rstats_cpu is None else rstats_cpu / sent * 1e6,
+    }
+
+
+def main(rate, duration, ring_size, rstats_pid, json_output):
+    os.environ.setdefault('JOB_NAME', 'benchmark_shared_memory')
+    os.environ.setdefault('JOB_INSTANCE_ID', '0')
+    os.environ.setdefault('SCENARIO_INSTANCE_ID', '0')
+    os.environ.setdefault('OWNER_SCENARIO_INSTANCE_ID', '0')
+
+    with tempfile.NamedTemporaryFile('w', suffix='.conf') as filter_file:
+        filter_file.write('[default]\nstorage=false\nbroadcast=false\n')
+        filter_file.flush()
+        results = [
+                run(transport, filter_file.name, rate, duration, ring_size, rstats_pid)
+                for transport in ('socket', 'shared memory')
+        ]
+
+    if json_output:
+        print(json.dumps(results, indent=4))
+        return
+
+    print('{:<15}{:>12}{:>12}{:>14}{:>12}{:>14}'.format(
+        '', 'rate (/s)', 'received', 'job CPU (µs)', 'drain (s)', 'rstats (µs)'))
+    for result in results:
+        rstats_cpu = result['rstats_cpu_per_sample_us']
+        print('{:<15}{:>12.0f}{:>12}{:>14.2f}{:>12.2f}{:>14}'.format(
+            result['transport'], result['achieved_rate'],
+            result['received_by_rstats'], result['job_cpu_per_sample_us'],
+            result['drain_time'], '-' if rstats_cpu is None else '{:.2f}'.format(rstats_cpu)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-r', '--rate', type=int, default=100000,
+            help='target amount of statistics sent per second')
+    parser.add_argument(
+            '-d', '--duration', type=float, default=5,
+            help='duration, in seconds, of the test of each transport')
+    parser.add_argument(
+            '-s', '--ring-size', type=int, default=2**22,
+            help='size, in bytes, of the shared-memory ring buffer')
+    parser.add_argument(
+            '-p', '--rstats-pid', type=int,
+            help='PID of rstats to also report its CPU usage')
+    parser.add_argument(
+            '-j', '--json', action='store_true',
+            help='output raw results as JSON')
+    args = parser.parse_args()
+    main(args.rate, args.duration, args.ring_size, args.rstats_pid, args.json)
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Benchmark of the loading of the installed jobs when the agent starts.
+
+The configuration files of the jobs of this repository are adapted to
+the host platform and duplicated to reach the requested amount of
+installed jobs. The time needed to load them all is then measured with
+no configurations cache (cold start), with an up-to-date cache (warm
+start) and with a cache outdated for a single job. Each measure runs
+in a fresh Python process and results are reported as JSON.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import tempfile
+import itertools
+import multiprocessing
+
+import yaml
+
+
+AGENT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'openbach-agent')
+REPOSITORY_JOBS = os.path.join(AGENT_FOLDER, '..', '..', 'jobs')
+
+
+def measure(folder, cache_file, results):
+    """Load every job in `folder` the way the agent does at startup"""
+    start = time.perf_counter()
+    sys.path.insert(0, AGENT_FOLDER)
+    import openbach_agent
+    imported = time.perf_counter()
+
+    openbach_agent.JOBS_FOLDER = folder
+    openbach_agent.JOBS_CACHE_FILE = cache_file
+    openbach_agent.populate_installed_jobs()
+    loaded = time.perf_counter()
+
+    results.put({
+            'import': imported - start,
+            'load_jobs': loaded - imported,
+            'jobs_loaded': len(openbach_agent.JobManager().jobs),
+    })
+
+
+def run(folder, cache_file):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=measure, args=(folder, cache_file, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def host_platform():
+    sys.path.insert(0, AGENT_FOLDER)
+    import openbach_agent
+    return openbach_agent.platform_facts()
+
+
+def install_jobs(source, folder, amount):
+    """Write `amount` job configuration files in `folder`,
+    adapted from those found in `source`.
+    """
+    system, distribution, version = host_platform()
+    configurations = []
+    for filename in sorted(glob.glob(os.path.join(source, '**', 'files', '*.yml'), recursive=True)):
+        with open(filename) as stream:
+            try:
+                content = yaml.safe_load(stream)
+            except yaml.YAMLError:
+                continue
+        if not isinstance(content, dict) or 'general' not in content:
+            continue
+        oses = content.get('platform_configuration') or []
+        command = oses[0].get('command') if oses else 'true'
+        oses.append({
+            'ansible_system': system,
+            'ansible_distribution': distribution,
+            'ansible_distribution_version': version,
+            'command': command,
+            'command_stop': None,
+        })
+        content['platform_configuration'] = oses
+        configurations.append(content)
+
+    if not configurations:
+        raise ValueError('no job configuration found in {}'.format(source))
+
+    for index, content in zip(range(amount), itertools.cycle(configurations)):
+        job_name = '{}_{}'.format(content['general']['name'], index)
+        with open(os.path.join(folder, '{}.yml'.format(job_name)), 'w') as stream:
+            yaml.safe_dump(content, stream, default_flow_style=False)
+    return job_name
+
+
+def main(amount, source):
+    with tempfile.TemporaryDirectory() as folder:
+        jobs_folder = os.path.join(folder, 'jobs')
+        os.mkdir(jobs_folder)
+        cache_file = os.path.join(folder, 'jobs_cache.json')
+        last_job = install_jobs(source, jobs_folder, amount)
+
+        cold = run(jobs_folder, cache_file)
+        warm = run(jobs_folder, cache_file)
+        # Make a single job outdated in the cache
+        os.utime(os.path.join(jobs_folder, '{}.yml'.format(last_job)))
+        one_modified = run(jobs_folder, cache_file)
+        cache_size = os.path.getsize(cache_file)
+
+    return {
+            'configuration': {
+                'installed_jobs': amount,
+                'python': platform.python_version(),
+                'yaml_with_libyaml': yaml.__with_libyaml__,
+            },
+            'cache_size': cache_size,
+            'cold_start': cold,
+            'warm_start': warm,
+            'one_job_modified': one_modified,
+            'speedup': cold['load_jobs'] / warm['load_jobs'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-n', '--jobs', type=int, default=50,
+            help='amount of installed jobs')
+    parser.add_argument(
+            '-s', '--source', default=REPOSITORY_JOBS,
+            help='folder to search for job configuration files')
+    parser.add_argument(
+            '-o', '--output', type=argparse.FileType('w'), default=sys.stdout,
+            help='file to write the JSON results to')
+    args = parser.parse_args()
+    results = main(args.jobs, args.source)
+    json.dump(results, args.output, indent=4)
+    args.output.write('\n')
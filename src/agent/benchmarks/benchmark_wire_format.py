@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Micro-benchmark of the encoding and decoding cost of a
+send_stat request using the text and the binary protocols
+between collect_agent and rstats.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import sys
+import shlex
+import timeit
+import argparse
+
+sys.path.insert(0, '/opt/openbach/agent/collect_agent/')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'collect-agent'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rstats'))
+import collect_agent
+import rstats
+
+
+CONNECTION_ID = 42
+TIMESTAMP = 1514764800000
+SUFFIX = 'eth0'
+STATISTICS = {
+        'rtt': 12.345,
+        'sent_packets': 1024,
+        'lost_packets': 3,
+        'throughput': 987654.321,
+        'congested': False,
+}
+
+
+def encode_text(connection_id, timestamp, suffix, stats):
+    """Mimic collect_agent.send_stat and the C library formatting"""
+    quote = shlex.quote
+    values = ' '.join(quote(str(value)) for item in stats.items() for value in item)
+    return '2 {} {} {} {}'.format(connection_id, timestamp, values, quote(suffix)).encode()
+
+
+def decode_text(data):
+    """Mimic RstatsRequestHandler.execute_request and send_stat"""
+    request, connection_id, timestamp, *statistics = shlex.split(data.decode())
+    int(request), int(connection_id), int(timestamp)
+    suffix = statistics[-1] if len(statistics) % 2 else None
+    statistics = {
+            name: rstats.parse_statistic(value)
+            for name, value in rstats.grouper(statistics, 2)
+    }
+    return suffix, statistics
+
+
+def encode_binary(connection_id, timestamp, suffix, stats):
+    return collect_agent.encode_stat(connection_id, timestamp, suffix, stats)
+
+
+def decode_binary(data):
+    return rstats.decode_binary_stat(data, rstats.BINARY_HEADER.size)
+
+
+def measure(function, argument, repeat, number):
+    timer = timeit.Timer(lambda: function(*argument))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main(repeat, number):
+    arguments = (CONNECTION_ID, TIMESTAMP, SUFFIX, STATISTICS)
+    text = encode_text(*arguments)
+    binary = encode_binary(*arguments)
+
+    print('Statistics:', STATISTICS)
+    print('Message size: text {} bytes, binary {} bytes'.format(len(text), len(binary)))
+    print('{:<10}{:>14}{:>14}'.format('', 'encode (µs)', 'decode (µs)'))
+    for name, encoder, decoder, message in (
+            ('text', encode_text, decode_text, text),
+            ('binary', encode_binary, decode_binary, binary)):
+        encode = measure(encoder, arguments, repeat, number)
+        decode = measure(decoder, (message,), repeat, number)
+        print('{:<10}{:>14.2f}{:>14.2f}'.format(name, encode * 1e6, decode * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-r', '--repeat', type=int, default=5,
+            help='amount of measurements, the best one is kept')
+    parser.add_argument(
+            '-n', '--number', type=int, default=20000,
+            help='amount of calls per measurement')
+    args = parser.parse_args()
+    main(args.repeat, args.number)
@@ -13,6 +13,14 @@ unsigned int owner_scenario_instance_id = 0;
 std::string agent_name("");
 std::string job_name;
 
+// Parameters of the last registration, used to register
+// again should RStats close the connection
+static bool registered = false;
+static std::string registered_config_file;
+static int registered_log_option = 0;
+static int registered_log_facility = 0;
+static const std::string UNKNOWN_CONNECTION("KO: The given id doesn't represent an open connection");
+
 
 namespace collect_agent {
 
@@ -93,13 +101,40 @@ bool register_collect(
     int log_facility,
     bool _new) {
   // Get the ids
-  job_name = getenv("JOB_NAME");
+  return register_collect_as(
+      config_file,
+      getenv("JOB_NAME"),
+      from_env("JOB_INSTANCE_ID", 0),
+      from_env("SCENARIO_INSTANCE_ID", 0),
+      from_env("OWNER_SCENARIO_INSTANCE_ID", 0),
+      log_option,
+      log_facility,
+      _new);
+}
+
+/*
+ * Same as register_collect but using the given ids
+ * instead of the ones found in the environment.
+ */
+bool register_collect_as(
+    const std::string& config_file,
+    const std::string& name,
+    unsigned int instance_id,
+    unsigned int scenario_id,
+    unsigned int owner_scenario_id,
+    int log_option,
+    int log_facility,
+    bool _new) {
+  registered_config_file = config_file;
+  registered_log_option = log_option;
+  registered_log_facility = log_facility;
+  job_name = name;
   if (job_name.empty()) {
     job_name = "job_debug";
   }
-  job_instance_id = from_env("JOB_INSTANCE_ID", 0);
-  scenario_instance_id = from_env("SCENARIO_INSTANCE_ID", 0);
-  owner_scenario_instance_id = from_env("OWNER_SCENARIO_INSTANCE_ID", 0);
+  job_instance_id = instance_id;
+  scenario_instance_id = scenario_id;
+  owner_scenario_instance_id = owner_scenario_id;
   std::ifstream agent_name_file;
   
   agent_name_file.open("/opt/openbach/agent/agent_name");
@@ -151,6 +186,7 @@ read:
       send_log(LOG_NOTICE, "NOTICE: Connexion ID is %d", id);
     }
     rstats_connection_id = id;
+    registered = true;
     return true;
   } else if (startswith == "KO") {
     send_log(LOG_ERR, "ERROR: Something went wrong");
@@ -159,6 +195,7 @@ read:
   }
 
   rstats_connection_id = 0;
+  registered = false;
   send_log(LOG_ERR, "\t%s", result.c_str());
   return false;
 }
@@ -202,56 +239,65 @@ void send_log(
 }
 
 /*
- * Create the message to generate a new statistic;
- * send it to the RStats service and propagate its response.
+ * Register again, with the parameters of the last registration,
+ * after RStats closed the connection `connection_id`; unless it
+ * was done already. Return whether a new connection is available.
  */
-std::string send_stat(
-    long long timestamp,
-    const std::unordered_map<std::string, std::string>& stats,
-    const std::string& suffix) {
-  // Format the message
-  std::stringstream command;
-  command << "2 " << rstats_connection_id << " " << timestamp;
-
-  for (auto& stat : stats) {
-    command << " \"" << stat.first << "\" \"" << stat.second << "\"";
-  }
-  if (suffix != "") {
-    command << " " << suffix;
+bool register_again(unsigned int connection_id) {
+  if (!registered) {
+    return false;
   }
-
-  // Send the message and propagate RStats response
-  try {
-    return rstats_messager(command.str());
-  } catch (std::exception& e) {
-    std::string msg = "KO Failed to send statistic to rstats: ";
-    msg += e.what();
-    send_log(LOG_ERR, "%s", msg.c_str());
-    return msg;
+  if (rstats_connection_id != connection_id) {
+    return true;
   }
+  return register_collect_as(
+      registered_config_file,
+      job_name,
+      job_instance_id,
+      scenario_instance_id,
+      owner_scenario_instance_id,
+      registered_log_option,
+      registered_log_facility,
+      false);
 }
 
 /*
- * Helper function that mimics `send_stat` functionality with
- * statistics values already formatted.
+ * Format the message to generate a new statistic.
  */
-std::string send_prepared_stat(
+std::string format_stat(
+    unsigned int connection_id,
     long long timestamp,
     const std::string& suffix,
     const std::string& stat_values) {
-  // Format the message
   std::stringstream command;
-  command << "2 " << rstats_connection_id << " " << timestamp;
+  command << "2 " << connection_id << " " << timestamp;
   if (stat_values != "") {
     command << " " << stat_values;
   }
   if (suffix != "") {
     command << " " << suffix;
   }
+  return command.str();
+}
+
+/*
+ * Helper function that mimics `send_stat` functionality with
+ * statistics values already formatted. Register again and send
+ * the statistic once more if RStats closed the connection.
+ */
+std::string send_prepared_stat(
+    long long timestamp,
+    const std::string& suffix,
+    const std::string& stat_values) {
+  unsigned int connection_id = rstats_connection_id;
 
   // Send the message and propagate RStats response
   try {
-    return rstats_messager(command.str());
+    std::string response = rstats_messager(format_stat(connection_id, timestamp, suffix, stat_values));
+    if (!response.compare(0, UNKNOWN_CONNECTION.size(), UNKNOWN_CONNECTION) && register_again(connection_id)) {
+      response = rstats_messager(format_stat(rstats_connection_id, timestamp, suffix, stat_values));
+    }
+    return response;
   } catch (std::exception& e) {
     std::string msg = "KO Failed to send statistic to rstats: ";
     msg += e.what();
@@ -260,6 +306,28 @@ std::string send_prepared_stat(
   }
 }
 
+/*
+ * Create the message to generate a new statistic;
+ * send it to the RStats service and propagate its response.
+ */
+std::string send_stat(
+    long long timestamp,
+    const std::unordered_map<std::string, std::string>& stats,
+    const std::string& suffix) {
+  // Format the values
+  std::stringstream values;
+  bool first = true;
+  for (auto& stat : stats) {
+    if (!first) {
+      values << " ";
+    }
+    values << "\"" << stat.first << "\" \"" << stat.second << "\"";
+    first = false;
+  }
+
+  return send_prepared_stat(timestamp, suffix, values.str());
+}
+
 /*
  * Create the message to reload a job configuration;
  * send it to the RStats service and propagate its response.
@@ -361,6 +429,23 @@ unsigned int collect_agent_register_collect(
   return collect_agent::register_collect(config_file, log_option, log_facility, _new);
 }
 
+/*
+ * Maps C interface to C++ call.
+ */
+unsigned int collect_agent_register_collect_as(
+    char* config_file,
+    char* job_name,
+    unsigned int job_instance_id,
+    unsigned int scenario_instance_id,
+    unsigned int owner_scenario_instance_id,
+    int log_option,
+    int log_facility,
+    bool _new) {
+  return collect_agent::register_collect_as(
+      config_file, job_name, job_instance_id, scenario_instance_id,
+      owner_scenario_instance_id, log_option, log_facility, _new);
+}
+
 /*
  * Maps C interface to C++ call.
  */
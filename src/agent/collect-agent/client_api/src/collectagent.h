@@ -68,6 +68,21 @@ namespace collect_agent {
       int log_facility=LOG_USER,
       bool _new=false);
 
+  /*
+   * Same as register_collect but using the given
+   * job name and ids instead of the ones found in
+   * the environment.
+   */
+  DLL_PUBLIC bool register_collect_as(
+      const std::string& config_file,
+      const std::string& job_name,
+      unsigned int job_instance_id,
+      unsigned int scenario_instance_id,
+      unsigned int owner_scenario_instance_id,
+      int log_option=LOG_PID,
+      int log_facility=LOG_USER,
+      bool _new=false);
+
   /*
    * Send the log
    */
@@ -129,6 +144,15 @@ extern "C" DLL_PUBLIC unsigned int collect_agent_register_collect(
   int log_option=LOG_PID,
   int log_facility=LOG_USER,
   bool _new=false);
+extern "C" DLL_PUBLIC unsigned int collect_agent_register_collect_as(
+  char* config_file,
+  char* job_name,
+  unsigned int job_instance_id,
+  unsigned int scenario_instance_id,
+  unsigned int owner_scenario_instance_id,
+  int log_option=LOG_PID,
+  int log_facility=LOG_USER,
+  bool _new=false);
 extern "C" DLL_PUBLIC void collect_agent_send_log(
   int priority,
   const char* log,
@@ -30,6 +30,9 @@
 """Collect-Agent API"""
 
 
+from __future__ import division
+
+
 __author__ = 'Viveris Technologies'
 __credits__ = '''Contributors:
  * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
@@ -37,12 +40,79 @@ __credits__ = '''Contributors:
 
 
 import os
+import re
+import math
+import mmap
+import time
+import atexit
 import ctypes
+import signal
+import socket
+import struct
+import numbers
+import tempfile
+import threading
+import collections
 try:
     from shlex import quote
 except ImportError:
     from pipes import quote
 
+from collect_agent_quantile import P2Quantile
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+
+RSTATS_ADDRESS = ('127.0.0.1', 1111)
+RSTATS_RESPONSE_SIZE = 2048
+RSTATS_MAX_PACKET_SIZE = 2**14
+# Response of RStats to a request on an evicted connection
+_UNKNOWN_CONNECTION = "KO: The given id doesn't represent an open connection"
+
+BINARY_PROTOCOL_VERSION = 2
+# Oldest version of the binary protocol understanding each request
+_SEND_STAT_VERSION = 1
+_SEND_STATS_VERSION = 2
+_BINARY_HEADER = struct.Struct('!cBB')
+_BINARY_CONNECTION_ID = struct.Struct('!I')
+_BINARY_SEND_STAT = struct.Struct('!IqH')
+_BINARY_SEND_STATS = struct.Struct('!IH')
+_BINARY_SAMPLE = struct.Struct('!qH')
+_BINARY_MAX_SAMPLES = 2**16 - 1
+_BINARY_STRING_LENGTH = struct.Struct('!H')
+_BINARY_INTEGER = struct.Struct('!Bq')
+_BINARY_FLOAT = struct.Struct('!Bd')
+_BINARY_BOOLEAN = struct.Struct('!B?')
+_BINARY_TYPE = struct.Struct('!B')
+_BINARY_TYPE_INTEGER = 1
+_BINARY_TYPE_FLOAT = 2
+_BINARY_TYPE_BOOLEAN = 3
+_BINARY_TYPE_STRING = 4
+_INTEGER_RANGE = (-2**63, 2**63)
+_ENCODED_NAMES_CACHE_SIZE = 1024
+
+BUFFER_POLICIES = ('block', 'drop-oldest', 'drop-newest')
+BUFFER_FLUSH_INTERVAL = 0.1
+BUFFER_FLUSH_SIZE = 1024
+BUFFER_EXIT_TIMEOUT = 5
+
+SUMMARY_FUNCTIONS = ('mean', 'min', 'max', 'stddev', 'jitter')
+_QUANTILE_PATTERN = re.compile(r'^p(\d{1,2}(?:\.\d+)?)$')
+
+RING_BUFFER_FOLDER = '/dev/shm'
+_RING_MAGIC = b'OBRB'
+_RING_VERSION = 1
+_RING_HEADER = struct.Struct('=4sB3xQ')
+_RING_HEAD_OFFSET = 16
+_RING_TAIL_OFFSET = 24
+_RING_OVERFLOWS_OFFSET = 32
+_RING_CLOSED_OFFSET = 40
+_RING_DATA_OFFSET = 64
+_RING_RECORD_LENGTH = struct.Struct('=I')
+
 
 try:
     library = ctypes.cdll.LoadLibrary('libcollectagent.so')
@@ -54,6 +124,12 @@ _register_collect = library.collect_agent_register_collect
 _register_collect.restype = ctypes.c_bool
 _register_collect.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_int, ctypes.c_bool]
 
+_register_collect_as = library.collect_agent_register_collect_as
+_register_collect_as.restype = ctypes.c_bool
+_register_collect_as.argtypes = [
+        ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint, ctypes.c_uint,
+        ctypes.c_uint, ctypes.c_int, ctypes.c_int, ctypes.c_bool]
+
 _send_log = library.collect_agent_send_log
 _send_log.restype = ctypes.c_void_p
 _send_log.argtypes = [ctypes.c_int, ctypes.c_char_p]
@@ -78,13 +154,473 @@ _change_config = library.collect_agent_change_config
 _change_config.restype = ctypes.c_char_p
 _change_config.argtypes = [ctypes.c_bool, ctypes.c_bool]
 
+_connection_id = ctypes.c_uint.in_dll(library, 'rstats_connection_id')
+
+_rstats_sockets = threading.local()
+_protocol_version = 0
+_ring_buffer = None
+_stats_buffer = None
+_encoded_names = {}
+_registration = None
+_registration_lock = threading.Lock()
+
+
+def _rstats_messager(message):
+    """Send a raw message to the local RStats relay and
+    return its response.
+    """
+    try:
+        sock = _rstats_sockets.socket
+    except AttributeError:
+        sock = _rstats_sockets.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.sendto(message, RSTATS_ADDRESS)
+    response = sock.recv(RSTATS_RESPONSE_SIZE)
+    return response.split(b'\0', 1)[0].decode(errors='replace')
+
+
+def _negotiate_protocol():
+    """Ask the RStats relay which version of the binary
+    protocol can be used; fall back on the text protocol
+    if it does not understand the request.
+    """
+    global _protocol_version
+    _protocol_version = 0
+    try:
+        response = _rstats_messager('8 {}'.format(BINARY_PROTOCOL_VERSION).encode())
+    except socket.error:
+        return
+    status, _, version = response.partition(' ')
+    if status == 'OK':
+        try:
+            _protocol_version = int(version)
+        except ValueError:
+            pass
+
+
+def _encode_string(value):
+    if not isinstance(value, bytes):
+        value = text_type(value).encode('utf-8')
+    return _BINARY_STRING_LENGTH.pack(len(value)) + value
+
+
+def _encode_value(value):
+    # Fast path for the most common types before costlier ABC checks
+    value_type = type(value)
+    if value_type is float:
+        return _BINARY_FLOAT.pack(_BINARY_TYPE_FLOAT, value)
+    if value_type is int and _INTEGER_RANGE[0] <= value < _INTEGER_RANGE[1]:
+        return _BINARY_INTEGER.pack(_BINARY_TYPE_INTEGER, value)
+    if value_type is bool:
+        return _BINARY_BOOLEAN.pack(_BINARY_TYPE_BOOLEAN, value)
+    if isinstance(value, numbers.Integral):
+        if _INTEGER_RANGE[0] <= value < _INTEGER_RANGE[1]:
+            return _BINARY_INTEGER.pack(_BINARY_TYPE_INTEGER, value)
+    elif isinstance(value, numbers.Real):
+        return _BINARY_FLOAT.pack(_BINARY_TYPE_FLOAT, value)
+    return _BINARY_TYPE.pack(_BINARY_TYPE_STRING) + _encode_string(value)
+
+
+def _encode_name(name):
+    try:
+        return _encoded_names[name]
+    except KeyError:
+        encoded = _encode_string(name)
+        if len(_encoded_names) < _ENCODED_NAMES_CACHE_SIZE:
+            _encoded_names[name] = encoded
+        return encoded
+
+
+def _encode_stat_payload(connection_id, timestamp, suffix, stats):
+    fields = [_encode_name(name) + _encode_value(value) for name, value in stats.items()]
+    return b''.join([
+        _BINARY_SEND_STAT.pack(connection_id, int(timestamp), len(fields)),
+        _encode_name(suffix or ''),
+    ] + fields)
+
+
+def _encode_sample(timestamp, suffix, stats):
+    fields = [_encode_name(name) + _encode_value(value) for name, value in stats.items()]
+    return b''.join([
+        _BINARY_SAMPLE.pack(int(timestamp), len(fields)),
+        _encode_name(suffix or ''),
+    ] + fields)
+
+
+def encode_stat(connection_id, timestamp, suffix, stats):
+    """Build a send_stat request using the binary framing
+    understood by RStats.
+
+    Numbers and booleans are sent as typed fields, any other
+    value is sent as text and parsed by RStats.
+    """
+    header = _BINARY_HEADER.pack(b'\0', _SEND_STAT_VERSION, 2)
+    return header + _encode_stat_payload(connection_id, timestamp, suffix, stats)
+
+
+def encode_stats(connection_id, samples, max_size=RSTATS_MAX_PACKET_SIZE):
+    """Generate send_stats requests, using the binary framing
+    understood by RStats, holding as many of the given samples as
+    fit in `max_size` bytes.
+
+    Samples are `(timestamp, suffix, stats)` tuples; a sample too
+    big to fit in a request on its own is generated as is, in place
+    of a request, for the caller to send it separately.
+    """
+    header = _BINARY_HEADER.pack(b'\0', _SEND_STATS_VERSION, 13)
+    available = max_size - len(header) - _BINARY_SEND_STATS.size
+    encoded = []
+    size = 0
+    for sample in samples:
+        payload = _encode_sample(*sample)
+        if len(payload) > available:
+            yield sample
+            continue
+        if size + len(payload) > available or len(encoded) == _BINARY_MAX_SAMPLES:
+            yield header + _BINARY_SEND_STATS.pack(connection_id, len(encoded)) + b''.join(encoded)
+            encoded = []
+            size = 0
+        encoded.append(payload)
+        size += len(payload)
+    if encoded:
+        yield header + _BINARY_SEND_STATS.pack(connection_id, len(encoded)) + b''.join(encoded)
+
+
+class _RingBuffer(object):
+    """Producer side of a ring buffer shared with RStats.
+
+    See the shared_memory module of RStats for the layout of the
+    file. Records are written without any system call; RStats
+    periodically reads them in batches.
+    """
+
+    def __init__(self, capacity):
+        fd, self.path = tempfile.mkstemp(prefix='openbach_rstats_', dir=RING_BUFFER_FOLDER)
+        try:
+            # RStats may run as a different user than the job
+            os.fchmod(fd, 0o666)
+            os.ftruncate(fd, _RING_DATA_OFFSET + capacity)
+            self.buffer = mmap.mmap(fd, _RING_DATA_OFFSET + capacity)
+        except Exception:
+            os.unlink(self.path)
+            raise
+        finally:
+            os.close(fd)
+        _RING_HEADER.pack_into(self.buffer, 0, _RING_MAGIC, _RING_VERSION, capacity)
+        self.capacity = capacity
+        self.mutex = threading.Lock()
+        self.detached = False
+        # Aligned 64 bits integers are read and written in one access
+        self.head = ctypes.c_uint64.from_buffer(self.buffer, _RING_HEAD_OFFSET)
+        self.tail = ctypes.c_uint64.from_buffer(self.buffer, _RING_TAIL_OFFSET)
+        self.overflows = ctypes.c_uint64.from_buffer(self.buffer, _RING_OVERFLOWS_OFFSET)
+        self.closed = ctypes.c_uint64.from_buffer(self.buffer, _RING_CLOSED_OFFSET)
+
+    def write(self, payload):
+        """Append a record to the ring buffer. Return False if
+        there is not enough room for it or if RStats stopped
+        reading the ring buffer.
+        """
+        record = _RING_RECORD_LENGTH.pack(len(payload)) + payload
+        size = len(record)
+        with self.mutex:
+            if self.detached or self.closed.value:
+                return False
+            head = self.head.value
+            if size > self.capacity - (head - self.tail.value):
+                self.overflows.value += 1
+                return False
+            start = head % self.capacity + _RING_DATA_OFFSET
+            end = start + size
+            data_end = _RING_DATA_OFFSET + self.capacity
+            if end <= data_end:
+                self.buffer[start:end] = record
+            else:
+                split = data_end - start
+                self.buffer[start:data_end] = record[:split]
+                self.buffer[_RING_DATA_OFFSET:end - self.capacity] = record[split:]
+            # Publish the record only once it is fully written
+            self.head.value = head + size
+        return True
+
+    def unlink(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def close(self):
+        with self.mutex:
+            self.detached = True
+            del self.head, self.tail, self.overflows, self.closed
+            self.buffer.close()
+        self.unlink()
+
+
+def _attach_ring_buffer(capacity):
+    """Create a ring buffer and ask RStats to read statistics
+    from it. Statistics are sent through the usual socket if
+    anything goes wrong.
+    """
+    global _ring_buffer
+    _detach_ring_buffer()
+    if not _protocol_version:
+        return
+    try:
+        ring = _RingBuffer(capacity)
+    except (OSError, ValueError, mmap.error):
+        return
+    try:
+        message = '12 {} {}'.format(_connection_id.value, quote(ring.path)).encode()
+        response = _rstats_messager(message)
+    except socket.error:
+        response = 'KO'
+    # RStats has mapped the file already, it is not needed anymore
+    ring.unlink()
+    if response.startswith('OK'):
+        _ring_buffer = ring
+    else:
+        ring.close()
+
+
+def _detach_ring_buffer():
+    global _ring_buffer
+    if _ring_buffer is not None:
+        _ring_buffer.close()
+        _ring_buffer = None
+
+
+class _StatsBuffer(threading.Thread):
+    """Bounded queue of statistics sent to RStats in
+    batches by a background thread.
+
+    When the queue is full, `policy` tells whether to wait for
+    room ('block'), to discard the oldest queued statistic
+    ('drop-oldest') or to discard the new one ('drop-newest').
+    """
+
+    def __init__(self, size, policy, interval=BUFFER_FLUSH_INTERVAL):
+        if policy not in BUFFER_POLICIES:
+            raise ValueError('unknown buffer policy: {}'.format(policy))
+        threading.Thread.__init__(self, name='collect_agent_flusher')
+        self.daemon = True
+        self.size = size
+        self.policy = policy
+        self.interval = interval
+        self.samples = collections.deque()
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.errors = 0
+        self.stopped = False
+
+    def put(self, sample):
+        with self.condition:
+            if len(self.samples) >= self.size:
+                if self.policy == 'drop-newest':
+                    self.dropped += 1
+                    return False
+                if self.policy == 'drop-oldest':
+                    self.samples.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self.samples) >= self.size and not self.stopped:
+                        self.condition.wait()
+            self.samples.append(sample)
+            if len(self.samples) >= BUFFER_FLUSH_SIZE:
+                self.condition.notify_all()
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.samples and not self.stopped:
+                    self.condition.wait(self.interval)
+                if not self.samples:
+                    if self.stopped:
+                        return
+                    continue
+                amount = min(len(self.samples), BUFFER_FLUSH_SIZE)
+                batch = [self.samples.popleft() for _ in range(amount)]
+                self.in_flight = amount
+                # Make room for blocked producers
+                self.condition.notify_all()
+
+            try:
+                response, failed = _send_stats_now(batch)
+            except Exception as e:
+                response, failed = 'KO {}'.format(e), amount
+
+            with self.condition:
+                self.in_flight = 0
+                self.sent += amount - failed
+                self.failed += failed
+                if not response.startswith('OK'):
+                    self.errors += 1
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until every queued statistic has been sent.
+        Return False if `timeout` seconds elapsed before.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            self.condition.notify_all()
+            while (self.samples or self.in_flight) and self.is_alive():
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return not self.samples
+
+    def stop(self, timeout=None):
+        flushed = self.flush(timeout)
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        return flushed
 
-def register_collect(config_file, log_option=0x01, log_facility=1<<3, new=False):
-    return _register_collect(
-            config_file.encode(),
-            log_option,
-            log_facility,
-            new)
+
+def _start_buffering(size, policy):
+    global _stats_buffer
+    _stop_buffering()
+    stats_buffer = _StatsBuffer(size, policy)
+    stats_buffer.start()
+    _stats_buffer = stats_buffer
+    _install_sigterm_handler()
+
+
+def _stop_buffering(timeout=None):
+    global _stats_buffer
+    stats_buffer, _stats_buffer = _stats_buffer, None
+    if stats_buffer is not None:
+        stats_buffer.stop(timeout)
+
+
+@atexit.register
+def _flush_at_exit():
+    _stop_buffering(BUFFER_EXIT_TIMEOUT)
+
+
+def _sigterm_handler(signum, frame):
+    _stop_buffering(BUFFER_EXIT_TIMEOUT)
+    # Terminate the way the job would have without buffering
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def _install_sigterm_handler():
+    """Flush queued statistics when the job is terminated,
+    unless it handles SIGTERM by itself; exiting cleanly from
+    its own handler flushes them anyway.
+    """
+    try:
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, _sigterm_handler)
+    except ValueError:
+        # Not in the main thread
+        pass
+
+
+def register_collect(
+        config_file, log_option=0x01, log_facility=1<<3, new=False,
+        ring_buffer_size=0, buffer_size=0, buffer_policy='block',
+        job_name=None, job_instance_id=0, scenario_instance_id=0,
+        owner_scenario_instance_id=0):
+    """Register the job to RStats.
+
+    The job is identified by the JOB_NAME, JOB_INSTANCE_ID,
+    SCENARIO_INSTANCE_ID and OWNER_SCENARIO_INSTANCE_ID environment
+    variables set by the agent, unless `job_name` is provided: the
+    given IDs are then used instead, which lets a process register
+    on behalf of another job without touching its environment.
+
+    If `ring_buffer_size` is not 0, statistics are written into a
+    shared memory ring buffer of this many bytes instead of being
+    sent one by one through a socket; suited to jobs sending several
+    thousands of statistics per second. The socket is still used
+    whenever the ring buffer is full.
+
+    If `buffer_size` is not 0, `send_stat` and `send_stats` do not
+    wait for RStats anymore: statistics are queued, up to this
+    many, and sent in batches by a background thread. See
+    `_StatsBuffer` for the values of `buffer_policy`. Queued
+    statistics are sent when calling `flush`, when registering
+    again or removing the connection, and when the job exits.
+
+    Should RStats close the connection, for instance because the
+    job stayed quiet for too long, the job is registered again, with
+    the same parameters, the next time it sends statistics.
+    """
+    global _registration
+    if buffer_size and buffer_policy not in BUFFER_POLICIES:
+        raise ValueError('unknown buffer policy: {}'.format(buffer_policy))
+    # Queued statistics belong to the previous connection
+    _stop_buffering()
+    if job_name is None:
+        identity = None
+    else:
+        identity = (
+                job_name.encode(),
+                int(job_instance_id),
+                int(scenario_instance_id),
+                int(owner_scenario_instance_id))
+    with _registration_lock:
+        _registration = (config_file.encode(), log_option, log_facility, identity, ring_buffer_size)
+        registered = _register(new)
+    if registered and buffer_size:
+        _start_buffering(buffer_size, buffer_policy)
+    return registered
+
+
+def _register(new):
+    """Open the connection described by the last call to
+    `register_collect`. Must be called with the registration
+    lock held.
+    """
+    config_file, log_option, log_facility, identity, ring_buffer_size = _registration
+    if identity is None:
+        registered = _register_collect(config_file, log_option, log_facility, new)
+    else:
+        arguments = (config_file,) + identity + (log_option, log_facility, new)
+        registered = _register_collect_as(*arguments)
+    if registered:
+        _negotiate_protocol()
+        if ring_buffer_size:
+            _attach_ring_buffer(ring_buffer_size)
+        else:
+            _detach_ring_buffer()
+    return registered
+
+
+def _register_again(connection_id):
+    """Open a new connection after RStats closed `connection_id`,
+    unless another thread already did. Return whether a new
+    connection is available.
+    """
+    with _registration_lock:
+        if _registration is None:
+            return False
+        if _connection_id.value != connection_id:
+            return True
+        return _register(False)
+
+
+def _send_binary(message):
+    """Send a binary request to RStats. If RStats closed the
+    connection, register again and send the request once more
+    with the new connection ID.
+    """
+    response = _rstats_messager(message)
+    if response.startswith(_UNKNOWN_CONNECTION):
+        offset = _BINARY_HEADER.size
+        connection_id, = _BINARY_CONNECTION_ID.unpack_from(message, offset)
+        if _register_again(connection_id):
+            connection_id = _BINARY_CONNECTION_ID.pack(_connection_id.value)
+            message = message[:offset] + connection_id + message[offset + _BINARY_CONNECTION_ID.size:]
+            response = _rstats_messager(message)
+    return response
 
 
 def send_log(priority, log):
@@ -92,19 +628,140 @@ def send_log(priority, log):
 
 
 def send_stat(timestamp, suffix=None, **kwargs):
+    stats_buffer = _stats_buffer
+    if stats_buffer is not None:
+        if stats_buffer.put((timestamp, suffix, kwargs)):
+            return 'OK'
+        return 'KO Statistic dropped: buffer full'
+    return _send_stat_now(timestamp, suffix, kwargs)
+
+
+def _send_stat_now(timestamp, suffix, stats):
+    ring = _ring_buffer
+    if ring is not None:
+        payload = _encode_stat_payload(_connection_id.value, timestamp, suffix, stats)
+        if ring.write(payload):
+            return 'OK'
+        message = _BINARY_HEADER.pack(b'\0', _SEND_STAT_VERSION, 2) + payload
+        try:
+            return _send_binary(message)
+        except socket.error as e:
+            return 'KO Failed to send statistic to rstats: {}'.format(e)
+
+    if _protocol_version:
+        message = encode_stat(_connection_id.value, timestamp, suffix, stats)
+        try:
+            return _send_binary(message)
+        except socket.error as e:
+            return 'KO Failed to send statistic to rstats: {}'.format(e)
+
     if suffix is None:
         suffix = ''
-    stats = ' '.join(quote(str(value)) for item in kwargs.items() for value in item)
+    stats = ' '.join(quote(str(value)) for item in stats.items() for value in item)
     response = _send_stat(timestamp, quote(suffix).encode(), stats.encode())
     return response.decode(errors='replace')
 
 
+def send_stats(samples):
+    """Send several statistics at once.
+
+    `samples` is an iterable of `(timestamp, suffix, stats)` tuples
+    where `stats` is a dictionary mapping statistics names to their
+    values. Samples are packed into as few requests as possible, which
+    is much cheaper than calling `send_stat` for each of them when
+    replaying or bulk-generating statistics.
+
+    Return 'OK' if every sample was accepted by RStats, the
+    first error reported otherwise. RStats accepts or rejects each
+    request as a whole: when a sample is invalid (e.g. a timestamp
+    in seconds), none of the samples of its request are forwarded.
+    Samples are only split across several requests when they do not
+    fit in a single one, or when they are sent one by one (shared
+    memory transport or older RStats); in that case a KO only tells
+    that some of the samples were not forwarded.
+    """
+    stats_buffer = _stats_buffer
+    if stats_buffer is not None:
+        dropped = sum(not stats_buffer.put(sample) for sample in samples)
+        if dropped:
+            return 'KO {} statistics dropped: buffer full'.format(dropped)
+        return 'OK'
+    response, _ = _send_stats_now(samples)
+    return response
+
+
+def _send_stats_now(samples):
+    """Send the samples to RStats. Return the first error
+    reported, or 'OK', and the amount of samples rejected.
+    """
+    response = 'OK'
+    failed = 0
+
+    def _check(status, amount=1):
+        if status.startswith('OK'):
+            return response, failed
+        if response == 'OK':
+            return status, failed + amount
+        return response, failed + amount
+
+    if _ring_buffer is not None or _protocol_version < _SEND_STATS_VERSION:
+        for timestamp, suffix, stats in samples:
+            response, failed = _check(_send_stat_now(timestamp, suffix, stats))
+        return response, failed
+
+    for message in encode_stats(_connection_id.value, samples):
+        if isinstance(message, tuple):
+            response, failed = _check(_send_stat_now(*message))
+            continue
+        # RStats accepts or rejects the samples of a request as a whole
+        _, amount = _BINARY_SEND_STATS.unpack_from(message, _BINARY_HEADER.size)
+        try:
+            response, failed = _check(_send_binary(message), amount)
+        except socket.error as e:
+            response, failed = _check('KO Failed to send statistics to rstats: {}'.format(e), amount)
+    return response, failed
+
+
+def flush(timeout=None):
+    """Wait until the statistics queued by a buffered client
+    are sent to RStats. Return False if `timeout` seconds
+    elapsed before.
+    """
+    stats_buffer = _stats_buffer
+    if stats_buffer is None:
+        return True
+    return stats_buffer.flush(timeout)
+
+
+def buffer_statistics():
+    """Counters of the buffered client: statistics currently
+    queued, accepted by RStats, dropped because the buffer was
+    full and rejected by RStats (or not delivered), and batches
+    that were not fully accepted.
+    """
+    stats_buffer = _stats_buffer
+    if stats_buffer is None:
+        return {'queued': 0, 'sent': 0, 'dropped': 0, 'failed': 0, 'errors': 0}
+    with stats_buffer.condition:
+        return {
+                'queued': len(stats_buffer.samples) + stats_buffer.in_flight,
+                'sent': stats_buffer.sent,
+                'dropped': stats_buffer.dropped,
+                'failed': stats_buffer.failed,
+                'errors': stats_buffer.errors,
+        }
+
+
 def reload_stat():
     return _reload_stat().decode(errors='replace')
 
 
 def remove_stat():
-    return _remove_stat().decode(errors='replace')
+    _stop_buffering()
+    response = _remove_stat().decode(errors='replace')
+    # RStats drained the ring buffer before closing the connection
+    _detach_ring_buffer()
+    return response
 
 
 def reload_all_stats():
@@ -113,3 +770,142 @@ def reload_all_stats():
 
 def change_config(storage, broadcast):
     return _change_config(storage, broadcast).decode(errors='replace')
+
+
+def reload_job_stats(job_name):
+    message = '9 {}'.format(quote(job_name)).encode()
+    try:
+        return _rstats_messager(message)
+    except socket.error as e:
+        return 'KO Failed to reload statistics: {}'.format(e)
+
+
+class StatsAggregator(object):
+    """Summarize the values of a statistic over windows and send
+    the summary through `send_stat` each time a window closes,
+    instead of sending every raw value.
+
+    A window closes after `count` values or, when `period` (in
+    seconds) is given, once a value falls past the end of the
+    window, windows being aligned on multiples of `period`. With
+    neither, the window only closes when calling `flush`.
+
+    `functions` lists the summaries to compute among 'count',
+    'mean', 'min', 'max', 'stddev', 'jitter' (mean absolute
+    difference between consecutive values) and quantiles such as
+    'p50' or 'p99', estimated in constant memory. Summaries are sent
+    as `<name>_<function>` unless `names` maps the function to
+    another statistic name.
+
+    Values can be added from several threads.
+    """
+
+    def __init__(self, name, count=None, period=None,
+                 functions=SUMMARY_FUNCTIONS, suffix=None, names=None):
+        self.name = name
+        self.count = count
+        self.period = None if period is None else int(period * 1000)
+        self.functions = tuple(functions)
+        self.suffix = suffix
+        self.names = {
+                function: '{}_{}'.format(name, function)
+                for function in self.functions
+        }
+        if names:
+            self.names.update(names)
+        self.quantiles = {}
+        for function in self.functions:
+            match = _QUANTILE_PATTERN.match(function)
+            if match is not None:
+                self.quantiles[function] = float(match.group(1)) / 100
+            elif function not in SUMMARY_FUNCTIONS and function != 'count':
+                raise ValueError('unknown summary function: {}'.format(function))
+        self._mutex = threading.Lock()
+        self._previous = None
+        self._reset()
+
+    def _reset(self):
+        self._values = 0
+        self._mean = 0
+        self._squares = 0
+        self._minimum = None
+        self._maximum = None
+        self._variations = 0
+        self._variation = 0
+        self._window_end = None
+        self._last_timestamp = None
+        self._sketches = {
+                function: P2Quantile(quantile)
+                for function, quantile in self.quantiles.items()
+        }
+
+    def add(self, value, timestamp=None):
+        """Account for a new value measured at `timestamp` (in ms,
+        defaults to now), sending the summaries of the windows it
+        closes.
+        """
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        summaries = []
+        with self._mutex:
+            if self._window_end is not None and timestamp >= self._window_end:
+                summaries.append(self._close())
+            if self.period and not self._values:
+                self._window_end = timestamp - timestamp % self.period + self.period
+
+            # Welford's online mean and variance
+            self._values += 1
+            delta = value - self._mean
+            self._mean += delta / self._values
+            self._squares += delta * (value - self._mean)
+            if self._minimum is None or value < self._minimum:
+                self._minimum = value
+            if self._maximum is None or value > self._maximum:
+                self._maximum = value
+            if self._previous is not None:
+                self._variations += 1
+                self._variation += abs(value - self._previous)
+            self._previous = value
+            for sketch in self._sketches.values():
+                sketch.add(value)
+            self._last_timestamp = timestamp
+
+            if self.count and self._values >= self.count:
+                summaries.append(self._close())
+
+        for timestamp, summary in summaries:
+            self._send(timestamp, summary)
+
+    def flush(self, timestamp=None):
+        """Close the current window, if it holds any value, and send
+        its summary, timestamped with its last value by default.
+        """
+        with self._mutex:
+            if not self._values:
+                return
+            last_timestamp, summary = self._close()
+        self._send(last_timestamp if timestamp is None else timestamp, summary)
+
+    def _close(self):
+        values = {
+                'count': self._values,
+                'mean': self._mean,
+                'min': self._minimum,
+                'max': self._maximum,
+                'stddev': math.sqrt(self._squares / self._values),
+                'jitter': self._variation / self._variations if self._variations else None,
+        }
+        for function, sketch in self._sketches.items():
+            values[function] = sketch.value
+        summary = {
+                self.names[function]: values[function]
+                for function in self.functions
+                if values[function] is not None
+        }
+        timestamp = self._last_timestamp
+        self._reset()
+        return timestamp, summary
+
+    def _send(self, timestamp, summary):
+        if summary:
+            send_stat(timestamp, suffix=self.suffix, **summary)
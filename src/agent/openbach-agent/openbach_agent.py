@@ -38,16 +38,24 @@ __credits__ = '''Contributors:
 
 import os
 import sys
+import copy
+import zlib
+import json
 import time
+import queue
 import shlex
+import socket
 import struct
 import signal
+import argparse
 import threading
 import platform
 import socketserver
 from datetime import datetime
-from subprocess import DEVNULL
-from contextlib import suppress, contextmanager
+from functools import lru_cache
+from subprocess import DEVNULL, PIPE
+from collections import OrderedDict
+from contextlib import suppress
 from distutils.version import StrictVersion
 
 import yaml
@@ -56,19 +64,51 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.base import JobLookupError, ConflictingIdError
 from apscheduler.triggers.interval import IntervalTrigger
 
+try:
+    import collect_agent
+except (ImportError, OSError):
+    # Resources accounting is not available without it
+    collect_agent = None
+
 try:
     # Try importing unix stuff
     import syslog
     OS_TYPE = 'linux'
     JOBS_FOLDER = '/opt/openbach/agent/jobs/'
+    JOBS_CACHE_FILE = '/opt/openbach/agent/jobs_cache.json'
+    AGENT_FILTER_FILE = '/opt/openbach/agent/openbach_agent_filter.conf'
     INSTANCES_FOLDER = '/opt/openbach/agent/job_instances/'
 except ImportError:
     # If we failed assume we’re on windows
     import syslog_viveris as syslog
     OS_TYPE = 'windows'
     JOBS_FOLDER = r'C:\openbach\jobs'
+    JOBS_CACHE_FILE = r'C:\openbach\jobs_cache.json'
+    AGENT_FILTER_FILE = r'C:\openbach\openbach_agent_filter.conf'
     INSTANCES_FOLDER = r'C:\openbach\instances'
 
+JOBS_CACHE_VERSION = 1
+JOURNAL_FILENAME = 'scheduling.journal'
+JOURNAL_RECORD_HEADER = struct.Struct('>II')
+JOURNAL_COMPACTION_THRESHOLD = 1000
+SUPERVISOR_POLL_INTERVAL = 5
+NOTIFICATIONS_KEEPALIVE = 10
+NOTIFICATIONS_RETRY_DELAY = 1
+NOTIFICATIONS_MAX_RETRY_DELAY = 60
+CONNECTION_IDLE_TIMEOUT = 60
+PIPELINE_MAX_PENDING = 32
+INSTANCES_HISTORY_SIZE = 1000
+INSTANCES_HISTORY_RETENTION = 24 * 3600
+INSTANCE_STATES = ('scheduled', 'running', 'exited', 'stopped')
+ACTIVE_INSTANCE_STATES = ('scheduled', 'running', 'exited')
+RESOURCES_SAMPLING_INTERVAL = 0
+CGROUP_ROOT = '/sys/fs/cgroup'
+CGROUP_NAME = 'openbach'
+CGROUP_CPU_PERIOD = 100000
+CGROUP_CPU_MIN_QUOTA = 1000
+# Hold the command until its placement is applied
+PLACEMENT_GATE = 'read -r placed && exec "$@" < /dev/null'
+
 
 def signal_term_handler(signal, frame):
     """Stop the Openbach Agent gracefully"""
@@ -82,10 +122,24 @@ def signal_term_handler(signal, frame):
 
 
 class JobManager:
-    """Context manager around job scheduling"""
+    """Context manager around job scheduling.
+
+    Job Instances are kept in a registry indexed by job, by state
+    and by pid. Finished instances (stopped ones and ones started
+    at a given date whose process exited) are moved to a history
+    bounded both in size and in age.
+    """
     __shared_state = {
             'scheduler': None,
             'jobs': {},
+            'instances': {},
+            'history_size': INSTANCES_HISTORY_SIZE,
+            'history_retention': INSTANCES_HISTORY_RETENTION,
+            '_instances_by_job': {},
+            '_instances_by_state': {state: set() for state in INSTANCE_STATES},
+            '_instances_by_pid': {},
+            '_history': OrderedDict(),
+            '_last_instance_id': 0,
             '_mutex': threading.RLock(),
     }
 
@@ -109,12 +163,7 @@ class JobManager:
 
     def has_instance(self, name, instance_id):
         with self._mutex:
-            try:
-                job = self.jobs[name]
-            except KeyError:
-                return False
-            else:
-                return instance_id in job['instances']
+            return (name, instance_id) in self.instances
 
     def add_job(self, name):
         with self._mutex:
@@ -122,9 +171,8 @@ class JobManager:
             try:
                 installed_job = self.jobs[name]
             except KeyError:
-                conf = {'instances': {}}
-                conf.update(new_configuration)
-                self.jobs[name] = conf
+                self.jobs[name] = new_configuration
+                self._instances_by_job.setdefault(name, set())
             else:
                 installed_version = StrictVersion(installed_job['job_version'])
                 new_version = StrictVersion(new_configuration['job_version'])
@@ -139,63 +187,839 @@ class JobManager:
     def pop_job(self, name):
         with self._mutex:
             try:
-                return self.jobs.pop(name)
+                job = self.jobs.pop(name)
             except KeyError:
                 raise BadRequest('OK No job {} is installed'.format(name))
+            for instance_id in self._instances_by_job.pop(name, ()):
+                self._unregister((name, instance_id))
+            return job
 
     def get_job(self, name):
         with self._mutex:
             try:
-                job = self.jobs[name]
+                return dict(self.jobs[name])
             except KeyError:
                 raise BadRequest('KO No job {} is installed'.format(name))
-            return {key: value for key, value in job.items() if key != 'instances'}
 
     def get_instances(self, name):
         with self._mutex:
-            try:
-                job = self.jobs[name]
-            except KeyError:
+            if name not in self.jobs:
                 raise BadRequest('KO No job {} is installed'.format(name))
-            yield from job['instances'].items()
+            return [
+                    (instance_id, self.instances[name, instance_id])
+                    for instance_id in self._instances_by_job[name]
+            ]
+
+    def get_active_instances(self, name=None):
+        """Return the (job name, job instance ID) pairs of the
+        Job Instances not finished yet, of all jobs or of the
+        given one.
+        """
+        with self._mutex:
+            return [
+                    key
+                    for state in ACTIVE_INSTANCE_STATES
+                    for key in self._instances_by_state[state]
+                    if name is None or key[0] == name
+            ]
+
+    def get_instances_in_state(self, state):
+        with self._mutex:
+            return list(self._instances_by_state[state])
+
+    def find_instance(self, pid):
+        """Return the (job name, job instance ID) pair of
+        the Job Instance whose process has the given pid.
+        """
+        with self._mutex:
+            return self._instances_by_pid[pid]
+
+    def _set_state(self, key, state):
+        instance = self.instances[key]
+        self._instances_by_state[instance['state']].discard(key)
+        self._instances_by_state[state].add(key)
+        instance['state'] = state
+
+        finished = state == 'stopped' or (state == 'exited' and instance['type'] == 'date')
+        self._history.pop(key, None)
+        if finished:
+            self._history[key] = time.time()
+            self._trim_history()
+
+    def _unregister(self, key):
+        instance = self.instances.pop(key, None)
+        if instance is None:
+            return
+        name, instance_id = key
+        self._instances_by_job.get(name, set()).discard(instance_id)
+        self._instances_by_state[instance['state']].discard(key)
+        if self._instances_by_pid.get(instance.get('pid')) == key:
+            del self._instances_by_pid[instance['pid']]
+        self._history.pop(key, None)
+
+    def _trim_history(self):
+        oldest = time.time() - self.history_retention
+        while self._history:
+            key, finished = next(iter(self._history.items()))
+            if len(self._history) <= self.history_size and finished >= oldest:
+                break
+            self._unregister(key)
 
     def add_instance(self, name, instance_id, arguments, date_type, date_value):
         with self._mutex:
-            self.jobs[name]['instances'][instance_id] = {
+            key = (name, instance_id)
+            self._unregister(key)
+            self.instances[key] = {
                     'args': arguments,
                     'type': date_type,
                     'date': date_value,
+                    'state': 'scheduled',
             }
+            self._instances_by_job[name].add(instance_id)
+            self._instances_by_state['scheduled'].add(key)
+            with suppress(ValueError):
+                self._last_instance_id = max(self._last_instance_id, int(instance_id))
+            self._trim_history()
+            StateNotifier().notify(name, instance_id, 'scheduled')
 
     def pop_instance(self, name, instance_id):
         with self._mutex:
             instance_infos = self.get_instance(name, instance_id)
-            instance = self.jobs[name]['instances'][instance_id]
-            del instance['pid']
-            del instance['return_code']
+            key = (name, instance_id)
+            instance = self.instances[key]
+            pid = instance.pop('pid', None)
+            instance.pop('return_code', None)
+            if self._instances_by_pid.get(pid) == key:
+                del self._instances_by_pid[pid]
+            self._set_state(key, 'stopped')
             return instance_infos
 
     def get_instance(self, name, instance_id):
         with self._mutex:
             infos = self.get_job(name)
-            infos.update(self.jobs[name]['instances'][instance_id])
+            infos.update(self.instances[name, instance_id])
             return infos
 
     def set_instance_status(self, name, instance_id, pid, return_code=None):
+        """Record that the process `pid` of a Job Instance started,
+        or exited if `return_code` is given. The exit is ignored if
+        the Job Instance was stopped or launched again since.
+        """
         with self._mutex:
-            instance = self.jobs[name]['instances'][instance_id]
-            if return_code is None or 'pid' in instance:
+            key = (name, instance_id)
+            instance = self.instances[key]
+            if return_code is None or instance.get('pid') == pid:
+                if self._instances_by_pid.get(instance.get('pid')) == key:
+                    del self._instances_by_pid[instance['pid']]
                 instance.update({'pid': pid, 'return_code': return_code})
+                if return_code is None:
+                    self._instances_by_pid[pid] = key
+                    self._set_state(key, 'running')
+                    StateNotifier().notify(name, instance_id, 'running', pid=pid)
+                else:
+                    self._set_state(key, 'exited')
+                    StateNotifier().notify(name, instance_id, 'exited', return_code=return_code)
+
+    def get_instances_details(self, instances=None):
+        """Consistent snapshot of the status of every Job Instance,
+        or of the given (job name, job instance ID) pairs only.
+        """
+        with self._mutex:
+            if instances is None:
+                instances = list(self.instances)
+            return [
+                    job_instance_details(name, instance_id)
+                    for name, instance_id in instances
+            ]
 
     def get_last_instance_id(self):
         with self._mutex:
-            if not self.jobs:
-                return 0
+            return self._last_instance_id
+
+    def next_instance_id(self):
+        """Reserve a new Job Instance ID"""
+        with self._mutex:
+            self._last_instance_id += 1
+            return self._last_instance_id
+
+
+class JobConfigurationCache:
+    """Parsed configuration of the installed jobs, persisted
+    between restarts of the agent so only the configuration
+    files modified since are read again.
+
+    Entries are keyed by the path of the configuration file and
+    invalidated when its modification time or size change. The
+    whole cache is invalidated when the host platform changes.
+    """
+    __shared_state = {
+            'entries': None,
+            'modified': False,
+            '_mutex': threading.RLock(),
+    }
+
+    def __init__(self):
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self.entries is None:
+                self.entries = self._load()
+
+    @staticmethod
+    def _load():
+        try:
+            with open(JOBS_CACHE_FILE) as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+        try:
+            valid = (
+                    cache['version'] == JOBS_CACHE_VERSION and
+                    cache['platform'] == list(platform_facts()))
+            entries = cache['entries']
+        except (KeyError, TypeError):
+            return {}
+        return entries if valid and isinstance(entries, dict) else {}
+
+    def get(self, path, stat):
+        """Return the configuration stored for the given file,
+        or None if it changed since or is unknown.
+        """
+        with self._mutex:
+            try:
+                mtime, size, configuration = self.entries[path]
+            except (KeyError, ValueError, TypeError):
+                return None
+            if mtime != stat.st_mtime_ns or size != stat.st_size:
+                return None
+            return copy.deepcopy(configuration)
+
+    def set(self, path, stat, configuration):
+        with self._mutex:
+            self.entries[path] = [stat.st_mtime_ns, stat.st_size, copy.deepcopy(configuration)]
+            self.modified = True
+
+    def prune(self, paths):
+        """Forget about the files not in `paths`"""
+        with self._mutex:
+            for path in set(self.entries).difference(paths):
+                del self.entries[path]
+                self.modified = True
+
+    def save(self):
+        with self._mutex:
+            if not self.modified:
+                return
+            cache = {
+                    'version': JOBS_CACHE_VERSION,
+                    'platform': platform_facts(),
+                    'entries': self.entries,
+            }
+            temporary = '{}.tmp'.format(JOBS_CACHE_FILE)
+            try:
+                with open(temporary, 'w') as cache_file:
+                    json.dump(cache, cache_file)
+                os.replace(temporary, JOBS_CACHE_FILE)
+            except OSError as e:
+                syslog.syslog(
+                        syslog.LOG_WARNING,
+                        'Cannot save the jobs configuration cache: {}'.format(e))
+            else:
+                self.modified = False
+
+
+class RecoveryJournal:
+    """Append-only journal of the orders to start or stop Job
+    Instances at a later date, replayed if the Agent restarts.
+
+    Each record is made of the length and the CRC32 of its JSON
+    payload followed by the payload itself: a list starting with
+    the kind of order, the job name, the job instance ID and the
+    date of the order. Only the last order of each kind matters
+    for a given Job Instance, so the journal is rewritten with
+    the orders yet to be executed once it holds many more records.
+    """
+    __shared_state = {
+            'orders': OrderedDict(),
+            'records': 0,
+            '_file': None,
+            '_mutex': threading.RLock(),
+    }
+
+    def __init__(self):
+        self.__dict__ = self.__class__.__shared_state
+
+    @property
+    def path(self):
+        return os.path.join(INSTANCES_FOLDER, JOURNAL_FILENAME)
+
+    def record_start(self, job_name, job_instance_id, scenario_id, owner_id, date, arguments, placement=None):
+        order = ['start', job_name, job_instance_id, date, scenario_id, owner_id, arguments]
+        if placement is not None:
+            order.append(placement.as_dict())
+        self._append(order)
+
+    def record_stop(self, job_name, job_instance_id, date):
+        self._append(['stop', job_name, job_instance_id, date])
+
+    def forget(self, job_name, job_instance_id):
+        """Discard the orders concerning a stopped Job Instance"""
+        with self._mutex:
+            if any((kind, job_name, job_instance_id) in self.orders for kind in ('start', 'stop')):
+                self._append(['forget', job_name, job_instance_id, 0])
+
+    def _apply(self, order):
+        kind, job_name, job_instance_id = key = tuple(order[:3])
+        if kind == 'forget':
+            self.orders.pop(('start', job_name, job_instance_id), None)
+            self.orders.pop(('stop', job_name, job_instance_id), None)
+        else:
+            self.orders.pop(key, None)
+            self.orders[key] = order
+        self.records += 1
+
+    @staticmethod
+    def _encode(order):
+        payload = json.dumps(order).encode()
+        return JOURNAL_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def _append(self, order):
+        record = self._encode(order)
+        with self._mutex:
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+            self._file.write(record)
+            self._file.flush()
+            self._apply(order)
+            if self.records > max(JOURNAL_COMPACTION_THRESHOLD, 2 * len(self.orders)):
+                self.compact()
+
+    def replay(self):
+        """Read the whole journal in a single pass and return
+        the orders it contains, oldest first.
+        """
+        with self._mutex:
+            self.orders.clear()
+            self.records = 0
+            try:
+                with open(self.path, 'rb') as journal:
+                    content = journal.read()
+            except FileNotFoundError:
+                return []
+
+            offset = 0
+            size = len(content)
+            decode = json.JSONDecoder().decode
+            while offset < size:
+                try:
+                    length, checksum = JOURNAL_RECORD_HEADER.unpack_from(content, offset)
+                except struct.error:
+                    length = checksum = None
+                start = offset + JOURNAL_RECORD_HEADER.size
+                payload = content[start:start + length] if length is not None else b''
+                if len(payload) != length or zlib.crc32(payload) != checksum:
+                    # Partial write or corruption: nothing trustworthy can
+                    # be read past this point, make room for new records
+                    syslog.syslog(
+                            syslog.LOG_ERR,
+                            'Corrupted record in {} at offset {}, dropping '
+                            'the last {} bytes'.format(self.path, offset, size - offset))
+                    with suppress(OSError):
+                        os.truncate(self.path, offset)
+                    break
+                try:
+                    self._apply(decode(payload.decode()))
+                except (ValueError, TypeError):
+                    syslog.syslog(
+                            syslog.LOG_ERR,
+                            'Invalid record in {} at offset {}'
+                            .format(self.path, offset))
+                offset = start + length
+            return list(self.orders.values())
+
+    def compact(self, now=None):
+        """Rewrite the journal with only the orders yet to be executed"""
+        if now is None:
+            now = time.time()
+        with self._mutex:
+            for key, order in list(self.orders.items()):
+                if order[3] < now:
+                    del self.orders[key]
+
+            temporary = '{}.tmp'.format(self.path)
+            try:
+                with open(temporary, 'wb') as journal:
+                    journal.write(b''.join(map(self._encode, self.orders.values())))
+                os.replace(temporary, self.path)
+            except OSError as e:
+                syslog.syslog(
+                        syslog.LOG_WARNING,
+                        'Cannot compact {}: {}'.format(self.path, e))
+                return
+
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.records = len(self.orders)
+
+
+class ProcessSupervisor:
+    """Watch the processes of the running Job Instances and
+    update their status in the JobManager once they exit.
+
+    A single thread reaps every process. It is woken up by
+    SIGCHLD and also polls the processes every
+    SUPERVISOR_POLL_INTERVAL seconds in case a signal was missed
+    or is not available on this platform.
+    """
+    __shared_state = {
+            'processes': {},
+            'cgroups': {},
+            '_wakeup': None,
+            '_mutex': threading.RLock(),
+    }
+
+    def __init__(self):
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self._wakeup is None:
+                self._wakeup = threading.Event()
+                threading.Thread(target=self._reap_forever, daemon=True).start()
+
+    def install_signal_handler(self):
+        """Get notified of the termination of child processes;
+        must be called from the main thread.
+        """
+        with suppress(AttributeError):
+            signal.signal(signal.SIGCHLD, self._signal_child_handler)
+
+    def _signal_child_handler(self, signal, frame):
+        self.wake_up()
+
+    def wake_up(self):
+        self._wakeup.set()
+
+    def watch(self, job_name, job_instance_id, process, cgroup=None):
+        with self._mutex:
+            self.processes[process.pid] = (job_name, job_instance_id, process)
+            if cgroup is not None:
+                self.cgroups[process.pid] = cgroup
+        # The process may have exited before being watched
+        self.wake_up()
+
+    def watched(self):
+        """Job name, Job Instance ID and process of
+        each running Job Instance.
+        """
+        with self._mutex:
+            return list(self.processes.values())
+
+    def is_running(self, job_name, job_instance_id):
+        with self._mutex:
+            return any(
+                    name == job_name and instance_id == job_instance_id
+                    for name, instance_id, _ in self.processes.values())
+
+    def _reap_forever(self):
+        while True:
+            self._wakeup.wait(SUPERVISOR_POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.reap()
+            except Exception as e:
+                syslog.syslog(
+                        syslog.LOG_ERR,
+                        'Error reaping job instances: {}'.format(e))
+
+    def reap(self):
+        """Update the status of the Job Instances whose process exited"""
+        with self._mutex:
+            processes = list(self.processes.items())
+
+        for pid, (job_name, job_instance_id, process) in processes:
+            # Only wait for our own processes, other children
+            # of the agent are waited for by their owner
+            return_code = process.poll()
+            if return_code is None:
+                continue
+            with self._mutex:
+                del self.processes[pid]
+                cgroup = self.cgroups.pop(pid, None)
+            if cgroup is not None:
+                Placement.remove_cgroup(cgroup)
+            with suppress(KeyError):
+                JobManager().set_instance_status(job_name, job_instance_id, pid, return_code)
+
+
+class ResourcesSampler(threading.Thread):
+    """Periodically measure the resources used by the whole process
+    tree of each running Job Instance and send them to rstats.
+
+    A single thread samples every Job Instance. Statistics are sent
+    on behalf of the agent, with a `<job name>_<job instance ID>`
+    suffix, and are cumulated over the live processes of the tree:
+    cpu_user_time and cpu_system_time (seconds, including reaped
+    children), memory_rss (bytes), ctx_switches_voluntary,
+    ctx_switches_involuntary, io_read_bytes, io_write_bytes,
+    open_fds and processes. Statistics that can not be read
+    for any process of the tree, usually for lack of
+    privileges, are not sent.
+    """
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+
+    def run(self):
+        if collect_agent is None:
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'collect_agent is not available, '
+                    'Job Instances resources will not be sampled')
+            return
+
+        # Register as the agent itself, not as the last Job Instance launched
+        registered = collect_agent.register_collect(
+                AGENT_FILTER_FILE, job_name='openbach_agent')
+        if not registered:
+            syslog.syslog(
+                    syslog.LOG_ERR,
+                    'Cannot register to rstats, Job Instances '
+                    'resources will not be sampled')
+            return
+
+        next_sample = time.monotonic()
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                syslog.syslog(
+                        syslog.LOG_ERR,
+                        'Error sampling job instances resources: {}'.format(e))
+            next_sample += self.interval
+            time.sleep(max(0, next_sample - time.monotonic()))
+
+    def sample(self):
+        instances = ProcessSupervisor().watched()
+        if not instances:
+            return
+
+        # Scan the processes once for all Job Instances
+        children = {}
+        for process in psutil.process_iter():
+            with suppress(psutil.Error):
+                children.setdefault(process.ppid(), []).append(process)
+
+        timestamp = int(time.time() * 1000)
+        samples = []
+        for job_name, job_instance_id, process in instances:
+            tree = [process]
+            for parent in tree:
+                tree.extend(children.get(parent.pid, ()))
+            usage = process_tree_usage(tree)
+            if usage:
+                suffix = '{}_{}'.format(job_name, job_instance_id)
+                samples.append((timestamp, suffix, usage))
+
+        if samples:
+            response = collect_agent.send_stats(samples)
+            if not response.startswith('OK'):
+                syslog.syslog(
+                        syslog.LOG_WARNING,
+                        'Cannot send job instances resources: {}'.format(response))
+
+
+class Placement:
+    """Resources a Job Instance is confined to, applied by the
+    agent to its process before the command is executed.
+
+    Hints are the CPUs the process may run on (`cpus`), either
+    a niceness (`nice`) or a real-time SCHED_FIFO priority
+    (`sched_fifo`), an IO scheduling class (`io_class`, with an
+    optional `io_priority`) and cgroup v2 limits on the memory
+    (`memory_max`, in bytes) and on the CPU time (`cpu_max`, in
+    amount of CPUs) used by the whole process tree.
+    """
+    HINTS = ('cpus', 'nice', 'sched_fifo', 'io_class', 'io_priority', 'memory_max', 'cpu_max')
+    IO_CLASSES = OrderedDict([
+            ('idle', 'IOPRIO_CLASS_IDLE'),
+            ('best-effort', 'IOPRIO_CLASS_BE'),
+            ('realtime', 'IOPRIO_CLASS_RT'),
+    ])
+
+    def __init__(self, cpus=None, nice=None, sched_fifo=None,
+                 io_class=None, io_priority=None,
+                 memory_max=None, cpu_max=None):
+        if cpus is not None:
+            if not hasattr(os, 'sched_setaffinity'):
+                raise BadRequest('KO CPU affinity is not supported on this agent')
+            if not isinstance(cpus, list) or not cpus:
+                raise BadRequest('KO The placement hint cpus should be a list of CPU numbers')
+            for cpu in cpus:
+                self._check_integer('cpus', cpu, 0)
+            unavailable = set(cpus).difference(os.sched_getaffinity(0))
+            if unavailable:
+                raise BadRequest(
+                        'KO CPUs {} are not available on this '
+                        'agent'.format(', '.join(map(str, sorted(unavailable)))))
+            cpus = sorted(set(cpus))
+
+        if nice is not None and sched_fifo is not None:
+            raise BadRequest(
+                    'KO The placement hints nice and sched_fifo '
+                    'can not be used together')
+        if nice is not None:
+            self._check_integer('nice', nice, -20, 19)
+        if sched_fifo is not None:
+            if not hasattr(os, 'SCHED_FIFO'):
+                raise BadRequest('KO SCHED_FIFO is not supported on this agent')
+            self._check_integer(
+                    'sched_fifo', sched_fifo,
+                    os.sched_get_priority_min(os.SCHED_FIFO),
+                    os.sched_get_priority_max(os.SCHED_FIFO))
+
+        if io_priority is not None:
+            self._check_integer('io_priority', io_priority, 0, 7)
+            if io_class is None:
+                io_class = 'best-effort'
+            elif io_class == 'idle':
+                raise BadRequest('KO The idle IO class does not accept an io_priority')
+        if io_class is not None:
+            if io_class not in self.IO_CLASSES:
+                raise BadRequest(
+                        'KO The placement hint io_class should be '
+                        'one of {}'.format(', '.join(self.IO_CLASSES)))
+            if not hasattr(psutil, self.IO_CLASSES[io_class]):
+                raise BadRequest('KO IO classes are not supported on this agent')
+
+        if memory_max is not None:
+            self._check_integer('memory_max', memory_max, 1)
+        if cpu_max is not None:
+            if isinstance(cpu_max, bool) or not isinstance(cpu_max, (int, float)) or cpu_max <= 0:
+                raise BadRequest(
+                        'KO The placement hint cpu_max should be '
+                        'a positive amount of CPUs')
+        if (memory_max is not None or cpu_max is not None) and not os.path.isfile(
+                os.path.join(CGROUP_ROOT, 'cgroup.controllers')):
+            raise BadRequest('KO cgroup v2 is not available on this agent')
+
+        self.cpus = cpus
+        self.nice = nice
+        self.sched_fifo = sched_fifo
+        self.io_class = io_class
+        self.io_priority = io_priority
+        self.memory_max = memory_max
+        self.cpu_max = cpu_max
+
+    @staticmethod
+    def _check_integer(hint, value, minimum, maximum=None):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise BadRequest('KO The placement hint {} should be an integer'.format(hint))
+        if value < minimum or (maximum is not None and value > maximum):
+            raise BadRequest(
+                    'KO The placement hint {} should be at least {}{}'.format(
+                        hint, minimum, '' if maximum is None else ' and at most {}'.format(maximum)))
+
+    @classmethod
+    def from_json(cls, description):
+        """Build a placement from the JSON object sent by the conductor"""
+        try:
+            hints = json.loads(description)
+        except ValueError:
+            hints = None
+        if not isinstance(hints, dict):
+            raise BadRequest('KO The placement of the job instance should be a JSON object')
+        unknown = set(hints).difference(cls.HINTS)
+        if unknown:
+            raise BadRequest(
+                    'KO Unknown placement hints: {}'
+                    .format(', '.join(sorted(unknown))))
+        return cls(**hints)
+
+    def as_dict(self):
+        return {
+                hint: getattr(self, hint) for hint in self.HINTS
+                if getattr(self, hint) is not None
+        }
+
+    def create_cgroup(self, job_name, job_instance_id):
+        """Create the cgroup enforcing the memory and CPU limits of
+        this placement and return its path, or None if there are no
+        such limits.
+        """
+        limits = OrderedDict()
+        if self.memory_max is not None:
+            limits['memory'] = ('memory.max', str(self.memory_max))
+        if self.cpu_max is not None:
+            quota = max(int(self.cpu_max * CGROUP_CPU_PERIOD), CGROUP_CPU_MIN_QUOTA)
+            limits['cpu'] = ('cpu.max', '{} {}'.format(quota, CGROUP_CPU_PERIOD))
+        if not limits:
+            return None
+
+        parent = os.path.join(CGROUP_ROOT, CGROUP_NAME)
+        os.makedirs(parent, exist_ok=True)
+        controllers = ' '.join('+' + controller for controller in limits)
+        for folder in (CGROUP_ROOT, parent):
+            with open(os.path.join(folder, 'cgroup.subtree_control'), 'w') as subtree:
+                subtree.write(controllers)
+
+        cgroup = os.path.join(parent, '{}_{}'.format(job_name, job_instance_id))
+        os.makedirs(cgroup, exist_ok=True)
+        for filename, value in limits.values():
+            with open(os.path.join(cgroup, filename), 'w') as limit:
+                limit.write(value)
+        return cgroup
+
+    @staticmethod
+    def remove_cgroup(cgroup):
+        """Remove the cgroup of a terminated Job Instance. It is
+        kept if processes spawned by the Job Instance are still
+        alive in it.
+        """
+        with suppress(OSError):
+            os.rmdir(cgroup)
+
+    def apply(self, pid, cgroup=None):
+        """Move the process `pid` into `cgroup` and apply the hints
+        to it. Called from the agent while the process waits for
+        it to execute the command (see `popen`), as running code
+        between the fork and the exec is not safe in a
+        multi-threaded process. The command and every process it
+        spawns inherit the placement.
+        """
+        if cgroup is not None:
+            with open(os.path.join(cgroup, 'cgroup.procs'), 'w') as procs:
+                procs.write(str(pid))
+        if self.cpus is not None:
+            os.sched_setaffinity(pid, self.cpus)
+        if self.sched_fifo is not None:
+            os.sched_setscheduler(pid, os.SCHED_FIFO, os.sched_param(self.sched_fifo))
+        if self.nice is not None:
+            os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+        if self.io_class is not None:
+            io_class = getattr(psutil, self.IO_CLASSES[self.io_class])
+            psutil.Process(pid).ionice(io_class, self.io_priority)
+
+
+class StateNotifier:
+    """Push the state transitions of the Job Instances to the
+    conductors that subscribed to them, so they do not have to
+    poll the agent.
+
+    Every message carries the epoch of the agent (the time it
+    started) and the sequence number of the last transition.
+    Each time the connection to a conductor is (re)established,
+    the state of every Job Instance is sent first so the
+    conductor can resynchronize.
+    """
+    __shared_state = {
+            'senders': {},
+            'epoch': int(time.time() * 1000),
+            'sequence': 0,
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        self.__dict__ = self.__class__.__shared_state
+
+    def subscribe(self, address, agent_address):
+        with self._mutex:
+            sender = self.senders.get(address)
+            if sender is None:
+                sender = self.senders[address] = NotificationSender(address, agent_address)
+                sender.start()
+            else:
+                sender.agent_address = agent_address
+                sender.resync()
+
+    def notify(self, job_name, job_instance_id, event, **details):
+        """Record a state transition; must be called with
+        the JobManager lock held.
+        """
+        with self._mutex:
+            self.sequence += 1
+            if not self.senders:
+                return
+            message = dict(
+                    details, type='event', event=event,
+                    job_name=job_name, job_instance_id=job_instance_id,
+                    status=self._status(job_name, job_instance_id),
+                    epoch=self.epoch, sequence=self.sequence)
+            for sender in self.senders.values():
+                sender.queue.put(message)
+
+    @staticmethod
+    def _status(job_name, job_instance_id):
+        try:
+            return job_instance_status(job_name, job_instance_id)
+        except AssertionError:
+            # Inconsistent state, let the conductor poll for it
+            return None
+
+    def snapshot(self):
+        """Current state of every Job Instance"""
+        with JobManager() as manager, self._mutex:
+            instances = [
+                    {
+                        'job_name': details['job_name'],
+                        'job_instance_id': details['job_instance_id'],
+                        'status': details['status'],
+                    }
+                    for details in manager.get_instances_details()
+            ]
+            return {
+                    'type': 'resync',
+                    'epoch': self.epoch,
+                    'sequence': self.sequence,
+                    'instances': instances,
+            }
+
 
-            return max(
-                    max(map(int, job['instances']), default=0)
-                    for job in self.jobs.values()
-            )
+class NotificationSender(threading.Thread):
+    """Send the notifications of the StateNotifier to a
+    conductor, reconnecting as long as the agent runs.
+    """
+
+    def __init__(self, address, agent_address):
+        super().__init__(daemon=True)
+        self.address = address
+        self.agent_address = agent_address
+        self.queue = queue.Queue()
+
+    def resync(self):
+        self.queue.put(None)
+
+    def run(self):
+        delay = NOTIFICATIONS_RETRY_DELAY
+        while True:
+            try:
+                with socket.create_connection(self.address, NOTIFICATIONS_KEEPALIVE) as connection:
+                    delay = NOTIFICATIONS_RETRY_DELAY
+                    self._send(connection, StateNotifier().snapshot())
+                    while True:
+                        try:
+                            message = self.queue.get(timeout=NOTIFICATIONS_KEEPALIVE)
+                        except queue.Empty:
+                            message = {'type': 'keepalive', 'epoch': StateNotifier().epoch}
+                        if message is None:
+                            message = StateNotifier().snapshot()
+                        self._send(connection, message)
+            except OSError as e:
+                syslog.syslog(
+                        syslog.LOG_WARNING,
+                        'Cannot send notifications to {}: {}'
+                        .format(self.address[0], e))
+            # The snapshot sent on reconnection supersedes pending events
+            with suppress(queue.Empty):
+                while True:
+                    self.queue.get_nowait()
+            time.sleep(delay)
+            delay = min(2 * delay, NOTIFICATIONS_MAX_RETRY_DELAY)
+
+    def _send(self, connection, message):
+        message['agent'] = self.agent_address
+        content = json.dumps(message).encode()
+        connection.sendall(struct.pack('>I', len(content)) + content)
 
 
 class TruncatedMessageException(Exception):
@@ -207,6 +1031,7 @@ class TruncatedMessageException(Exception):
                 .format(expected_length, length)
         )
         super().__init__(message)
+        self.length = length
 
 
 class BadRequest(ValueError):
@@ -217,6 +1042,9 @@ class BadRequest(ValueError):
 
 
 class AgentAction:
+    # Address of the conductor sending the request
+    requester = None
+
     def __init__(self, **kwargs):
         for name, value in kwargs.items():
             setattr(self, name, value)
@@ -237,7 +1065,10 @@ class AddJobAgent(AgentAction):
         super().__init__(name=name)
 
     def _action(self):
-        JobManager().add_job(self.name)
+        try:
+            JobManager().add_job(self.name)
+        finally:
+            JobConfigurationCache().save()
 
 
 class DelJobAgent(AgentAction):
@@ -246,7 +1077,8 @@ class DelJobAgent(AgentAction):
 
     def _action(self):
         with JobManager() as manager:
-            for job_instance_id, _ in manager.get_instances(self.name):
+            manager.get_job(self.name)
+            for _, job_instance_id in manager.get_active_instances(self.name):
                 manager.scheduler.add_job(
                         stop_job, 'date', args=(self.name, job_instance_id),
                         id='{}{}_stop'.format(self.name, job_instance_id))
@@ -260,33 +1092,26 @@ class StatusJobInstanceAgent(AgentAction):
         JobManager().get_job(self.name)
 
     def _action(self):
-        manager = JobManager()
-        job = manager.scheduler.get_job(self.name + self.instance_id)
-        try:
-            infos = manager.get_instance(self.name, self.instance_id)
-        except KeyError:
-            assert job is None
-            return 'Not Scheduled'
-
-        try:
-            pid = infos['pid']
-            return_code = infos['return_code']
-        except KeyError:
-            return 'Stopped' if job is None else 'Scheduled'
+        return job_instance_status(self.name, self.instance_id)
 
-        if return_code:
-            return 'Error'
 
-        if return_code is None:
-            assert psutil.pid_exists(pid)
-            return 'Running'
+class StatusJobInstancesAgent(AgentAction):
+    def __init__(self, *instances):
+        super().__init__(instances=instances)
 
-        assert return_code == 0
-        if job:
-            assert isinstance(job.trigger, IntervalTrigger)
-            return 'Running'
+    def check_arguments(self):
+        if len(self.instances) % 2:
+            raise BadRequest(
+                    'KO Job Instances should be given as pairs '
+                    'of job name and job instance ID')
 
-        return 'Not Running'
+    def _action(self):
+        instances = None
+        if self.instances:
+            names = self.instances[::2]
+            ids = self.instances[1::2]
+            instances = list(zip(names, ids))
+        return json.dumps(JobManager().get_instances_details(instances))
 
 
 class StartJobInstanceAgent(AgentAction):
@@ -294,7 +1119,7 @@ class StartJobInstanceAgent(AgentAction):
         super().__init__(
                 name=name, instance_id=instance_id, scenario_id=scenario_id,
                 owner_id=owner_id, date_type=date_type, date=date_value,
-                arguments=arguments)
+                arguments=arguments, placement=None)
 
     def _check_instance(self):
         if JobManager().has_instance(self.name, self.instance_id):
@@ -305,6 +1130,15 @@ class StartJobInstanceAgent(AgentAction):
     def check_arguments(self):
         self._check_instance()
 
+        if self.date_type == 'placement':
+            self.placement = Placement.from_json(self.date)
+            try:
+                self.date_type, self.date, *self.arguments = self.arguments
+            except ValueError:
+                raise BadRequest(
+                        'KO A "date" or an "interval" should follow '
+                        'the placement of the job instance')
+
         if self.date_type == 'date':
             if self.date == 'now':
                 self.date = 0
@@ -345,12 +1179,12 @@ class StartJobInstanceAgent(AgentAction):
             if self.date_type == 'date':
                 date, _ = schedule_job_instance(
                         self.name, self.instance_id, self.scenario_id,
-                        self.owner_id, arguments, self.date)
+                        self.owner_id, arguments, self.date,
+                        placement=self.placement)
                 if date is not None:
-                    with recover_file(self.name, self.instance_id, 'start') as job_instance_prog:
-                        print(self.name, self.instance_id, self.scenario_id,
-                              self.owner_id, self.date, arguments,
-                              sep='\n', file=job_instance_prog)
+                    RecoveryJournal().record_start(
+                            self.name, self.instance_id, self.scenario_id,
+                            self.owner_id, self.date, arguments, self.placement)
             elif self.date_type == 'interval':
                 job_infos = manager.get_job(self.name)
                 if job_infos['persistent']:
@@ -363,7 +1197,8 @@ class StartJobInstanceAgent(AgentAction):
                     manager.scheduler.add_job(
                             launch_job, 'interval', seconds=self.date,
                             args=(self.name, self.instance_id, self.scenario_id,
-                                  self.owner_id, job_infos['command'], arguments),
+                                  self.owner_id, job_infos['command'], arguments,
+                                  self.placement),
                             id=self.name + self.instance_id)
                 except ConflictingIdError:
                     raise BadRequest(
@@ -374,7 +1209,7 @@ class StartJobInstanceAgent(AgentAction):
 
 class StartJobInstanceAgentId(StartJobInstanceAgent):
     def __init__(self, name, date_type, date_value, *arguments):
-        instance_id = str(JobManager().get_last_instance_id() + 1)
+        instance_id = str(JobManager().next_instance_id())
         super().__init__(
                 name, instance_id, '0', '0',
                 date_type, date_value, *arguments)
@@ -417,9 +1252,7 @@ class StopJobInstanceAgent(AgentAction):
     def _action(self):
         date = schedule_job_instance_stop(self.name, self.instance_id, self.date)
         if date is not None:
-            with recover_file(self.name, self.instance_id, 'stop') as job_instance_stop:
-                print(self.name, self.instance_id, self.date,
-                      sep='\n', file=job_instance_stop)
+            RecoveryJournal().record_stop(self.name, self.instance_id, self.date)
 
 
 class StatusJobsAgent(AgentAction):
@@ -431,11 +1264,10 @@ class StatusJobsAgent(AgentAction):
 class RestartAgent(AgentAction):
     def _action(self):
         with JobManager() as manager:
-            for job_name in manager.job_names:
-                for job_instance_id, _ in manager.get_instances(job_name):
-                    manager.scheduler.add_job(
-                            stop_job, 'date', args=(job_name, job_instance_id),
-                            id='{}{}_stop'.format(job_name, job_instance_id))
+            for job_name, job_instance_id in manager.get_active_instances():
+                manager.scheduler.add_job(
+                        stop_job, 'date', args=(job_name, job_instance_id),
+                        id='{}{}_stop'.format(job_name, job_instance_id))
 
 
 class CheckConnection(AgentAction):
@@ -443,16 +1275,139 @@ class CheckConnection(AgentAction):
         pass
 
 
-def popen(command, args, **kwargs):
+class SubscribeNotificationsAgent(AgentAction):
+    def __init__(self, port, agent_address):
+        super().__init__(port=port, agent_address=agent_address)
+
+    def check_arguments(self):
+        try:
+            self.port = int(self.port)
+        except ValueError:
+            raise BadRequest(
+                    'KO The port to send notifications '
+                    'to should be an integer')
+
+    def _action(self):
+        StateNotifier().subscribe((self.requester, self.port), self.agent_address)
+
+
+def job_instance_status(job_name, job_instance_id):
+    """Compute the status of a Job Instance as reported to the conductor"""
+    manager = JobManager()
+    job = manager.scheduler.get_job(job_name + job_instance_id)
+    try:
+        infos = manager.get_instance(job_name, job_instance_id)
+    except KeyError:
+        assert job is None
+        return 'Not Scheduled'
+
+    try:
+        pid = infos['pid']
+        return_code = infos['return_code']
+    except KeyError:
+        return 'Stopped' if job is None else 'Scheduled'
+
+    if return_code:
+        return 'Error'
+
+    if return_code is None:
+        assert psutil.pid_exists(pid)
+        return 'Running'
+
+    assert return_code == 0
+    if job:
+        assert isinstance(job.trigger, IntervalTrigger)
+        return 'Running'
+
+    return 'Not Running'
+
+
+def job_instance_details(job_name, job_instance_id):
+    """Status, process and scheduling informations of a Job
+    Instance, as reported to the conductor in batch requests.
+    """
+    manager = JobManager()
+    details = {
+            'job_name': job_name,
+            'job_instance_id': job_instance_id,
+            'status': None,
+            'pid': None,
+            'return_code': None,
+            'schedule': None,
+    }
+    try:
+        details['status'] = job_instance_status(job_name, job_instance_id)
+    except AssertionError:
+        # Inconsistent state, let the conductor decide
+        pass
+    except BadRequest:
+        details['status'] = 'Not Scheduled'
+
+    with suppress(KeyError, BadRequest):
+        infos = manager.get_instance(job_name, job_instance_id)
+        details['pid'] = infos.get('pid')
+        details['return_code'] = infos.get('return_code')
+        job = manager.scheduler.get_job(job_name + job_instance_id)
+        next_run = getattr(job, 'next_run_time', None)
+        details['schedule'] = {
+                'type': infos['type'],
+                'value': infos['date'],
+                'next_run': None if next_run is None else int(next_run.timestamp() * 1000),
+        }
+    return details
+
+
+def process_tree_usage(processes):
+    """Cumulated resources used by the given processes"""
+    usage = {}
+
+    def add(name, value):
+        usage[name] = usage.get(name, 0) + value
+
+    for process in processes:
+        try:
+            with process.oneshot():
+                cpu = process.cpu_times()
+                memory = process.memory_info()
+                switches = process.num_ctx_switches()
+                io = fds = None
+                with suppress(psutil.AccessDenied, AttributeError):
+                    io = process.io_counters()
+                with suppress(psutil.AccessDenied, AttributeError):
+                    fds = process.num_fds()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        if io is not None:
+            add('io_read_bytes', io.read_bytes)
+            add('io_write_bytes', io.write_bytes)
+        if fds is not None:
+            add('open_fds', fds)
+        add('cpu_user_time', cpu.user + getattr(cpu, 'children_user', 0))
+        add('cpu_system_time', cpu.system + getattr(cpu, 'children_system', 0))
+        add('memory_rss', memory.rss)
+        add('ctx_switches_voluntary', switches.voluntary)
+        add('ctx_switches_involuntary', switches.involuntary)
+        add('processes', 1)
+    return usage
+
+
+def popen(command, args, held=False, **kwargs):
     """Start a command with the provided arguments and
     return the associated process.
 
+    If `held` is True, the process waits until a line is written
+    on its standard input before executing the command, under the
+    same PID; closing it instead aborts the execution.
+
     Additional keywords arguments can be passed to the
     Popen constructor to manage the process creation.
     """
 
     kwargs.pop('shell', False)
     command_line = shlex.split(command) + shlex.split(args)
+    if held:
+        command_line = ['/bin/sh', '-c', PLACEMENT_GATE, 'sh'] + command_line
+        kwargs['stdin'] = PIPE
 
     return psutil.Popen(
             command_line,
@@ -463,7 +1418,7 @@ def popen(command, args, **kwargs):
 
 def schedule_job_instance(job_name, job_instance_id, scenario_instance_id,
                           owner_scenario_instance_id, arguments, date_value,
-                          reschedule=False):
+                          reschedule=False, placement=None):
     """Schedule a Job Instance at a later date.
 
     Do nothing if the scheduling date is passed and it is a
@@ -486,7 +1441,8 @@ def schedule_job_instance(job_name, job_instance_id, scenario_instance_id,
             manager.scheduler.add_job(
                     launch_job, 'date', run_date=date,
                     args=(job_name, job_instance_id, scenario_instance_id,
-                          owner_scenario_instance_id, command, arguments),
+                          owner_scenario_instance_id, command, arguments,
+                          placement),
                     id=job_name+job_instance_id)
         except ConflictingIdError:
             raise BadRequest('KO A job {} is already programmed'.format(job_name))
@@ -497,8 +1453,24 @@ def schedule_job_instance(job_name, job_instance_id, scenario_instance_id,
 
 
 def launch_job(job_name, instance_id, scenario_instance_id,
-               owner_scenario_instance_id, command, args):
-    """Launch the Job Instance and wait for its termination"""
+               owner_scenario_instance_id, command, args, placement=None):
+    """Launch the Job Instance and let the ProcessSupervisor
+    wait for its termination.
+
+    The process is held until its placement is applied, so the
+    command and its children run with it from the start. If the
+    placement can not be applied, the process is killed before
+    executing the command and the Job Instance is reported in error.
+    """
+    supervisor = ProcessSupervisor()
+    if supervisor.is_running(job_name, instance_id):
+        # An interval Job Instance is still running since last time
+        syslog.syslog(
+                syslog.LOG_WARNING,
+                'Skipping execution of {} {}: previous execution '
+                'still running'.format(job_name, instance_id))
+        return
+
     # Add some environement variable for the Job Instance
     environ = os.environ.copy()
     environ.update({'JOB_NAME': job_name, 'JOB_INSTANCE_ID': instance_id,
@@ -506,11 +1478,36 @@ def launch_job(job_name, instance_id, scenario_instance_id,
                     'OWNER_SCENARIO_INSTANCE_ID': owner_scenario_instance_id})
     # Launch the Job Instance
     job_config = JobManager().get_job(job_name)
-    proc = popen(command, args, env=environ, shell=job_config['sudo'])
+    try:
+        proc = popen(
+                command, args, held=placement is not None,
+                env=environ, shell=job_config['sudo'])
+    except Exception as e:
+        syslog.syslog(
+                syslog.LOG_ERR,
+                'Cannot launch {} {}: {}'.format(job_name, instance_id, e))
+        raise
     pid = proc.pid
+
+    cgroup = None
+    if placement is not None:
+        try:
+            cgroup = placement.create_cgroup(job_name, instance_id)
+            placement.apply(pid, cgroup)
+        except Exception as e:
+            syslog.syslog(
+                    syslog.LOG_ERR,
+                    'Cannot apply the placement of {} {}: {}'
+                    .format(job_name, instance_id, e))
+            with suppress(psutil.Error):
+                proc.kill()
+        else:
+            with suppress(OSError):
+                proc.stdin.write(b'\n')
+        with suppress(OSError):
+            proc.stdin.close()
     JobManager().set_instance_status(job_name, instance_id, pid)
-    return_code = proc.wait()
-    JobManager().set_instance_status(job_name, instance_id, pid, return_code)
+    supervisor.watch(job_name, instance_id, proc, cgroup)
 
 
 def schedule_job_instance_stop(job_name, job_instance_id, date_value,
@@ -551,6 +1548,8 @@ def stop_job(job_name, job_instance_id):
         finally:
             with suppress(JobLookupError):
                 manager.scheduler.remove_job(job_name + job_instance_id)
+            RecoveryJournal().forget(job_name, job_instance_id)
+            StateNotifier().notify(job_name, job_instance_id, 'stopped')
 
 
 def stop_job_already_running(job_name, job_instance_id, instance_infos):
@@ -591,6 +1590,22 @@ class AgentServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
 
 
 class RequestHandler(socketserver.BaseRequestHandler):
+    """Handle messages comming from the conductor.
+
+    A connection carries a single request unless its first message
+    is `persistent_connection_agent`: it is then kept open for any
+    number of requests until the conductor closes it or it stays idle
+    for CONNECTION_IDLE_TIMEOUT seconds. Using
+    `persistent_connection_agent pipelined` instead, each request must
+    be prefixed by an identifier that is repeated in front of its
+    response; requests are then processed concurrently and responses
+    sent as soon as they are ready, possibly out of order.
+    """
+
+    def setup(self):
+        self._send_mutex = threading.Lock()
+        self._pending = threading.BoundedSemaphore(PIPELINE_MAX_PENDING)
+
     def _read_all(self, amount):
         expected = amount
         buffer = bytearray(amount)
@@ -602,50 +1617,118 @@ class RequestHandler(socketserver.BaseRequestHandler):
             amount -= received
         return buffer
 
+    def _read_message(self):
+        message_length = self._read_all(4)
+        message_length, = struct.unpack('>I', message_length)
+        return self._read_all(message_length)
+
     def finish(self):
         self.request.close()
 
     def handle(self):
-        """Handle message comming from the conductor"""
         try:
-            message_length = self._read_all(4)
-            message_length, = struct.unpack('>I', message_length)
-            message = self._read_all(message_length).decode()
+            message = self._read_message()
+        except TruncatedMessageException as e:
+            self.send_response(str(e), syslog.LOG_WARNING)
+            return
+
+        action_name, *arguments = message.decode(errors='replace').split() or ['']
+        if action_name != 'persistent_connection_agent':
+            self.send_response(*self.execute(message))
+            return
+
+        if arguments not in ([], ['pipelined']):
+            self.send_response('Bad parameters: {}'.format(arguments), syslog.LOG_CRIT)
+            return
+        self.send_response('OK', add_ko=False)
+        self.request.settimeout(CONNECTION_IDLE_TIMEOUT)
+        if arguments:
+            self.handle_pipelined()
+        else:
+            self.handle_persistent()
+
+    def _next_message(self):
+        """Read the next request on a persistent connection,
+        return None when the connection should be closed.
+        """
+        try:
+            return self._read_message()
+        except TruncatedMessageException as e:
+            if e.length:
+                syslog.syslog(syslog.LOG_WARNING, str(e))
+        except socket.timeout:
+            syslog.syslog(
+                    syslog.LOG_INFO,
+                    'Closing idle connection from {}'
+                    .format(self.client_address[0]))
+        except OSError as e:
+            syslog.syslog(syslog.LOG_WARNING, 'Connection lost: {}'.format(e))
+
+    def handle_persistent(self):
+        message = self._next_message()
+        while message is not None:
+            self.send_response(*self.execute(message))
+            message = self._next_message()
+
+    def handle_pipelined(self):
+        message = self._next_message()
+        while message is not None:
+            request_id, _, message = message.partition(b' ')
+            self._pending.acquire()
+            threading.Thread(
+                    target=self._execute_pipelined,
+                    args=(request_id.decode(errors='replace'), message),
+                    daemon=True).start()
+            message = self._next_message()
+
+        # Let pending requests answer before closing the connection
+        for _ in range(PIPELINE_MAX_PENDING):
+            self._pending.acquire()
+
+    def _execute_pipelined(self, request_id, message):
+        try:
+            response, severity, add_ko = self.execute(message)
+            if add_ko:
+                response = 'KO {}'.format(response)
+            with suppress(OSError):
+                self.send_response('{} {}'.format(request_id, response), severity, False)
+        finally:
+            self._pending.release()
+
+    def execute(self, message):
+        """Run the request in the given message and return the
+        arguments to `send_response` to answer it.
+        """
+        try:
+            message = message.decode()
             syslog.syslog(syslog.LOG_INFO, message)
             action_name, *arguments = shlex.split(message)
             action = ''.join(map(str.title, action_name.split('_')))
             handler = getattr(sys.modules[__name__], action)(*arguments)
-        except TruncatedMessageException as e:
-            self.send_response(str(e), syslog.LOG_WARNING)
-        except struct.error as e:
-            self.send_response(
-                    'Error converting the message length to '
-                    'an integer: {}'.format(e), syslog.LOG_CRIT)
+            handler.requester = self.client_address[0]
         except AttributeError:
-            self.send_response(
-                    'Unknown action: {}'.format(action_name),
-                    syslog.LOG_CRIT)
+            return 'Unknown action: {}'.format(action_name), syslog.LOG_CRIT, True
         except TypeError as e:
-            self.send_response('Bad parameters: {}'.format(e), syslog.LOG_CRIT)
+            return 'Bad parameters: {}'.format(e), syslog.LOG_CRIT, True
+        except Exception as e:
+            return (
+                    'Error on request: {0.__class__.__name__} '
+                    '{0}'.format(e), syslog.LOG_ERR, True)
+
+        try:
+            result = handler.action()
+        except BadRequest as e:
+            severity = syslog.LOG_ERR
+            if e.reason.startswith('OK'):
+                severity = syslog.LOG_WARNING
+            return e.reason, severity, False
         except Exception as e:
-            self.send_response(
+            return (
                     'Error on request: {0.__class__.__name__} '
-                    '{0}'.format(e), syslog.LOG_ERR)
+                    '{0}'.format(e), syslog.LOG_ERR, True)
         else:
-            try:
-                result = handler.action()
-            except BadRequest as e:
-                severity = syslog.LOG_ERR
-                if e.reason.startswith('OK'):
-                    severity = syslog.LOG_WARNING
-                self.send_response(e.reason, severity, False)
-            except Exception as e:
-                self.send_response(
-                        'Error on request: {0.__class__.__name__} '
-                        '{0}'.format(e), syslog.LOG_ERR)
-            else:
-                response = 'OK' if result is None else 'OK {}'.format(result)
-                self.send_response(response, add_ko=False)
+            response = 'OK' if result is None else 'OK {}'.format(result)
+            return response, None, False
 
     def send_response(self, message, severity=None, add_ko=True):
         if severity is not None:
@@ -654,17 +1737,8 @@ class RequestHandler(socketserver.BaseRequestHandler):
             message = 'KO {}'.format(message)
         result = message.encode()
         length = struct.pack('>I', len(result))
-        self.request.sendall(length + result)
-
-
-@contextmanager
-def recover_file(job_name, job_instance_id, extension):
-    """Context Manager providing a file opened in write mode
-    aimed at saving informations in case the Agent restart.
-    """
-    filename = '{}{}.{}'.format(job_name, job_instance_id, extension)
-    with open(os.path.join(INSTANCES_FOLDER, filename), 'w') as recover_file:
-        yield recover_file
+        with self._send_mutex:
+            self.request.sendall(length + result)
 
 
 def list_jobs_in_dir(dirname):
@@ -677,10 +1751,36 @@ def list_jobs_in_dir(dirname):
             yield name
 
 
+@lru_cache(maxsize=None)
+def platform_facts():
+    """System, distribution and version of the host"""
+    own_system = platform.system()
+    own_distribution, own_version, _ = platform.dist()
+    return own_system, own_distribution, own_version
+
+
 def read_job_configuration(job_name):
-    # Load the configuration
+    """Retrieve the configuration of a job, parsing its
+    configuration file only if it changed since last time.
+    """
     filename = '{}.yml'.format(job_name)
     conf_file = os.path.join(JOBS_FOLDER, filename)
+    try:
+        stat = os.stat(conf_file)
+    except FileNotFoundError:
+        raise BadRequest(
+                'KO Conf file {} does not exist'.format(filename))
+
+    cache = JobConfigurationCache()
+    configuration = cache.get(conf_file, stat)
+    if configuration is None:
+        configuration = parse_job_configuration(job_name, filename, conf_file)
+        cache.set(conf_file, stat, configuration)
+    return configuration
+
+
+def parse_job_configuration(job_name, filename, conf_file):
+    # Load the configuration
     try:
         with open(conf_file, 'r') as stream:
             try:
@@ -701,8 +1801,7 @@ def read_job_configuration(job_name):
     # Register the configuration
     oses = content.get('platform_configuration')
     if oses is not None:
-        own_system = platform.system()
-        own_distribution, own_version, _ = platform.dist()
+        own_system, own_distribution, own_version = platform_facts()
         for system in oses:
             try:
                 if own_system != system['ansible_system']:
@@ -721,7 +1820,7 @@ def read_job_configuration(job_name):
         else:
             raise BadRequest(
                     'KO Conf file {} does not contain a suitable '
-                    'os for {}'.format(filename, platform.system()))
+                    'os for {}'.format(filename, own_system))
 
     configuration['required'] = conf_required = []
     args = content.get('arguments', {})
@@ -765,62 +1864,112 @@ def populate_installed_jobs():
     """Read configuration files of Installed Jobs and
     store them into the JobManager.
     """
+    cache = JobConfigurationCache()
     with JobManager() as manager:
-        for job in list_jobs_in_dir(JOBS_FOLDER):
+        jobs = list(list_jobs_in_dir(JOBS_FOLDER))
+        for job in jobs:
             try:
                 manager.add_job(job)
             except BadRequest as e:
                 syslog.syslog(syslog.LOG_ERR, e.reason)
+    cache.prune(os.path.join(JOBS_FOLDER, '{}.yml'.format(job)) for job in jobs)
+    cache.save()
+
+
+def import_recover_files(journal):
+    """Move the orders saved by older versions of the
+    Agent, one file per order, into the journal.
+    """
+    try:
+        filenames = sorted(os.listdir(INSTANCES_FOLDER))
+    except FileNotFoundError:
+        return
+
+    for filename in filenames:
+        _, ext = os.path.splitext(filename)
+        if ext not in ('.start', '.stop'):
+            continue
+        fullpath = os.path.join(INSTANCES_FOLDER, filename)
+        with open(fullpath) as f:
+            lines = f.read().splitlines()
+        try:
+            if ext == '.start':
+                job_name, instance_id, scenario_id, owner_id, date_value, arguments = lines
+                journal.record_start(
+                        job_name, instance_id, scenario_id,
+                        owner_id, float(date_value), arguments)
+            else:
+                job_name, instance_id, date_value = lines
+                journal.record_stop(job_name, instance_id, float(date_value))
+        except ValueError:
+            syslog.syslog(
+                syslog.LOG_ERR,
+                'Error with the reading of {}'.format(fullpath))
+        os.remove(fullpath)
 
 
 def recover_old_state():
     """Read orders to start/stop jobs at a latter date and try to
     recover from a failure, depending of the current date.
     """
-    for root, _, filenames in os.walk(INSTANCES_FOLDER):
-        for filename in sorted(filenames):
-            fullpath = os.path.join(root, filename)
-            with open(fullpath) as f:
-                basename, ext = os.path.splitext(filename)
-                date = None
-                if ext == 'start':
-                    try:
-                        job_name, instance_id, scenario_id, owner_id, date_value, arguments = f.readlines()
-                        date_value = float(date_value)
-                    except ValueError:
-                        syslog.syslog(
-                            syslog.LOG_ERR,
-                            'Error with the reading of {}'.format(fullpath))
-                        continue
-                    date, result = schedule_job_instance(
-                            job_name, instance_id, scenario_id,
-                            owner_id, arguments, date_value,
-                            reschedule=True)
-                    if result:
-                        JobManager().add_instance(job_name, instance_id, arguments, 'date', date)
-                elif ext == 'stop':
-                    try:
-                        job_name, job_instance_id, date_value = f.readlines()
-                        date_value = float(date_value)
-                    except ValueError:
-                        syslog.syslog(
-                            syslog.LOG_ERR,
-                            'Error with the reading of {}'.format(fullpath))
-                        continue
-                    date = schedule_job_instance_stop(
-                            job_name, job_instance_id,
-                            date_value, reschedule=True)
-            if date is None:
-                os.remove(fullpath)
+    journal = RecoveryJournal()
+    journal.replay()
+    import_recover_files(journal)
+
+    for order in list(journal.orders.values()):
+        kind, job_name, job_instance_id, date_value, *details = order
+        try:
+            if kind == 'start':
+                scenario_id, owner_id, arguments, *placement = details
+                placement = Placement(**placement[0]) if placement else None
+                date, result = schedule_job_instance(
+                        job_name, job_instance_id, scenario_id,
+                        owner_id, arguments, date_value,
+                        reschedule=True, placement=placement)
+                if result and date is None:
+                    JobManager().add_instance(job_name, job_instance_id, arguments, 'date', date)
+            elif kind == 'stop':
+                schedule_job_instance_stop(
+                        job_name, job_instance_id,
+                        date_value, reschedule=True)
+        except (BadRequest, ValueError) as e:
+            syslog.syslog(
+                    syslog.LOG_ERR,
+                    'Cannot recover order {}: {}'.format(order, e))
+
+    # Orders whose date passed were either executed or missed
+    journal.compact()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '--history-size', type=int, default=INSTANCES_HISTORY_SIZE,
+            help='amount of finished Job Instances whose status is kept')
+    parser.add_argument(
+            '--history-retention', type=float, default=INSTANCES_HISTORY_RETENTION,
+            help='time, in seconds, during which the status '
+            'of finished Job Instances is kept')
+    parser.add_argument(
+            '--resources-interval', type=float, default=RESOURCES_SAMPLING_INTERVAL,
+            help='interval, in seconds, between two samples of the '
+            'resources used by each Job Instance, 0 to disable sampling')
+    args = parser.parse_args()
+    manager = JobManager()
+    manager.history_size = args.history_size
+    manager.history_retention = args.history_retention
+
     syslog.openlog('openbach_agent', syslog.LOG_PID, syslog.LOG_USER)
     signal.signal(signal.SIGTERM, signal_term_handler)
     signal.signal(signal.SIGINT, signal_term_handler)
+    ProcessSupervisor().install_signal_handler()
 
     populate_installed_jobs()
     recover_old_state()
+    if args.resources_interval > 0:
+        ResourcesSampler(args.resources_interval).start()
 
     server = AgentServer(('', 1112), RequestHandler)
     try:
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Windowed pre-aggregation of statistics in rstats.
+
+Statistics configured with an `aggregate` period in the filter file
+of a job are summarized over tumbling windows aligned on their
+timestamps, and only the summary is sent to the collector. Every
+summary is computed incrementally, in constant memory per window.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import re
+from numbers import Number
+
+from collect_agent_quantile import P2Quantile
+
+
+DEFAULT_FUNCTIONS = ('mean', 'min', 'max', 'count')
+DURATION_UNITS = {'ms': 1, 's': 1000, 'm': 60 * 1000, 'h': 3600 * 1000}
+DURATION_PATTERN = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*(ms|s|m|h)?\s*$')
+
+
+def parse_duration(duration):
+    """Convert a duration such as `500ms`, `1s` or `2m`
+    into milliseconds. Plain numbers are seconds.
+    """
+    match = DURATION_PATTERN.match(duration)
+    if match is None:
+        raise ValueError('invalid duration: {}'.format(duration))
+    value, unit = match.groups()
+    milliseconds = int(float(value) * DURATION_UNITS[unit or 's'])
+    if milliseconds <= 0:
+        raise ValueError('invalid duration: {}'.format(duration))
+    return milliseconds
+
+
+def parse_functions(functions):
+    """Convert a comma separated list of aggregation
+    functions into a tuple of their names.
+    """
+    if not functions:
+        return DEFAULT_FUNCTIONS
+    names = tuple(name.strip() for name in functions.split(',') if name.strip())
+    for name in names:
+        if name not in AGGREGATION_FUNCTIONS:
+            raise ValueError('unknown aggregation function: {}'.format(name))
+    return names
+
+
+class Window:
+    """Running summary of the values of a statistic received
+    during the window starting at `start` (in ms).
+    """
+
+    __slots__ = ('start', 'count', 'total', 'minimum', 'maximum', 'last', 'quantiles')
+
+    def __init__(self, start, functions):
+        self.start = start
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self.last = None
+        self.quantiles = {
+                name: P2Quantile(QUANTILES[name])
+                for name in functions if name in QUANTILES
+        }
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.last = value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        for quantile in self.quantiles.values():
+            quantile.add(value)
+
+    def summary(self, name, functions):
+        return {
+                '{}_{}'.format(name, function): AGGREGATION_FUNCTIONS[function](self)
+                for function in functions
+        }
+
+
+QUANTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99}
+AGGREGATION_FUNCTIONS = {
+        'mean': lambda window: window.total / window.count,
+        'min': lambda window: window.minimum,
+        'max': lambda window: window.maximum,
+        'count': lambda window: window.count,
+        'sum': lambda window: window.total,
+        'last': lambda window: window.last,
+}
+AGGREGATION_FUNCTIONS.update(
+        (name, lambda window, name=name: window.quantiles[name].value)
+        for name in QUANTILES)
+
+
+class Aggregator:
+    """Windows currently open for the statistics of a connection.
+
+    Adding a value or expiring windows return the summaries of the
+    windows that were completed, as a list of `(suffix, start, name,
+    summary)` tuples where `summary` maps each aggregated statistic
+    name to its value.
+    """
+
+    def __init__(self):
+        self._windows = {}
+
+    def add(self, suffix, name, timestamp, value, period, functions):
+        if not isinstance(value, Number) or isinstance(value, bool):
+            raise TypeError('only numbers can be aggregated')
+        completed = []
+        start = timestamp - timestamp % period
+        key = (suffix, name)
+        window = self._windows.get(key)
+        if window is None or window[0].start != start:
+            if window is not None:
+                completed.append(self._summarize(key, *window))
+            window = self._windows[key] = (Window(start, functions), period, functions)
+        window[0].add(value)
+        return completed
+
+    def expire(self, now):
+        """Close the windows ending before `now` (in ms)"""
+        expired = [
+                key for key, (window, period, _) in self._windows.items()
+                if window.start + period <= now
+        ]
+        return [self._summarize(key, *self._windows.pop(key)) for key in expired]
+
+    def drain(self):
+        """Close every open window"""
+        windows, self._windows = self._windows, {}
+        return [self._summarize(key, *window) for key, window in windows.items()]
+
+    @staticmethod
+    def _summarize(key, window, period, functions):
+        suffix, name = key
+        return suffix, window.start, name, window.summary(name, functions)
+
+    def __len__(self):
+        return len(self._windows)
@@ -41,19 +41,29 @@ __credits__ = '''Contributors:
 '''
 
 
+import sys
+import gzip
+import math
+import time
 import shlex
+import signal
 import socket
+import struct
+import asyncio
 import os.path
-import logging
+import argparse
 import functools
 import threading
 import contextlib
 import configparser
 import socketserver
-from itertools import groupby
-from time import strftime
+import http.client
+import concurrent.futures
+from urllib.parse import urlencode
+from itertools import count, islice
+from time import monotonic
 from datetime import datetime
-from collections import namedtuple
+from collections import namedtuple, defaultdict, OrderedDict, Counter
 try:
     import simplejson as json
 except ImportError:
@@ -61,10 +71,67 @@ except ImportError:
 
 import yaml
 
+from stats_store import StatsSegmentWriter
+from aggregation import Aggregator, parse_duration, parse_functions
+from collect_agent_quantile import P2Quantile
+from shared_memory import SharedMemoryRing, RingBufferError
+
 
 DEFAULT_LOG_PATH = '/var/openbach_stats/'
 RSTATS_CONFIG_FILE = '/opt/openbach/agent/rstats/rstats.yml'
 COLLECTOR_CONFIG_FILE = '/opt/openbach/agent/collector.yml'
+CONNECTION_TIMEOUT = 5
+RECONNECT_BACKOFF_MIN = 0.1
+RECONNECT_BACKOFF_MAX = 30
+MAX_DATAGRAM_SIZE = 1400
+BATCH_SIZE = 64
+INFLUXDB_COMPRESSION_LEVEL = 3
+INFLUXDB_PRECISIONS = {
+        'n': (10**6, 1),
+        'u': (10**3, 1),
+        'ms': (1, 1),
+        's': (1, 1000),
+        'm': (1, 60 * 1000),
+        'h': (1, 3600 * 1000),
+}
+INFLUXDB_TAGS = (
+        ('@agent_name', 'agent_name'),
+        ('@job_instance_id', 'job_instance_id'),
+        ('@owner_scenario_instance_id', 'owner_scenario_instance_id'),
+        ('@scenario_instance_id', 'scenario_instance_id'),
+        ('@suffix', 'suffix'),
+)
+BATCH_LATENCY = 0.05
+SPOOL_PATH = os.path.join(DEFAULT_LOG_PATH, 'rstats_spool')
+SPOOL_MAX_SIZE = 100 * 2**20
+SPOOL_MAX_AGE = 24 * 3600
+SPOOL_DRAIN_RATE = 1000
+SPOOL_DRAIN_PERIOD = 0.1
+SPOOL_SEGMENT_SIZE = 2**20
+MAX_OPEN_FILES = 256
+REAPER_INTERVAL = 60
+STORAGE_FLUSH_INTERVAL = 1
+AGENT_NAME_FILE = '/opt/openbach/agent/agent_name'
+RING_DRAIN_INTERVAL = 0.01
+RING_DRAIN_MAX_INTERVAL = 0.5
+RING_BUFFER_FOLDER = '/dev/shm'
+RING_BUFFER_PREFIX = 'openbach_rstats_'
+AGGREGATION_GRACE = 1000
+
+BINARY_PROTOCOL_VERSION = 2
+BINARY_MAGIC = b'\0'
+BINARY_HEADER = struct.Struct('!cBB')
+BINARY_SEND_STAT = struct.Struct('!IqH')
+BINARY_SEND_STATS = struct.Struct('!IH')
+BINARY_SAMPLE = struct.Struct('!qH')
+BINARY_STRING_LENGTH = struct.Struct('!H')
+BINARY_TYPE = struct.Struct('!B')
+BINARY_TYPE_STRING = 4
+BINARY_VALUES = {
+        1: struct.Struct('!q'),
+        2: struct.Struct('!d'),
+        3: struct.Struct('!?'),
+}
 
 BOOLEAN_TRUE = frozenset({'t', 'T', 'true', 'True', 'TRUE'})
 BOOLEAN_FALSE = frozenset({'f', 'F', 'false', 'False', 'FALSE'})
@@ -76,6 +143,21 @@ def grouper(iterable, n):
     return zip(*args)
 
 
+def parse_statistic(statistic_value):
+    """Convert a statistic value received as text to the
+    most suitable type.
+    """
+    with contextlib.suppress(ValueError):
+        return int(statistic_value)
+    with contextlib.suppress(ValueError):
+        return float(statistic_value)
+    if statistic_value in BOOLEAN_TRUE:
+        return True
+    if statistic_value in BOOLEAN_FALSE:
+        return False
+    return statistic_value
+
+
 class BadRequest(ValueError):
     """Base exception for this module"""
     def __init__(self, reason):
@@ -83,64 +165,730 @@ class BadRequest(ValueError):
         self.reason = reason
 
 
-@functools.lru_cache(maxsize=1)
-def get_statistics_sender():
-    """Build the function that will route data to the logstash
-    server based on the provided configuration files.
+class LogstashSender:
+    """Base class for the objects routing statistics to logstash.
+
+    Keep track of the amount of messages sent and of the cumulated
+    time spent sending them so the cost of the chosen transport can
+    be monitored.
     """
 
-    with open(COLLECTOR_CONFIG_FILE) as stream:
-        content = yaml.load(stream)
-    host = content['address']
-    port = content['stats']['port']
-    address = (host, int(port))
+    def __init__(self, address):
+        self.address = address
+        self._mutex = threading.Lock()
+        self.messages_sent = 0
+        self.send_latency = 0.0
+        self.max_send_latency = 0.0
+        self._latency_quantiles = {
+                'p50': P2Quantile(0.5),
+                'p99': P2Quantile(0.99),
+        }
 
-    # Build functions to send stats to the configured address
+    def __call__(self, *messages):
+        """Send the given JSON messages, one per line"""
+        start = time.perf_counter()
+        with self._mutex:
+            self._send([message.encode() + b'\n' for message in messages])
+            latency = time.perf_counter() - start
+            self.messages_sent += len(messages)
+            self.send_latency += latency
+            self.max_send_latency = max(self.max_send_latency, latency)
+            for quantile in self._latency_quantiles.values():
+                quantile.add(latency)
+
+    def _send(self, lines):
+        raise NotImplementedError
+
+    def statistics(self):
+        with self._mutex:
+            count = self.messages_sent
+            latency = self.send_latency
+            statistics = {
+                    'send_latency_' + name: quantile.value or 0.0
+                    for name, quantile in self._latency_quantiles.items()
+            }
+            statistics['send_latency_max'] = self.max_send_latency
+        average = latency / count if count else 0.0
+        statistics.update({
+                'messages_sent': count,
+                'send_latency': latency,
+                'average_send_latency': average,
+        })
+        return statistics
+
+    def close(self):
+        pass
 
     @contextlib.contextmanager
-    def socket_error_to_bad_request(message):
+    def _socket_error_to_bad_request(self, message):
         """Helper context manager aimed at reducing boilerplate code"""
         try:
             yield
-        except socket.error as err:
-            raise BadRequest(message.format(*err))
+        except OSError as err:
+            raise BadRequest(message.format(err.errno, err.strerror))
+
+
+class UDPSender(LogstashSender):
+    """Send statistics through a single socket, packing as many
+    lines as possible in each datagram without exceeding
+    `max_datagram_size`.
+    """
 
-    def send_udp(data):
-        with socket_error_to_bad_request('Failed to create socket'):
-            logstash = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    def __init__(self, address, max_datagram_size=MAX_DATAGRAM_SIZE):
+        super().__init__(address)
+        self.max_datagram_size = max_datagram_size
+        with self._socket_error_to_bad_request('Failed to create socket: {} {}'):
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # Connect the socket so that ICMP errors are reported
+            # on the following sends when the collector is down
+            self._socket.connect(address)
+
+    def _send(self, lines):
+        datagram = bytearray()
+        for line in lines:
+            if datagram and len(datagram) + len(line) > self.max_datagram_size:
+                self._send_datagram(datagram)
+                datagram = bytearray()
+            datagram += line
+        if datagram:
+            self._send_datagram(datagram)
+
+    def _send_datagram(self, datagram):
+        with self._socket_error_to_bad_request('Error code: {}, Message {}'):
+            self._socket.send(datagram)
+
+    def close(self):
+        self._socket.close()
+
+
+class TCPSender(LogstashSender):
+    """Send statistics as newline-delimited JSON through a long-lived
+    connection to logstash.
+
+    The connection is lazily (re)opened when needed. Failed connection
+    attempts are spaced using a bounded exponential backoff so that an
+    unreachable collector does not cost a connect per statistic.
+    """
+
+    def __init__(self, address, backoff_min=RECONNECT_BACKOFF_MIN,
+                 backoff_max=RECONNECT_BACKOFF_MAX):
+        super().__init__(address)
+        self._socket = None
+        self._backoff_min = backoff_min
+        self._backoff_max = backoff_max
+        self._backoff = 0
+        self._next_attempt = 0
+
+    def _connect(self):
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise BadRequest(
+                    'Failed to connect to server: retrying '
+                    'in {:.1f}s'.format(self._next_attempt - now))
+
+        try:
+            self._socket = socket.create_connection(self.address, timeout=CONNECTION_TIMEOUT)
+        except OSError as err:
+            self._backoff = min(max(2 * self._backoff, self._backoff_min), self._backoff_max)
+            self._next_attempt = now + self._backoff
+            raise BadRequest('Failed to connect to server: {}'.format(err))
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._backoff = 0
+
+    def _close(self):
+        if self._socket is not None:
+            with contextlib.suppress(OSError):
+                self._socket.close()
+            self._socket = None
+
+    def _send(self, lines):
+        data = b''.join(lines)
+        reconnected = self._socket is None
+        if reconnected:
+            self._connect()
+
+        try:
+            self._socket.sendall(data)
+        except OSError as err:
+            self._close()
+            if reconnected:
+                raise BadRequest('Error code: {}, Message {}'.format(err.errno, err.strerror))
+            # The long-lived connection may have been closed by the
+            # remote end since the last use, try once on a fresh one
+            self._connect()
+            try:
+                self._socket.sendall(data)
+            except OSError as err:
+                self._close()
+                raise BadRequest('Error code: {}, Message {}'.format(err.errno, err.strerror))
+
+    def close(self):
+        with self._mutex:
+            self._close()
 
-        with logstash:
-            with socket_error_to_bad_request('Error code: {}, Message {}'):
-                logstash.sendto(data.encode(), address)
 
-    def send_tcp(data):
-        with socket_error_to_bad_request('Failed to create socket'):
-            logstash = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+def _escape_line_protocol(text, characters):
+    text = str(text)
+    for character in characters:
+        text = text.replace(character, '\\' + character)
+    return text
 
-        with logstash:
-            with socket_error_to_bad_request('Failed to connect to server'):
-                logstash.connect(address)
-            with socket_error_to_bad_request('Error code: {}, Message {}'):
-                logstash.send(data.encode())
+
+class InfluxDBSender(LogstashSender):
+    """Write statistics straight into InfluxDB, using batched
+    and compressed line protocol requests sent through a
+    keep-alive HTTP connection, instead of going through logstash.
+
+    Points use the same measurement (the job name) and tags than
+    the ones produced by the logstash pipeline so they can be
+    queried the same way. Statistics flagged for broadcast are
+    still forwarded to logstash through `broadcast_sender`, with
+    their flag set to broadcast only (2) when they are also
+    written here, so logstash does not store them a second time.
+    """
+
+    def __init__(self, address, database, precision='ms', broadcast_sender=None,
+                 backoff_min=RECONNECT_BACKOFF_MIN, backoff_max=RECONNECT_BACKOFF_MAX):
+        super().__init__(address)
+        try:
+            self._multiplier, self._divisor = INFLUXDB_PRECISIONS[precision]
+        except KeyError:
+            raise BadRequest('InfluxDB precision not known: {}'.format(precision))
+        self.path = '/write?' + urlencode({'db': database, 'rp': database, 'precision': precision})
+        self.broadcast_sender = broadcast_sender
+        self.points_written = 0
+        self.points_rejected = 0
+        self.bytes_written = 0
+        self._connection = None
+        self._backoff_min = backoff_min
+        self._backoff_max = backoff_max
+        self._backoff = 0
+        self._next_attempt = 0
+
+    def _send(self, lines):
+        points = []
+        broadcast = []
+        for line in lines:
+            message = line.decode().rstrip('\n')
+            statistics = json.loads(message)
+            metadata = statistics['_metadata']
+            flag = metadata.get('flag', 0)
+            if flag & 2:
+                if flag & 1:
+                    message = json.dumps(dict(statistics, _metadata=dict(metadata, flag=2)))
+                broadcast.append(message)
+            if flag & 1:
+                point = self._format_point(statistics)
+                if point is not None:
+                    points.append(point)
+
+        if points:
+            self._write('\n'.join(points).encode())
+        if broadcast and self.broadcast_sender is not None:
+            self.broadcast_sender(*broadcast)
+
+    def _format_point(self, statistics):
+        """Convert a statistic to a line of the InfluxDB
+        line protocol, mimicking logstash influxdb output.
+        """
+        metadata = statistics.pop('_metadata')
+        fields = []
+        for name, value in statistics.items():
+            name = _escape_line_protocol(name, ', =')
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            elif isinstance(value, int):
+                value = '{}i'.format(value)
+            elif isinstance(value, float):
+                if not math.isfinite(value):
+                    continue
+                value = repr(value)
+            else:
+                value = '"{}"'.format(_escape_line_protocol(value, '\\"'))
+            fields.append('{}={}'.format(name, value))
+        if not fields:
+            return None
+
+        tags = ''.join(
+                ',{}={}'.format(tag, _escape_line_protocol(metadata[key], ', ='))
+                for tag, key in INFLUXDB_TAGS
+                if metadata.get(key, '') != ''
+        )
+        measurement = _escape_line_protocol(metadata['job_name'], ', ')
+        timestamp = int(metadata['time']) * self._multiplier // self._divisor
+        return '{}{} {} {}'.format(measurement, tags, ','.join(fields), timestamp)
+
+    def _write(self, body):
+        data = gzip.compress(body, INFLUXDB_COMPRESSION_LEVEL)
+        reconnected = self._connection is None
+        if reconnected:
+            self._connect()
+
+        try:
+            response = self._post(data)
+        except (OSError, http.client.HTTPException) as err:
+            self._close()
+            if reconnected:
+                raise BadRequest('Failed to write to InfluxDB: {}'.format(err))
+            # The keep-alive connection may have been closed by
+            # InfluxDB since the last use, try once on a fresh one
+            self._connect()
+            try:
+                response = self._post(data)
+            except (OSError, http.client.HTTPException) as err:
+                self._close()
+                raise BadRequest('Failed to write to InfluxDB: {}'.format(err))
+
+        points = body.count(b'\n') + 1
+        if response.status >= 500:
+            raise BadRequest('InfluxDB failed to write points: {} {}'.format(
+                response.status, response.reason))
+        if response.status >= 300:
+            # Retrying will not help, do not spool these points
+            self.points_rejected += points
+        else:
+            self.points_written += points
+            self.bytes_written += len(data)
+
+    def _post(self, data):
+        self._connection.request('POST', self.path, data, {
+            'Content-Encoding': 'gzip',
+            'Content-Type': 'text/plain; charset=utf-8',
+        })
+        response = self._connection.getresponse()
+        # Read the whole response so the connection can be reused
+        response.read()
+        if response.will_close:
+            self._close()
+        return response
+
+    def _connect(self):
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise BadRequest(
+                    'Failed to connect to InfluxDB: retrying '
+                    'in {:.1f}s'.format(self._next_attempt - now))
+
+        host, port = self.address
+        connection = http.client.HTTPConnection(host, port, timeout=CONNECTION_TIMEOUT)
+        try:
+            connection.connect()
+        except OSError as err:
+            self._backoff = min(max(2 * self._backoff, self._backoff_min), self._backoff_max)
+            self._next_attempt = now + self._backoff
+            raise BadRequest('Failed to connect to InfluxDB: {}'.format(err))
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._connection = connection
+        self._backoff = 0
+
+    def _close(self):
+        if self._connection is not None:
+            with contextlib.suppress(OSError):
+                self._connection.close()
+            self._connection = None
+
+    def statistics(self):
+        statistics = super().statistics()
+        with self._mutex:
+            statistics.update({
+                'points_written': self.points_written,
+                'points_rejected': self.points_rejected,
+                'bytes_written': self.bytes_written,
+            })
+        return statistics
+
+    def close(self):
+        with self._mutex:
+            self._close()
+        if self.broadcast_sender is not None:
+            self.broadcast_sender.close()
+
+
+class SpoolSegment:
+    """Bookkeeping of a file of the spool"""
+
+    def __init__(self, path, created, messages=0, size=0):
+        self.path = path
+        self.created = created
+        self.messages = messages
+        self.size = size
+        self.offset = 0
+        self.drained = 0
+
+
+class StatisticsSpool:
+    """Store-and-forward buffer in front of a sender.
+
+    Messages that can not be sent because the collector is unreachable
+    are appended to segment files in `path` instead of being lost. A
+    background thread drains the oldest segments, at most `drain_rate`
+    messages per second, as soon as the collector can be reached again.
+    Whole segments are discarded, oldest first, when the spool grows
+    beyond `max_size` bytes or when they are older than `max_age`
+    seconds.
+
+    Messages may be sent twice if rstats stops while a segment is being
+    drained; this is harmless as InfluxDB overwrites identical points.
+    """
+
+    def __init__(self, sender, path, max_size=SPOOL_MAX_SIZE,
+                 max_age=SPOOL_MAX_AGE, drain_rate=SPOOL_DRAIN_RATE,
+                 segment_size=SPOOL_SEGMENT_SIZE):
+        self.sender = sender
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.drain_rate = drain_rate
+        self.segment_size = segment_size
+        self.messages_spooled = 0
+        self.messages_drained = 0
+        self.messages_expired = 0
+        self.measured_drain_rate = 0.0
+        self._segments = OrderedDict()
+        self._current = None
+        self._current_file = None
+        self._sequence = count()
+        self._running = True
+        self._condition = threading.Condition()
+
+        os.makedirs(path, exist_ok=True)
+        for filename in sorted(os.listdir(path)):
+            name, ext = os.path.splitext(filename)
+            if ext != '.spool':
+                continue
+            filepath = os.path.join(path, filename)
+            with open(filepath, 'rb') as segment:
+                messages = sum(1 for _ in segment)
+            created = int(name.split('-')[0]) / 1000
+            self._segments[filepath] = SpoolSegment(
+                    filepath, created, messages,
+                    os.path.getsize(filepath))
+
+        self._drainer = threading.Thread(target=self._drain, daemon=True)
+        self._drainer.start()
+
+    def __call__(self, *messages):
+        try:
+            self.sender(*messages)
+        except BadRequest:
+            self.store(messages)
+
+    def store(self, messages):
+        data = ''.join(message + '\n' for message in messages).encode()
+        with self._condition:
+            try:
+                if self._current is None or self._current.size >= self.segment_size:
+                    self._rotate()
+                self._current_file.write(data)
+                self._current_file.flush()
+            except OSError as err:
+                raise BadRequest('Failed to spool statistics: {}'.format(err))
+            self._current.messages += len(messages)
+            self._current.size += len(data)
+            self.messages_spooled += len(messages)
+            self._enforce_limits()
+            self._condition.notify()
+
+    def _rotate(self):
+        self._close_current()
+        now = time.time()
+        filename = '{:013d}-{:06d}.spool'.format(int(now * 1000), next(self._sequence))
+        filepath = os.path.join(self.path, filename)
+        self._current_file = open(filepath, 'ab')
+        self._current = self._segments[filepath] = SpoolSegment(filepath, now)
+
+    def _close_current(self):
+        if self._current_file is not None:
+            self._current_file.close()
+        self._current_file = None
+        self._current = None
+
+    def _remove_segment(self, segment):
+        if segment is self._current:
+            self._close_current()
+        del self._segments[segment.path]
+        with contextlib.suppress(OSError):
+            os.remove(segment.path)
+
+    def _enforce_limits(self):
+        expiration = time.time() - self.max_age
+        size = sum(segment.size - segment.offset for segment in self._segments.values())
+        for segment in list(self._segments.values()):
+            if segment.created >= expiration and size <= self.max_size:
+                break
+            size -= segment.size - segment.offset
+            self.messages_expired += segment.messages - segment.drained
+            self._remove_segment(segment)
+
+    def _wait(self, timeout):
+        """Wait for `timeout` seconds, or less if the spool is
+        closed in the meantime. Return whether it is still running.
+
+        Messages stored in the meantime do not shorten the wait, so
+        that the reconnection backoff and the drain rate still hold
+        while the collector is unreachable.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: not self._running, timeout)
+            return self._running
+
+    def _drain(self):
+        backoff = RECONNECT_BACKOFF_MIN
+        while True:
+            with self._condition:
+                while self._running and not self._segments:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                self._enforce_limits()
+                if not self._segments:
+                    continue
+                segment = next(iter(self._segments.values()))
+                if segment is self._current:
+                    # Stop appending to the segment we are about to read
+                    self._close_current()
+
+            try:
+                self._drain_segment(segment)
+            except BadRequest:
+                if not self._wait(backoff):
+                    return
+                backoff = min(2 * backoff, RECONNECT_BACKOFF_MAX)
+            else:
+                backoff = RECONNECT_BACKOFF_MIN
+
+    def _drain_segment(self, segment):
+        chunk_size = max(1, int(self.drain_rate * SPOOL_DRAIN_PERIOD))
+        with open(segment.path, 'rb') as stream:
+            stream.seek(segment.offset)
+            while True:
+                start = time.monotonic()
+                lines = list(islice(stream, chunk_size))
+                if not lines:
+                    break
+                self.sender(*(line.decode().rstrip('\n') for line in lines))
+                with self._condition:
+                    if segment.path not in self._segments:
+                        # Expired while we were sending it
+                        return
+                    segment.offset += sum(map(len, lines))
+                    segment.drained += len(lines)
+                    self.messages_drained += len(lines)
+                elapsed = max(len(lines) / self.drain_rate - (time.monotonic() - start), 0)
+                if not self._wait(elapsed):
+                    return
+                rate = len(lines) / (time.monotonic() - start)
+                self.measured_drain_rate = 0.8 * self.measured_drain_rate + 0.2 * rate
+
+        with self._condition:
+            if segment.path in self._segments:
+                self._remove_segment(segment)
+            if not self._segments:
+                self.measured_drain_rate = 0.0
+
+    def statistics(self):
+        statistics = self.sender.statistics()
+        with self._condition:
+            segments = self._segments.values()
+            statistics.update({
+                'spool_backlog': sum(s.messages - s.drained for s in segments),
+                'spool_backlog_size': sum(s.size - s.offset for s in segments),
+                'spool_segments': len(self._segments),
+                'messages_spooled': self.messages_spooled,
+                'messages_drained': self.messages_drained,
+                'messages_expired': self.messages_expired,
+                'spool_drain_rate': self.measured_drain_rate,
+            })
+        return statistics
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._drainer.join()
+        with self._condition:
+            self._close_current()
+        self.sender.close()
+
+
+class StatisticsBatcher:
+    """Accumulate messages in front of a sender and forward them
+    in batches.
+
+    A batch is flushed as soon as it holds `max_size` messages, when
+    its oldest message has been waiting for `max_latency` seconds or
+    when the batcher is closed. Since messages are sent asynchronously,
+    sending errors can not be reported back to the jobs: the messages
+    of a failed batch are counted as dropped instead.
+    """
+
+    def __init__(self, sender, max_size=BATCH_SIZE, max_latency=BATCH_LATENCY):
+        self.sender = sender
+        self.max_size = max_size
+        self.max_latency = max_latency
+        self.messages_dropped = 0
+        self._pending = []
+        self._deadline = None
+        self._running = True
+        self._condition = threading.Condition()
+        self._flusher = threading.Thread(target=self._flush_on_deadline, daemon=True)
+        self._flusher.start()
+
+    def __call__(self, message):
+        with self._condition:
+            if not self._pending:
+                self._deadline = time.monotonic() + self.max_latency
+                self._condition.notify()
+            self._pending.append(message)
+            if len(self._pending) < self.max_size:
+                return
+            batch = self._take_pending()
+        self._send(batch)
+
+    def _take_pending(self):
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _send(self, batch):
+        if not batch:
+            return
+
+        try:
+            self.sender(*batch)
+        except BadRequest:
+            with self._condition:
+                self.messages_dropped += len(batch)
+
+    def _timeout(self):
+        if not self._pending:
+            return None
+        return self._deadline - time.monotonic()
+
+    def _flush_on_deadline(self):
+        running = True
+        while running:
+            with self._condition:
+                timeout = self._timeout()
+                while self._running and (timeout is None or timeout > 0):
+                    self._condition.wait(timeout)
+                    timeout = self._timeout()
+                running = self._running
+                batch = self._take_pending()
+            self._send(batch)
+
+    def statistics(self):
+        statistics = self.sender.statistics()
+        with self._condition:
+            statistics['messages_pending'] = len(self._pending)
+            statistics['messages_dropped'] = self.messages_dropped
+        return statistics
+
+    def close(self):
+        """Flush pending messages and stop the background flusher"""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._flusher.join()
+        self.sender.close()
+
+
+@functools.lru_cache(maxsize=1)
+def get_statistics_sender():
+    """Build the object that will route data to the logstash
+    server based on the provided configuration files.
+    """
+
+    with open(COLLECTOR_CONFIG_FILE) as stream:
+        content = yaml.load(stream)
+    host = content['address']
+    collector_stats = content['stats']
+    address = (host, int(collector_stats['port']))
 
     with open(RSTATS_CONFIG_FILE) as stream:
         content = yaml.load(stream)
+    logstash = content['logstash']
 
-    # Select the right function to use based on the configured mode
+    # Select the right sender to use based on the configured mode
     try:
-        return {
-            'tcp': send_tcp,
-            'udp': send_udp,
-        }[content['logstash']['mode']]
+        mode = logstash['mode']
+        if mode == 'udp':
+            sender = UDPSender(address, logstash.get('max_datagram_size', MAX_DATAGRAM_SIZE))
+        elif mode == 'tcp':
+            sender = TCPSender(address)
+        elif mode == 'influxdb':
+            # Broadcast statistics are still routed through logstash
+            sender = InfluxDBSender(
+                    (host, int(collector_stats['query'])),
+                    collector_stats['database'],
+                    collector_stats.get('precision', 'ms'),
+                    UDPSender(address, logstash.get('max_datagram_size', MAX_DATAGRAM_SIZE)))
+        else:
+            raise KeyError(mode)
     except KeyError:
         raise BadRequest('Mode not known')
 
+    spool = content.get('spool')
+    if spool:
+        sender = StatisticsSpool(
+                sender, spool.get('path', SPOOL_PATH),
+                int(spool.get('max_size', SPOOL_MAX_SIZE // 2**20)) * 2**20,
+                int(spool.get('max_age', SPOOL_MAX_AGE)),
+                int(spool.get('drain_rate', SPOOL_DRAIN_RATE)))
+
+    batch = logstash.get('batch') or {}
+    size = int(batch.get('size', BATCH_SIZE))
+    latency = int(batch.get('latency', BATCH_LATENCY * 1000)) / 1000
+    if size <= 1:
+        return sender
+    return StatisticsBatcher(sender, size, latency)
+
+
+class OpenStatsFiles:
+    """Borg keeping track of the statistics files currently opened
+    and closing the least recently used ones when there are more
+    than `max_open_files` of them.
+    """
+
+    __shared_state = {
+            'handlers': OrderedDict(),
+            'mutex': threading.Lock(),
+            'max_open_files': MAX_OPEN_FILES,
+            'writer_options': {},
+    }
+
+    def __init__(self):
+        self.__dict__ = self.__class__.__shared_state
+
+    def use(self, handler):
+        with self.mutex:
+            handler.use()
+            self.handlers[handler] = None
+            self.handlers.move_to_end(handler)
+            while len(self.handlers) > self.max_open_files:
+                least_recently_used, _ = self.handlers.popitem(last=False)
+                least_recently_used.release_stream()
+
+    def forget(self, handler):
+        with self.mutex:
+            self.handlers.pop(handler, None)
+            handler.close()
+
+    def flush(self):
+        with self.mutex:
+            handlers = list(self.handlers)
+        for handler in handlers:
+            handler.flush()
+
+    def __len__(self):
+        with self.mutex:
+            return len(self.handlers)
+
 
 class Rstats:
-    def __init__(self, connection_id, logpath=DEFAULT_LOG_PATH, confpath='',
+    def __init__(self, connection_id, logpath=None, confpath='',
                  suffix=None, job_name=None, job_instance_id=0,
                  scenario_instance_id=0, owner_scenario_instance_id=0,
-                 agent_name='agent_name_not_found', reset_handlers=False):
+                 agent_name='agent_name_not_found'):
         self._mutex = threading.Lock()
         self.metadata = {
                 'job_name': 'rstats' if job_name is None else job_name,
@@ -151,27 +899,44 @@ class Rstats:
         }
         if suffix is not None:
             self.metadata['suffix'] = suffix
+        self.last_activity = time.monotonic()
 
-        self._logger = logging.getLogger('rstats-{}'.format(connection_id))
-        if reset_handlers:
-            for handler in self._logger.handlers:
-                self._logger.removeHandler(handler)
-
-        if not self._logger.hasHandlers():
-            self._logger.setLevel(logging.INFO)
-            filename = '{}_{}.stats'.format(self.metadata['job_name'], strftime("%Y-%m-%dT%H%M%S"))
-            logfile = os.path.join(logpath, self.metadata['job_name'], filename)
-            try:
-                fhd = logging.FileHandler(logfile, mode='a')
-            except OSError:
-                pass
-            else:
-                fhd.setFormatter(logging.Formatter('{message}', style='{'))
-                self._logger.addHandler(fhd)
-
+        if logpath is None:
+            logpath = DEFAULT_LOG_PATH
+        folder = os.path.join(logpath, self.metadata['job_name'])
+        try:
+            self._storage = StatsSegmentWriter(
+                    folder, self.metadata,
+                    **OpenStatsFiles().writer_options)
+        except OSError:
+            self._storage = None
+
+        self._aggregator = Aggregator()
+        self._ring = None
+        self.counters = dict.fromkeys((
+                'messages_received', 'messages_sent', 'messages_broadcast',
+                'messages_storage_only', 'messages_local_only',
+                'statistics_aggregated', 'summaries_sent',
+                'ring_records_invalid'), 0)
         self._confpath = confpath
         self.reload_conf()
 
+    def close(self):
+        """Release the resources associated to this connection"""
+        with contextlib.suppress(BadRequest):
+            # Do not lose the last records written by the job
+            self.drain_ring()
+        with self._mutex:
+            ring, self._ring = self._ring, None
+            if ring is not None:
+                ring.close()
+            with contextlib.suppress(BadRequest):
+                self._send_summaries(self._aggregator.drain())
+            if self._storage is not None:
+                with contextlib.suppress(OSError):
+                    OpenStatsFiles().forget(self._storage)
+                self._storage = None
+
     def reload_conf(self):
         config = configparser.ConfigParser()
         with self._mutex:
@@ -184,60 +949,250 @@ class Rstats:
                 return
 
             self._rules.update(
-                    (name, RstatsRule(name,
-                                      section.getboolean('storage'),
-                                      section.getboolean('broadcast')))
+                    (name, RstatsRule.from_section(name, section))
                     for name, section in config.items()
             )
 
     def send_stat(self, suffix, time, stats):
         with self._mutex:
+            self.last_activity = monotonic()
             statistics_metadata = {'time': time, **self.metadata}
             if suffix is not None:
                 statistics_metadata['suffix'] = suffix
 
-            statistics_by_flag = sorted((
-                {statistic_name: self._parse(value)}
-                for statistic_name, value in stats.items()
-            ), key=self._get_flag)
+            statistics_by_flag = defaultdict(dict)
+            for statistic_name, value in stats.items():
+                statistics_by_flag[self._get_rule(statistic_name).flag][statistic_name] = value
 
-            for flag, statistics_group in groupby(statistics_by_flag, self._get_flag):
+            summaries = []
+            for flag, statistics in sorted(statistics_by_flag.items()):
                 statistics_metadata['flag'] = flag
-                statistics = {
-                        k: v
-                        for statistic in statistics_group
-                        for k, v in statistic.items()
-                }
+                aggregated = [
+                        name for name, value in statistics.items()
+                        if flag != 0 and self._aggregate(suffix, name, time, value, summaries)
+                ]
                 statistics['_metadata'] = statistics_metadata
                 message_to_send = json.dumps(statistics)
-                if flag != 0:
-                    get_statistics_sender()(message_to_send)
-                self._logger.info(message_to_send)
+                if flag == 0:
+                    self.counters['messages_local_only'] += 1
+                elif len(aggregated) + 1 < len(statistics):
+                    if aggregated:
+                        # Only broadcast the statistics that are not summarized
+                        raw_statistics = {
+                                k: v for k, v in statistics.items()
+                                if k not in aggregated
+                        }
+                        self._send(json.dumps(raw_statistics), flag)
+                    else:
+                        self._send(message_to_send, flag)
+                self._store(message_to_send, time)
+            self.counters['messages_received'] += 1
+            self._send_summaries(summaries)
+
+    def _send(self, message, flag):
+        get_statistics_sender()(message)
+        self.counters['messages_sent'] += 1
+        if flag & 2:
+            self.counters['messages_broadcast'] += 1
+        else:
+            self.counters['messages_storage_only'] += 1
 
-    def _get_flag(self, statistic_holder):
-        statistic_name, = statistic_holder
+    def attach_ring(self, ring):
+        """Use `ring` as an additional source of statistics"""
+        with contextlib.suppress(BadRequest):
+            self.drain_ring()
+        with self._mutex:
+            previous, self._ring = self._ring, ring
+        if previous is not None:
+            previous.close()
+
+    @property
+    def ring_attached(self):
+        return self._ring is not None
+
+    def drain_ring(self):
+        """Process the statistics written in the ring buffer of
+        this connection, if any. Return the amount of records read.
+        """
+        ring = self._ring
+        if ring is None:
+            return 0
         try:
-            return self._rules[statistic_name].flag
+            records = ring.read()
+        except RingBufferError:
+            with self._mutex:
+                if self._ring is ring:
+                    self._ring = None
+            ring.close()
+            raise BadRequest('Ring buffer of connection corrupted, detaching it')
+
+        for record in records:
+            try:
+                _, timestamp, suffix, statistics = decode_binary_stat(record, 0)
+                _check_timestamp(timestamp)
+            except (BadRequest, struct.error, UnicodeDecodeError):
+                with self._mutex:
+                    self.counters['ring_records_invalid'] += 1
+                continue
+            self.send_stat(suffix, timestamp, statistics)
+        return len(records)
+
+    def _aggregate(self, suffix, name, time, value, summaries):
+        """Feed the value of a statistic to its aggregation window,
+        if any, and collect the summaries of the completed windows.
+        Return whether the value was aggregated.
+        """
+        rule = self._get_rule(name)
+        if not rule.aggregate:
+            return False
+        try:
+            completed = self._aggregator.add(
+                    suffix, name, time, value,
+                    rule.aggregate, rule.functions)
+        except TypeError:
+            return False
+        summaries.extend(completed)
+        self.counters['statistics_aggregated'] += 1
+        return True
+
+    def flush_aggregates(self, now=None):
+        """Send the summaries of the aggregation windows that
+        ended more than AGGREGATION_GRACE milliseconds ago.
+        """
+        if now is None:
+            now = int(time.time() * 1000)
+        with self._mutex:
+            self._send_summaries(self._aggregator.expire(now - AGGREGATION_GRACE))
+
+    def _send_summaries(self, summaries):
+        """Send the summaries of completed aggregation windows,
+        grouped by suffix, window and flag of their statistic.
+        """
+        messages = OrderedDict()
+        for suffix, start, name, summary in summaries:
+            flag = self._get_rule(name).flag
+            messages.setdefault((suffix, start, flag), {}).update(summary)
+
+        for (suffix, start, flag), statistics in messages.items():
+            if flag == 0:
+                # Filter reloaded while the window was open
+                continue
+            statistics_metadata = {'time': start, **self.metadata, 'flag': flag}
+            if suffix is not None:
+                statistics_metadata['suffix'] = suffix
+            statistics['_metadata'] = statistics_metadata
+            self._send(json.dumps(statistics), flag)
+            self.counters['summaries_sent'] += 1
+
+    def statistics(self):
+        """Activity counters of this connection"""
+        with self._mutex:
+            statistics = dict(self.counters)
+            statistics['open_windows'] = len(self._aggregator)
+            ring = self._ring
+        if ring is not None:
+            statistics['ring_records_read'] = ring.records_read
+            statistics['ring_pending_bytes'] = ring.pending
+            statistics['ring_overflows'] = ring.overflows
+        statistics.update(self.metadata)
+        statistics['idle_time'] = monotonic() - self.last_activity
+        return statistics
+
+    def _store(self, message, timestamp):
+        if self._storage is None:
+            return
+        try:
+            OpenStatsFiles().use(self._storage)
+            self._storage.write(message, timestamp)
+        except OSError:
+            # Keep broadcasting statistics even if the disk is full
+            pass
+
+    def _get_rule(self, statistic_name):
+        try:
+            return self._rules[statistic_name]
         except KeyError:
-            return self._rules['default'].flag
+            return self._rules['default']
 
-    @staticmethod
-    def _parse(statistic_value):
-        with contextlib.suppress(ValueError):
-            return int(statistic_value)
-        with contextlib.suppress(ValueError):
-            return float(statistic_value)
-        if statistic_value in BOOLEAN_TRUE:
-            return True
-        if statistic_value in BOOLEAN_FALSE:
-            return False
-        return statistic_value
 
+class FiltersWatcher(threading.Thread):
+    """Periodically check the filter files used by the open
+    connections and reload the rules of the connections whose
+    file changed, or appeared, since the last check.
+    """
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self._modification_times = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        connections_by_filter = defaultdict(list)
+        for _, client_connection in StatsManager():
+            connections_by_filter[client_connection._confpath].append(client_connection)
+
+        modification_times = {}
+        for confpath, connections in connections_by_filter.items():
+            try:
+                modification_time = os.stat(confpath).st_mtime
+            except OSError:
+                modification_time = None
+            modification_times[confpath] = modification_time
+
+            try:
+                known_time = self._modification_times[confpath]
+            except KeyError:
+                # Connections just loaded this file
+                continue
+            if known_time != modification_time:
+                for client_connection in connections:
+                    client_connection.reload_conf()
+        self._modification_times = modification_times
+
+    def stop(self):
+        self._stopped.set()
+
+
+class RstatsRule(namedtuple('RstatsRule', 'name storage broadcast aggregate functions')):
+    """Routing of a statistic, as read from a section of a filter file:
+
+        [rtt]
+        storage=true
+        broadcast=true
+        aggregate=1s
+        functions=mean,max,p99
+
+    When `aggregate` is set, numeric values of the statistic are only
+    sent to the collector as one summary per window (`rtt_mean`,
+    `rtt_max` and `rtt_p99` here); raw values are still kept locally.
+    """
 
-class RstatsRule(namedtuple('RstatsRule', 'name storage broadcast')):
     ACCEPT = True
     DENY = False
 
+    def __new__(cls, name, storage, broadcast, aggregate=None, functions=()):
+        return super().__new__(cls, name, storage, broadcast, aggregate, functions)
+
+    @classmethod
+    def from_section(cls, name, section):
+        """Build a rule from a section of a filter file. Invalid
+        aggregation settings disable the aggregation.
+        """
+        aggregate, functions = None, ()
+        try:
+            if section.get('aggregate'):
+                aggregate = parse_duration(section['aggregate'])
+                functions = parse_functions(section.get('functions'))
+        except ValueError:
+            aggregate, functions = None, ()
+        return cls(name, section.getboolean('storage'),
+                   section.getboolean('broadcast'), aggregate, functions)
+
     @property
     def flag(self):
         return bool(self.storage) + 2 * bool(self.broadcast)
@@ -247,10 +1202,58 @@ class RstatsRule(namedtuple('RstatsRule', 'name storage broadcast')):
         return 'ACCEPT' if rule_value else 'DENY'
 
     def __str__(self):
-        return 'storage: {}, broadcast: {} for {}'.format(
+        rule = 'storage: {}, broadcast: {} for {}'.format(
                 self._rule_to_str(self.storage),
                 self._rule_to_str(self.broadcast),
                 self.name)
+        if self.aggregate:
+            rule += ' ({} aggregated over {}ms)'.format(
+                    ', '.join(self.functions), self.aggregate)
+        return rule
+
+
+class MeasuredLock:
+    """Lock keeping track of the time spent waiting to acquire it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def acquire(self):
+        if self._lock.acquire(blocking=False):
+            waited = 0.0
+        else:
+            start = time.perf_counter()
+            self._lock.acquire()
+            waited = time.perf_counter() - start
+            self.contended += 1
+        # Counters are only updated while holding the lock
+        self.acquisitions += 1
+        self.wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def statistics(self):
+        acquisitions = self.acquisitions
+        return {
+                'acquisitions': acquisitions,
+                'contended': self.contended,
+                'wait_time': self.wait_time,
+                'average_wait_time': self.wait_time / acquisitions if acquisitions else 0.0,
+                'max_wait_time': self.max_wait_time,
+        }
 
 
 class StatsManager:
@@ -259,8 +1262,9 @@ class StatsManager:
     __shared_state = {
             'stats': {},
             'cache': {},
-            'mutex': threading.Lock(),
+            'mutex': MeasuredLock(),
             'id': 0,
+            'evicted': 0,
     }
 
     def __init__(self):
@@ -283,22 +1287,208 @@ class StatsManager:
         except KeyError:
             raise BadRequest("The given id doesn't represent an open connection")
 
+    def _forget(self, id_):
+        """Remove a connection and its cache entry. Must
+        be called with the mutex held.
+        """
+        statistic = self.stats.pop(id_)
+        key = (statistic.metadata['job_instance_id'], statistic.metadata['scenario_instance_id'])
+        if self.cache.get(key) == id_:
+            del self.cache[key]
+        return statistic
+
     def __getitem__(self, id_):
         with self._id_check():
             return self.stats[id_]
 
     def __setitem__(self, id_, statistic):
         with self.mutex:
+            previous = self.stats.get(id_)
             self.stats[id_] = statistic
+        if previous is not None and previous is not statistic:
+            previous.close()
 
     def __delitem__(self, id_):
         with self.mutex, self._id_check():
-            del self.stats[id_]
+            statistic = self._forget(id_)
+        statistic.close()
+
+    def __contains__(self, id_):
+        with self.mutex:
+            return id_ in self.stats
 
     def __iter__(self):
         with self.mutex:
             yield from self.stats.items()
 
+    def __len__(self):
+        with self.mutex:
+            return len(self.stats)
+
+    def evict_idle(self, timeout):
+        """Close the connections that did not send any
+        statistic for more than `timeout` seconds.
+        """
+        expiration = monotonic() - timeout
+        with self.mutex:
+            idle = [
+                    self._forget(id_)
+                    for id_, statistic in list(self.stats.items())
+                    if statistic.last_activity < expiration
+            ]
+            self.evicted += len(idle)
+        for statistic in idle:
+            statistic.close()
+
+
+class ConnectionsReaper(threading.Thread):
+    """Periodically evict the connections idle for too long"""
+
+    def __init__(self, idle_timeout):
+        super().__init__(daemon=True)
+        self.idle_timeout = idle_timeout
+        self._stopped = threading.Event()
+
+    def run(self):
+        interval = min(self.idle_timeout, REAPER_INTERVAL)
+        while not self._stopped.wait(interval):
+            StatsManager().evict_idle(self.idle_timeout)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class StatsFilesFlusher(threading.Thread):
+    """Periodically write to disk the statistics buffered
+    by the connections that stopped sending new ones and
+    send the summaries of their elapsed aggregation windows.
+    """
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with contextlib.suppress(OSError):
+                OpenStatsFiles().flush()
+            for _, client_connection in list(StatsManager()):
+                with contextlib.suppress(BadRequest):
+                    client_connection.flush_aggregates()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class RingBuffersDrainer(threading.Thread):
+    """Periodically process the statistics written by the jobs
+    in the ring buffers attached to their connection.
+
+    The drainer sleeps until a ring buffer is attached and polls
+    less and less often, up to `max_interval`, while the attached
+    ones stay empty.
+    """
+
+    _connections = set()
+    _mutex = threading.Lock()
+    _attached = threading.Event()
+
+    def __init__(self, interval, max_interval=RING_DRAIN_MAX_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.delay = interval
+        self._stopped = threading.Event()
+
+    @classmethod
+    def watch(cls, client_connection):
+        """Drain the ring buffer of `client_connection`
+        until it is detached.
+        """
+        with cls._mutex:
+            cls._connections.add(client_connection)
+        cls._attached.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._attached.clear()
+            with self._mutex:
+                connections = list(self._connections)
+            if not connections:
+                self.delay = self.interval
+                self._attached.wait()
+                continue
+
+            records = 0
+            for client_connection in connections:
+                with contextlib.suppress(BadRequest):
+                    records += client_connection.drain_ring()
+            with self._mutex:
+                self._connections.difference_update(
+                        client_connection for client_connection in connections
+                        if not client_connection.ring_attached)
+
+            if records:
+                self.delay = self.interval
+            else:
+                self.delay = min(self.delay * 2, self.max_interval)
+            self._attached.wait(self.delay)
+
+    def stop(self):
+        self._stopped.set()
+        self._attached.set()
+
+
+class SelfReporter(threading.Thread):
+    """Periodically send the activity counters of rstats as
+    statistics of the `rstats` job, one suffix per connection.
+    """
+
+    COUNTERS = (
+            'messages_received', 'messages_sent', 'messages_broadcast',
+            'messages_storage_only', 'messages_local_only',
+            'statistics_aggregated', 'summaries_sent', 'open_windows',
+            'idle_time',
+    )
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+        try:
+            with open(AGENT_NAME_FILE) as stream:
+                agent_name = stream.read().strip()
+        except OSError:
+            agent_name = socket.gethostname()
+        self.connection = Rstats(0, job_name='rstats', agent_name=agent_name)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with contextlib.suppress(BadRequest):
+                self.report()
+
+    def report(self):
+        timestamp = int(time.time() * 1000)
+        statistics = collect_self_statistics()
+        connections = statistics.pop('connections')
+        sender = statistics.pop('sender') or {}
+        lock = statistics.pop('stats_manager_lock')
+
+        statistics['connections'] = len(connections)
+        statistics.update(('sender_' + name, value) for name, value in sender.items())
+        statistics.update(('stats_manager_lock_' + name, value) for name, value in lock.items())
+        self.connection.send_stat(None, timestamp, statistics)
+
+        for client_connection in connections.values():
+            suffix = '{}_{}'.format(client_connection['job_name'], client_connection['job_instance_id'])
+            counters = {name: client_connection[name] for name in self.COUNTERS}
+            self.connection.send_stat(suffix, timestamp, counters)
+
+    def stop(self):
+        self._stopped.set()
+        self.connection.close()
+
 
 ######################################
 # Implementation of allowed requests #
@@ -336,30 +1526,83 @@ def create_stat(confpath, job, job_instance_id, scenario_instance_id,
                 job_instance_id=job_instance_id,
                 scenario_instance_id=scenario_instance_id,
                 owner_scenario_instance_id=owner_scenario_instance_id,
-                agent_name=agent_name,
-                reset_handlers=new)
+                agent_name=agent_name)
 
     return statistic_id
 
 
+def _check_timestamp(timestamp):
+    with _handle_parse_errors('timestamp', 'timestamp in milliseconds'):
+        date = datetime.fromtimestamp(timestamp / 1000)
+        if date.year == 1970:
+            # Most likely a timestamp in seconds, not milliseconds
+            raise ValueError
+
+
 def send_stat(connection_id, timestamp, *statistics):
     # Type conversion
     with _handle_parse_errors('connection_id', 'integer'):
         connection_id = int(connection_id)
     with _handle_parse_errors('timestamp', 'integer'):
         timestamp = int(timestamp)
-    with _handle_parse_errors('timestamp', 'timestamp in milliseconds'):
-        date = datetime.fromtimestamp(timestamp / 1000)
-        if date.year == 1970:
-            # Most likely a timestamp in seconds, not milliseconds
-            raise ValueError
+    _check_timestamp(timestamp)
 
     client_connection = StatsManager()[connection_id]
     suffix = statistics[-1] if len(statistics) % 2 else None
-    statistics = dict(grouper(statistics, 2))
+    statistics = {
+            name: parse_statistic(value)
+            for name, value in grouper(statistics, 2)
+    }
     client_connection.send_stat(suffix, timestamp, statistics)
 
 
+def send_stats(connection_id, *samples):
+    """Send several samples at once. Each sample is made of its
+    timestamp, the amount of statistics in it, the statistics as
+    name/value pairs and the suffix, possibly empty.
+
+    The request is accepted or rejected as a whole: if any sample
+    is invalid, none of them is forwarded.
+    """
+    # Type conversion
+    with _handle_parse_errors('connection_id', 'integer'):
+        connection_id = int(connection_id)
+
+    decoded = []
+    samples = iter(samples)
+    for timestamp in samples:
+        with _handle_parse_errors('timestamp', 'integer'):
+            timestamp = int(timestamp)
+        with _handle_parse_errors('count', 'integer'):
+            amount = int(next(samples, ''))
+        statistics = list(islice(samples, 2 * amount + 1))
+        if len(statistics) != 2 * amount + 1:
+            raise BadRequest('Message not formed well. Sample truncated')
+        *statistics, suffix = statistics
+        decoded.append((timestamp, suffix or None, {
+            name: parse_statistic(value)
+            for name, value in grouper(statistics, 2)
+        }))
+
+    _send_samples(StatsManager()[connection_id], decoded)
+
+
+def _send_samples(client_connection, samples):
+    rejected = 0
+    for timestamp, _, _ in samples:
+        try:
+            _check_timestamp(timestamp)
+        except BadRequest:
+            rejected += 1
+    if rejected:
+        raise BadRequest(
+                'Batch rejected: {} out of {} samples have an '
+                'invalid timestamp'.format(rejected, len(samples)))
+
+    for timestamp, suffix, statistics in samples:
+        client_connection.send_stat(suffix, timestamp, statistics)
+
+
 def reload_stat(connection_id):
     # Type conversion
     with _handle_parse_errors('connection_id', 'integer'):
@@ -382,6 +1625,12 @@ def reload_stats():
         client_connection.reload_conf()
 
 
+def reload_job_stats(job_name):
+    for _, client_connection in StatsManager():
+        if client_connection.metadata['job_name'] == job_name:
+            client_connection.reload_conf()
+
+
 def change_config(scenario_instance_id, job_instance_id, broadcast, storage):
     # Type conversion
     with _handle_parse_errors('job_instance_id', 'integer'):
@@ -399,6 +1648,178 @@ def change_config(scenario_instance_id, job_instance_id, broadcast, storage):
     client_connection._rules['default'] = RstatsRule('default', storage, broadcast)
 
 
+def sender_statistics():
+    return json.dumps(get_statistics_sender().statistics())
+
+
+def connections_statistics():
+    try:
+        open_fds = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        open_fds = None
+    manager = StatsManager()
+    return json.dumps({
+        'connections': len(manager),
+        'evicted_connections': manager.evicted,
+        'open_stats_files': len(OpenStatsFiles()),
+        'open_fds': open_fds,
+    })
+
+
+def attach_ring_buffer(connection_id, path):
+    # Type conversion
+    with _handle_parse_errors('connection_id', 'integer'):
+        connection_id = int(connection_id)
+
+    # Only map the files created by collect_agent
+    real_path = os.path.realpath(path)
+    folder, filename = os.path.split(real_path)
+    if folder != os.path.realpath(RING_BUFFER_FOLDER) or not filename.startswith(RING_BUFFER_PREFIX):
+        raise BadRequest('Cannot use ring buffer {}: not a {}* file of {}'.format(
+                path, RING_BUFFER_PREFIX, RING_BUFFER_FOLDER))
+
+    client_connection = StatsManager()[connection_id]
+    try:
+        ring = SharedMemoryRing(real_path)
+    except (OSError, ValueError) as e:
+        raise BadRequest('Cannot use ring buffer {}: {}'.format(path, e))
+    client_connection.attach_ring(ring)
+    RingBuffersDrainer.watch(client_connection)
+
+
+def rstats_statistics():
+    return json.dumps(collect_self_statistics())
+
+
+def collect_self_statistics():
+    """Gather the activity counters of the whole daemon"""
+    manager = StatsManager()
+    handler = RstatsRequestHandler
+    with handler._requests_mutex:
+        statistics = dict.fromkeys(('requests_succeeded', 'requests_rejected', 'requests_failed'), 0)
+        statistics.update(handler.requests_received)
+    statistics['stats_manager_lock'] = manager.mutex.statistics()
+    statistics['connections'] = {
+            str(id_): client_connection.statistics()
+            for id_, client_connection in manager
+    }
+    statistics['evicted_connections'] = manager.evicted
+    statistics['open_stats_files'] = len(OpenStatsFiles())
+    try:
+        statistics['sender'] = get_statistics_sender().statistics()
+    except (BadRequest, OSError, KeyError, TypeError):
+        statistics['sender'] = None
+    return statistics
+
+
+def negotiate_protocol(version):
+    # Type conversion
+    with _handle_parse_errors('version', 'integer'):
+        version = int(version)
+
+    return min(version, BINARY_PROTOCOL_VERSION)
+
+
+###########################
+# Binary requests parsing #
+###########################
+
+def _decode_string(data, offset):
+    length, = BINARY_STRING_LENGTH.unpack_from(data, offset)
+    offset += BINARY_STRING_LENGTH.size
+    end = offset + length
+    if end > len(data):
+        raise BadRequest('Binary message truncated')
+    return data[offset:end].decode(), end
+
+
+def _decode_statistic(data, offset):
+    name, offset = _decode_string(data, offset)
+    value_type, = BINARY_TYPE.unpack_from(data, offset)
+    offset += BINARY_TYPE.size
+    if value_type == BINARY_TYPE_STRING:
+        value, offset = _decode_string(data, offset)
+        return name, parse_statistic(value), offset
+
+    try:
+        value_format = BINARY_VALUES[value_type]
+    except KeyError:
+        raise BadRequest('Unknown type {} for statistic {}'.format(value_type, name))
+    value, = value_format.unpack_from(data, offset)
+    return name, value, offset + value_format.size
+
+
+def decode_binary_stat(data, offset):
+    connection_id, timestamp, count = BINARY_SEND_STAT.unpack_from(data, offset)
+    offset += BINARY_SEND_STAT.size
+    suffix, offset = _decode_string(data, offset)
+
+    statistics = {}
+    for _ in range(count):
+        name, value, offset = _decode_statistic(data, offset)
+        statistics[name] = value
+
+    return connection_id, timestamp, suffix or None, statistics
+
+
+def decode_binary_stats(data, offset):
+    connection_id, count = BINARY_SEND_STATS.unpack_from(data, offset)
+    offset += BINARY_SEND_STATS.size
+
+    samples = []
+    for _ in range(count):
+        timestamp, fields = BINARY_SAMPLE.unpack_from(data, offset)
+        offset += BINARY_SAMPLE.size
+        suffix, offset = _decode_string(data, offset)
+        statistics = {}
+        for _ in range(fields):
+            name, value, offset = _decode_statistic(data, offset)
+            statistics[name] = value
+        samples.append((timestamp, suffix or None, statistics))
+
+    return connection_id, samples
+
+
+def binary_send_stats(data, offset):
+    connection_id, samples = decode_binary_stats(data, offset)
+    _send_samples(StatsManager()[connection_id], samples)
+
+
+def binary_send_stat(data, offset):
+    connection_id, timestamp, suffix, statistics = decode_binary_stat(data, offset)
+    _check_timestamp(timestamp)
+    client_connection = StatsManager()[connection_id]
+    client_connection.send_stat(suffix, timestamp, statistics)
+
+
+def execute_binary_request(data):
+    """Decode and execute a request sent using the binary framing.
+
+    Such messages start with a header made of a null byte, the
+    version of the framing and the 1-based number of the request;
+    the payload of the request comes right after. Numbers are sent
+    as typed fields and do not need to be parsed; text fields are
+    length-prefixed UTF-8 strings.
+    """
+    try:
+        _, version, request = BINARY_HEADER.unpack_from(data)
+        if not 0 < version <= BINARY_PROTOCOL_VERSION:
+            raise BadRequest('Binary protocol version {} not supported'.format(version))
+        try:
+            binary_request = BINARY_REQUESTS[request]
+        except KeyError:
+            raise BadRequest('Type of binary request not recognized')
+        return binary_request(data, BINARY_HEADER.size)
+    except (struct.error, UnicodeDecodeError):
+        raise BadRequest('Binary message not formed well')
+
+
+BINARY_REQUESTS = {
+        2: binary_send_stat,
+        13: binary_send_stats,
+}
+
+
 #####################
 # Requests handling #
 #####################
@@ -411,37 +1832,61 @@ class RstatsRequestHandler(socketserver.BaseRequestHandler):
             remove_stat,
             reload_stats,
             change_config,
+            sender_statistics,
+            negotiate_protocol,
+            reload_job_stats,
+            connections_statistics,
+            rstats_statistics,
+            attach_ring_buffer,
+            send_stats,
     ]
+    requests_received = Counter()
+    _requests_mutex = threading.Lock()
 
     def handle(self):
         data, sock = self.request
+        sock.sendto(self.process_request(data), self.client_address)
+
+    @classmethod
+    def process_request(cls, data):
+        """Execute the request contained in `data` and build
+        the response to send back to the client.
+        """
         msg = 'KO: Unhandled exception occured\0'
+        outcome = 'requests_failed'
         try:
-            result = self.execute_request(data.decode())
+            if data[:1] == BINARY_MAGIC:
+                result = execute_binary_request(data)
+            else:
+                result = cls.execute_request(data.decode())
         except BadRequest as e:
             msg = 'KO: {}\0'.format(e.reason)
+            outcome = 'requests_rejected'
         except Exception as e:
             msg = 'KO: An error occured: {}\0'.format(e)
         else:
+            outcome = 'requests_succeeded'
             if result is None:
                 msg = 'OK\0'
             else:
                 msg = 'OK {}\0'.format(result)
-        finally:
-            sock.sendto(msg.encode(), self.client_address)
+        with cls._requests_mutex:
+            cls.requests_received[outcome] += 1
+        return msg.encode()
 
-    def execute_request(self, data):
+    @classmethod
+    def execute_request(cls, data):
         try:
             request, *args = shlex.split(data)
             request = int(request) - 1  # Compensate for collect_agent using 1-based indexing
         except ValueError:
             raise BadRequest('Type of request not recognized')
 
-        if request not in range(len(self.AVAILABLE_FUNCTIONS)):
+        if request not in range(len(cls.AVAILABLE_FUNCTIONS)):
             raise BadRequest('Type of request not recognized')
 
         try:
-            return self.AVAILABLE_FUNCTIONS[request](*args)
+            return cls.AVAILABLE_FUNCTIONS[request](*args)
         except TypeError as e:
             raise BadRequest('Arguments length mismatch: {}'.format(e))
 
@@ -450,9 +1895,148 @@ class RstatsServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
     allow_reuse_address = True
     max_packet_size = 2**14
 
+
+class RstatsProtocol(asyncio.DatagramProtocol):
+    """Receive requests on the event loop and execute them in
+    the executor so that statistics files and logstash I/O
+    never block the loop.
+    """
+
+    def __init__(self, loop, executor, request_handler_class):
+        self.loop = loop
+        self.executor = executor
+        self.request_handler_class = request_handler_class
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        future = self.loop.run_in_executor(
+                self.executor,
+                self.request_handler_class.process_request,
+                data)
+        future.add_done_callback(functools.partial(self._reply, address))
+
+    def _reply(self, address, future):
+        if self.transport is not None and not future.cancelled():
+            self.transport.sendto(future.result(), address)
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+
+class AsyncRstatsServer:
+    """Event loop based alternative to RstatsServer.
+
+    Requests are read by a single asyncio loop and executed, in
+    order, by a fixed pool of `workers` threads instead of spawning
+    a thread per datagram. Mimic the socketserver API so both servers
+    can be used interchangeably.
+    """
+
+    def __init__(self, server_address, RequestHandlerClass, workers=1):
+        self.server_address = server_address
+        self.RequestHandlerClass = RequestHandlerClass
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(server_address)
+        self.server_address = self.socket.getsockname()
+
+        protocol = functools.partial(
+                RstatsProtocol, self.loop,
+                self.executor, RequestHandlerClass)
+        self.transport, _ = self.loop.run_until_complete(
+                self.loop.create_datagram_endpoint(protocol, sock=self.socket))
+
+    def serve_forever(self):
+        self.loop.run_forever()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def server_close(self):
+        self.transport.close()
+        self.executor.shutdown(wait=True)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+
+def signal_term_handler(signal, frame):
+    """Stop the RStats daemon gracefully"""
+    sys.exit(0)
+
+
 if __name__ == '__main__':
-    server = RstatsServer(('', 1111), RstatsRequestHandler)
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-a', '--asyncio', action='store_true',
+            help='serve requests from a single asyncio event loop '
+            'instead of spawning a thread per request')
+    parser.add_argument(
+            '-w', '--workers', type=int, default=1,
+            help='amount of threads executing requests in asyncio mode')
+    parser.add_argument(
+            '-p', '--port', type=int, default=1111,
+            help='port to listen on for requests')
+    parser.add_argument(
+            '-f', '--watch-filters', metavar='INTERVAL', type=float,
+            help='check the filter files of open connections every '
+            'INTERVAL seconds and reload the ones that changed')
+    args = parser.parse_args()
+
+    if args.watch_filters:
+        FiltersWatcher(args.watch_filters).start()
+
+    try:
+        with open(RSTATS_CONFIG_FILE) as stream:
+            content = yaml.load(stream)
+        connections = content.get('connections') or {}
+        storage = content.get('storage') or {}
+        self_report = content.get('self_report') or {}
+    except (OSError, AttributeError):
+        connections = storage = self_report = {}
+    open_files = OpenStatsFiles()
+    open_files.max_open_files = int(connections.get('max_open_files', MAX_OPEN_FILES))
+    idle_timeout = connections.get('idle_timeout')
+    if idle_timeout:
+        ConnectionsReaper(int(idle_timeout)).start()
+
+    flush_interval = int(storage.get('flush_interval', STORAGE_FLUSH_INTERVAL * 1000)) / 1000
+    open_files.writer_options = {'flush_interval': flush_interval}
+    if 'segment_max_size' in storage:
+        open_files.writer_options['max_size'] = int(storage['segment_max_size']) * 2**20
+    if 'segment_max_age' in storage:
+        open_files.writer_options['max_age'] = int(storage['segment_max_age'])
+    if 'flush_size' in storage:
+        open_files.writer_options['flush_size'] = int(storage['flush_size'])
+    stats_flusher = StatsFilesFlusher(flush_interval)
+    stats_flusher.start()
+
+    RingBuffersDrainer(RING_DRAIN_INTERVAL).start()
+
+    self_report_interval = self_report.get('interval')
+    if self_report_interval:
+        SelfReporter(int(self_report_interval)).start()
+
+    signal.signal(signal.SIGTERM, signal_term_handler)
+    if args.asyncio:
+        server = AsyncRstatsServer(('', args.port), RstatsRequestHandler, args.workers)
+    else:
+        server = RstatsServer(('', args.port), RstatsRequestHandler)
     try:
         server.serve_forever()
     finally:
         server.server_close()
+        stats_flusher.stop()
+        for _, client_connection in StatsManager():
+            # Write buffered statistics and seal the segments
+            client_connection.close()
+        if get_statistics_sender.cache_info().currsize:
+            # Flush statistics still waiting in a batch
+            get_statistics_sender().close()
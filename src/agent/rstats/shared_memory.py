@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Reading side of the shared-memory transport between
+collect_agent and rstats.
+
+A job registering a ring buffer creates a file in /dev/shm, named
+openbach_rstats_*, made of a 64 bytes header followed by `capacity`
+bytes of data:
+
+    offset  0: magic (b'OBRB') and version of the layout
+    offset  8: capacity of the data area, in bytes
+    offset 16: head, total amount of bytes ever written by the job
+    offset 24: tail, total amount of bytes ever read by rstats
+    offset 32: overflows, amount of records the job could not write
+    offset 40: closed, set by rstats once it stopped reading the ring
+
+All integers use the native byte order. The data area holds records
+made of a 32 bits length followed by a binary send_stat payload,
+wrapping around at the end of the area. The job (single producer)
+only ever moves the head, after having written a record; rstats
+(single consumer) only ever moves the tail, after having copied
+the records it read. Once the ring is closed, for instance because
+rstats evicted the connection, the job sends its statistics through
+the rstats socket instead, which tells it to register again.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import mmap
+import stat
+import ctypes
+import struct
+import threading
+
+
+RING_MAGIC = b'OBRB'
+RING_VERSION = 1
+RING_HEADER = struct.Struct('=4sB3xQ')
+RING_HEAD_OFFSET = 16
+RING_TAIL_OFFSET = 24
+RING_OVERFLOWS_OFFSET = 32
+RING_CLOSED_OFFSET = 40
+RING_DATA_OFFSET = 64
+RING_RECORD_LENGTH = struct.Struct('=I')
+RING_MAX_CAPACITY = 256 * 2**20
+
+
+class RingBufferError(ValueError):
+    """Raised when a ring buffer can not be used"""
+
+
+class SharedMemoryRing:
+    """Consumer side of a ring buffer filled by a job"""
+
+    def __init__(self, path):
+        # The file lives in a world-writable folder
+        fd = os.open(path, os.O_RDWR | os.O_NOFOLLOW)
+        try:
+            status = os.fstat(fd)
+            if not stat.S_ISREG(status.st_mode):
+                raise RingBufferError('Not a regular file')
+            size = status.st_size
+            if size <= RING_DATA_OFFSET:
+                raise RingBufferError('File too small to be a ring buffer')
+            self._buffer = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, version, capacity = RING_HEADER.unpack_from(self._buffer)
+        if (magic != RING_MAGIC or version != RING_VERSION or
+                capacity > RING_MAX_CAPACITY or
+                RING_DATA_OFFSET + capacity > size):
+            self._buffer.close()
+            raise RingBufferError('Invalid ring buffer header')
+
+        self.path = path
+        self.capacity = capacity
+        self.records_read = 0
+        self._mutex = threading.Lock()
+        # Aligned 64 bits integers are read and written in one access
+        self._head = ctypes.c_uint64.from_buffer(self._buffer, RING_HEAD_OFFSET)
+        self._tail = ctypes.c_uint64.from_buffer(self._buffer, RING_TAIL_OFFSET)
+        self._overflows = ctypes.c_uint64.from_buffer(self._buffer, RING_OVERFLOWS_OFFSET)
+        self._closed = ctypes.c_uint64.from_buffer(self._buffer, RING_CLOSED_OFFSET)
+
+    @property
+    def overflows(self):
+        """Amount of records the job had to send through the
+        rstats socket instead because the ring buffer was full
+        """
+        with self._mutex:
+            if self._buffer is None:
+                return 0
+            return self._overflows.value
+
+    @property
+    def pending(self):
+        """Amount of bytes written by the job and not read yet"""
+        with self._mutex:
+            if self._buffer is None:
+                return 0
+            return self._head.value - self._tail.value
+
+    def read(self):
+        """Return the payloads of the records written since the last
+        call and make their space available again to the job.
+        """
+        with self._mutex:
+            if self._buffer is None:
+                return []
+            head = self._head.value
+            tail = self._tail.value
+            if head == tail:
+                return []
+            if not 0 < head - tail <= self.capacity:
+                raise RingBufferError('Ring buffer indexes corrupted')
+
+            start = tail % self.capacity + RING_DATA_OFFSET
+            end = start + head - tail
+            data_end = RING_DATA_OFFSET + self.capacity
+            if end <= data_end:
+                data = self._buffer[start:end]
+            else:
+                data = self._buffer[start:data_end] + self._buffer[RING_DATA_OFFSET:end - self.capacity]
+            self._tail.value = head
+
+        records = []
+        offset = 0
+        while offset + RING_RECORD_LENGTH.size <= len(data):
+            length, = RING_RECORD_LENGTH.unpack_from(data, offset)
+            offset += RING_RECORD_LENGTH.size
+            records.append(data[offset:offset + length])
+            offset += length
+        self.records_read += len(records)
+        return records
+
+    def close(self):
+        with self._mutex:
+            if self._buffer is None:
+                return
+            # Let the job know that its records are not read anymore
+            self._closed.value = 1
+            # Views on the mapping must be released before closing it
+            del self._head, self._tail, self._overflows, self._closed
+            self._buffer.close()
+            self._buffer = None
@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Local storage of the statistics received by rstats.
+
+Statistics of a connection are appended, as JSON lines, to gzip
+compressed segments stored in `<stats folder>/<job name>/`. Each
+segment is bounded in size and duration and comes with a small
+sidecar index file holding the time range and the job instance
+its statistics belong to, so lookups only decompress the segments
+they actually need.
+
+Writes are buffered in memory and flushed, then fsync'ed, in
+batches. Each flush ends with a zlib sync flush so a segment left
+behind by a crash can still be read up to its last flush.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import gzip
+import zlib
+import time
+import os.path
+import threading
+import contextlib
+from time import strftime, monotonic
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+SEGMENT_EXTENSION = '.stats.gz'
+INDEX_EXTENSION = '.idx'
+LEGACY_EXTENSION = '.stats'
+SEGMENT_MAX_SIZE = 16 * 2**20
+SEGMENT_MAX_AGE = 3600
+FLUSH_SIZE = 256
+FLUSH_INTERVAL = 1
+COMPRESSION_LEVEL = 6
+
+
+def _index_path(segment_path):
+    return segment_path[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION
+
+
+def _write_atomically(path, content):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as stream:
+        stream.write(content)
+    os.replace(temporary, path)
+
+
+class StatsSegmentWriter:
+    """Append statistics to the segments of a single connection.
+
+    Messages are kept in memory until `flush_size` of them are
+    waiting or `flush_interval` seconds elapsed since the last
+    flush. A new segment is started once the current one is
+    bigger than `max_size` compressed bytes or older than
+    `max_age` seconds.
+    """
+
+    def __init__(self, folder, metadata, max_size=SEGMENT_MAX_SIZE,
+                 max_age=SEGMENT_MAX_AGE, flush_size=FLUSH_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        self.folder = folder
+        self.metadata = {
+                name: metadata.get(name)
+                for name in ('job_name', 'job_instance_id', 'scenario_instance_id',
+                             'owner_scenario_instance_id', 'agent_name')
+        }
+        self.max_size = max_size
+        self.max_age = max_age
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.prefix = '{}_{}'.format(metadata['job_name'], strftime('%Y-%m-%dT%H%M%S'))
+        self.sequence = 0
+        self.stream = None
+        self._mutex = threading.RLock()
+        self._pending = []
+        self._last_flush = monotonic()
+        self._index = None
+        self._segment_path = None
+        self._segment_created = None
+
+        os.makedirs(folder, exist_ok=True)
+
+    def write(self, message, timestamp):
+        """Queue a JSON encoded statistic taken at `timestamp` (in ms)"""
+        with self._mutex:
+            self._pending.append((message, timestamp))
+            if (len(self._pending) >= self.flush_size or
+                    monotonic() - self._last_flush >= self.flush_interval):
+                self.flush()
+
+    def flush(self):
+        """Compress the pending messages to disk and update the index"""
+        with self._mutex:
+            self._last_flush = monotonic()
+            if not self._pending:
+                return
+            if self._segment_path is None or self._segment_expired():
+                self._rotate()
+            self.use()
+
+            pending, self._pending = self._pending, []
+            self.stream.write(''.join(message + '\n' for message, _ in pending).encode())
+            self.stream.flush(zlib.Z_SYNC_FLUSH)
+            self.stream.fileobj.flush()
+            os.fsync(self.stream.fileobj.fileno())
+
+            index = self._index
+            timestamps = [timestamp for _, timestamp in pending]
+            first, last = min(timestamps), max(timestamps)
+            index['start'] = first if index['start'] is None else min(first, index['start'])
+            index['end'] = last if index['end'] is None else max(last, index['end'])
+            index['count'] += len(pending)
+            self._write_index()
+
+    def _segment_expired(self):
+        if time.time() - self._segment_created >= self.max_age:
+            return True
+        with contextlib.suppress(OSError):
+            return os.path.getsize(self._segment_path) >= self.max_size
+        return False
+
+    def _rotate(self):
+        if self._segment_path is not None:
+            self._close_stream()
+            self._index['closed'] = True
+            self._write_index()
+        while True:
+            # Do not collide with the segments of connections
+            # of the same job opened during the same second
+            self.sequence += 1
+            filename = '{}_{:04d}{}'.format(self.prefix, self.sequence, SEGMENT_EXTENSION)
+            self._segment_path = os.path.join(self.folder, filename)
+            try:
+                os.close(os.open(
+                        _index_path(self._segment_path),
+                        os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+            except FileExistsError:
+                continue
+            break
+        self._segment_created = time.time()
+        self._index = dict(self.metadata, start=None, end=None, count=0, closed=False)
+
+    def _write_index(self):
+        _write_atomically(_index_path(self._segment_path), json.dumps(self._index))
+
+    def use(self):
+        """Make sure the current segment is open"""
+        with self._mutex:
+            if self.stream is None and self._segment_path is not None:
+                # Appending to a gzip file starts a new member, which
+                # is transparently concatenated when reading it back
+                self.stream = gzip.GzipFile(
+                        self._segment_path, mode='ab',
+                        compresslevel=COMPRESSION_LEVEL)
+
+    def release_stream(self):
+        """Flush the pending messages and close the
+        current segment until the next flush.
+        """
+        with self._mutex:
+            self.flush()
+            self._close_stream()
+
+    def _close_stream(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def close(self):
+        """Flush the pending messages and seal the current segment"""
+        with self._mutex:
+            self.release_stream()
+            if self._segment_path is not None:
+                self._index['closed'] = True
+                self._write_index()
+                self._segment_path = None
+
+
+def read_index(segment_path):
+    """Return the index of a segment or None if it is unavailable"""
+    try:
+        with open(_index_path(segment_path)) as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def find_segments(folder, job_instance_id=None, start=None, end=None):
+    """List, in chronological order, the segments stored in `folder`
+    that may hold statistics of the given job instance in the given
+    time range (timestamps in ms, bounds included).
+
+    Segments without index, and uncompressed files written by older
+    versions of rstats, are always listed as their content is unknown.
+    """
+    try:
+        filenames = sorted(os.listdir(folder))
+    except OSError:
+        return []
+
+    segments = []
+    for filename in filenames:
+        path = os.path.join(folder, filename)
+        if filename.endswith(LEGACY_EXTENSION):
+            segments.append(path)
+        elif filename.endswith(SEGMENT_EXTENSION):
+            index = read_index(path)
+            if index is not None:
+                if job_instance_id is not None and index['job_instance_id'] != job_instance_id:
+                    continue
+                if index['count'] and start is not None and index['end'] < start:
+                    continue
+                if index['count'] and end is not None and index['start'] > end:
+                    continue
+            segments.append(path)
+    return segments
+
+
+def read_segment(path):
+    """Generate the statistics stored in a segment, stopping
+    at the last complete message if the file is truncated.
+    """
+    opener = open if path.endswith(LEGACY_EXTENSION) else gzip.open
+    with opener(path, 'rb') as stream:
+        try:
+            for line in stream:
+                if not line.endswith(b'\n'):
+                    break
+                with contextlib.suppress(ValueError):
+                    yield json.loads(line.decode())
+        except (EOFError, OSError, zlib.error):
+            # Data past the last flush of a crashed rstats
+            return
+
+
+def read_statistics(folder, job_instance_id=None, start=None, end=None):
+    """Generate the statistics stored in `folder` for the given
+    job instance in the given time range (timestamps in ms).
+    """
+    for path in find_segments(folder, job_instance_id, start, end):
+        for statistic in read_segment(path):
+            metadata = statistic.get('_metadata', {})
+            if job_instance_id is not None and metadata.get('job_instance_id') != job_instance_id:
+                continue
+            timestamp = metadata.get('time', 0)
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp > end:
+                continue
+            yield statistic
@@ -0,0 +1,12 @@
+"""Unit tests of the agent components.
+
+Run them from the src/agent folder with `python3 -m unittest`.
+"""
+
+import os
+import sys
+
+
+AGENT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for component in ('collect-agent', 'rstats', 'openbach-agent'):
+    sys.path.insert(0, os.path.join(AGENT_FOLDER, component))
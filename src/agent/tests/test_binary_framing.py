@@ -0,0 +1,89 @@
+import struct
+import unittest
+
+import rstats
+
+try:
+    import collect_agent
+except (ImportError, OSError):
+    # The Python bindings need the collect-agent library
+    collect_agent = None
+
+
+STATISTICS = {
+        'integer': -42,
+        'float': 3.5,
+        'boolean': True,
+        'text': 'élevé',
+        'huge': 2**70,
+}
+
+
+@unittest.skipIf(collect_agent is None, 'collect_agent is not available')
+class BinaryFramingTestCase(unittest.TestCase):
+    def test_send_stat(self):
+        message = collect_agent.encode_stat(7, 1500000000123, 'suffix', STATISTICS)
+        _, version, request = rstats.BINARY_HEADER.unpack_from(message)
+        self.assertEqual((version, request), (1, 2))
+        decoded = rstats.decode_binary_stat(message, rstats.BINARY_HEADER.size)
+        self.assertEqual(decoded, (7, 1500000000123, 'suffix', STATISTICS))
+
+    def test_send_stat_without_suffix(self):
+        message = collect_agent.encode_stat(7, 0, None, {})
+        decoded = rstats.decode_binary_stat(message, rstats.BINARY_HEADER.size)
+        self.assertEqual(decoded, (7, 0, None, {}))
+
+    def test_send_stats(self):
+        samples = [
+                (1000 + i, 'suffix' if i % 2 else None, dict(STATISTICS, index=i))
+                for i in range(10)
+        ]
+        messages = list(collect_agent.encode_stats(3, samples))
+        self.assertEqual(len(messages), 1)
+        _, version, request = rstats.BINARY_HEADER.unpack_from(messages[0])
+        self.assertEqual((version, request), (2, 13))
+        decoded = rstats.decode_binary_stats(messages[0], rstats.BINARY_HEADER.size)
+        self.assertEqual(decoded, (3, samples))
+
+    def test_send_stats_split(self):
+        samples = [(1000 + i, None, {'index': i}) for i in range(100)]
+        messages = list(collect_agent.encode_stats(3, samples, max_size=256))
+        self.assertGreater(len(messages), 1)
+        decoded = []
+        for message in messages:
+            self.assertLessEqual(len(message), 256)
+            connection_id, batch = rstats.decode_binary_stats(message, rstats.BINARY_HEADER.size)
+            self.assertEqual(connection_id, 3)
+            decoded.extend(batch)
+        self.assertEqual(decoded, samples)
+
+    def test_send_stats_oversized_sample(self):
+        big = (1000, None, {'text': 'x' * 512})
+        small = (2000, None, {'index': 1})
+        messages = list(collect_agent.encode_stats(3, [big, small], max_size=256))
+        self.assertEqual(messages[0], big)
+        _, batch = rstats.decode_binary_stats(messages[1], rstats.BINARY_HEADER.size)
+        self.assertEqual(batch, [small])
+
+    def test_truncated_message(self):
+        message = collect_agent.encode_stat(7, 0, 'suffix', STATISTICS)
+        for length in (2, rstats.BINARY_HEADER.size + 5, len(message) - 1):
+            with self.assertRaises(rstats.BadRequest):
+                rstats.execute_binary_request(message[:length])
+
+    def test_unsupported_version(self):
+        message = collect_agent.encode_stat(7, 0, 'suffix', STATISTICS)
+        header = struct.pack('!cBB', b'\0', rstats.BINARY_PROTOCOL_VERSION + 1, 2)
+        with self.assertRaises(rstats.BadRequest):
+            rstats.execute_binary_request(header + message[rstats.BINARY_HEADER.size:])
+
+    def test_unknown_type(self):
+        message = bytearray(collect_agent.encode_stat(7, 0, '', {'a': 1}))
+        # Type of the value follows the empty suffix and the name 'a'
+        message[rstats.BINARY_HEADER.size + rstats.BINARY_SEND_STAT.size + 2 + 3] = 9
+        with self.assertRaises(rstats.BadRequest):
+            rstats.decode_binary_stat(bytes(message), rstats.BINARY_HEADER.size)
+
+
+if __name__ == '__main__':
+    unittest.main()
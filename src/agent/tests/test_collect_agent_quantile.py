@@ -0,0 +1,46 @@
+import random
+import unittest
+
+from collect_agent_quantile import P2Quantile
+
+
+class P2QuantileTestCase(unittest.TestCase):
+    def test_no_value(self):
+        self.assertIsNone(P2Quantile(0.5).value)
+
+    def test_few_values(self):
+        quantile = P2Quantile(0.5)
+        for value in (3, 1, 2):
+            quantile.add(value)
+        self.assertEqual(quantile.value, 2)
+
+    def test_constant_values(self):
+        quantile = P2Quantile(0.9)
+        for _ in range(1000):
+            quantile.add(4.2)
+        self.assertEqual(quantile.value, 4.2)
+
+    def test_estimation(self):
+        generator = random.Random(42)
+        values = [generator.uniform(0, 1000) for _ in range(20000)]
+        ordered = sorted(values)
+        for rank in (0.5, 0.9, 0.99):
+            quantile = P2Quantile(rank)
+            for value in values:
+                quantile.add(value)
+            exact = ordered[int(rank * len(ordered))]
+            self.assertAlmostEqual(quantile.value, exact, delta=10)
+
+    def test_skewed_distribution(self):
+        generator = random.Random(7)
+        values = [generator.expovariate(1 / 50) for _ in range(20000)]
+        ordered = sorted(values)
+        quantile = P2Quantile(0.99)
+        for value in values:
+            quantile.add(value)
+        exact = ordered[int(0.99 * len(ordered))]
+        self.assertAlmostEqual(quantile.value / exact, 1, delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+import openbach_agent
+
+
+def reset_job_manager():
+    """Empty the shared state of the JobManager and install a single job"""
+    manager = openbach_agent.JobManager()
+    with manager:
+        manager.jobs.clear()
+        manager.instances.clear()
+        manager._instances_by_job.clear()
+        manager._instances_by_pid.clear()
+        manager._history.clear()
+        for instances in manager._instances_by_state.values():
+            instances.clear()
+        manager.history_size = openbach_agent.INSTANCES_HISTORY_SIZE
+        manager.history_retention = openbach_agent.INSTANCES_HISTORY_RETENTION
+        manager.jobs['job'] = {'job_version': '1.0', 'command_stop': None, 'sudo': False}
+        manager._instances_by_job['job'] = set()
+    return manager
+
+
+class JobManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.manager = reset_job_manager()
+
+    def add_instance(self, instance_id, date_type='date'):
+        self.manager.add_instance('job', instance_id, '', date_type, 'now')
+
+    def test_indexes(self):
+        self.add_instance('1')
+        self.add_instance('2')
+        self.manager.set_instance_status('job', '1', 42)
+        self.assertEqual(self.manager.find_instance(42), ('job', '1'))
+        self.assertEqual(self.manager.get_instances_in_state('running'), [('job', '1')])
+        self.assertEqual(self.manager.get_instances_in_state('scheduled'), [('job', '2')])
+        self.assertEqual(
+                sorted(self.manager.get_active_instances('job')),
+                [('job', '1'), ('job', '2')])
+
+        self.manager.set_instance_status('job', '1', 42, 0)
+        self.assertNotIn(42, self.manager._instances_by_pid)
+        self.assertEqual(self.manager.get_instances_in_state('exited'), [('job', '1')])
+        self.assertIn(('job', '1'), self.manager._history)
+
+    def test_exit_of_previous_process(self):
+        self.add_instance('1', 'interval')
+        self.manager.set_instance_status('job', '1', 42)
+        # Launched again before the exit of the first process is reaped
+        self.manager.set_instance_status('job', '1', 43)
+        self.manager.set_instance_status('job', '1', 42, 0)
+        instance = self.manager.get_instance('job', '1')
+        self.assertEqual((instance['state'], instance['pid'], instance['return_code']), ('running', 43, None))
+        self.assertEqual(self.manager.find_instance(43), ('job', '1'))
+
+        self.manager.set_instance_status('job', '1', 43, 0)
+        self.assertEqual(self.manager.get_instance('job', '1')['state'], 'exited')
+
+    def test_stop_running_instance(self):
+        self.add_instance('1', 'interval')
+        self.manager.set_instance_status('job', '1', 42)
+        infos = self.manager.pop_instance('job', '1')
+        self.assertEqual(infos['pid'], 42)
+        self.assertEqual(self.manager.get_instances_in_state('stopped'), [('job', '1')])
+        self.assertNotIn(42, self.manager._instances_by_pid)
+        self.assertIn(('job', '1'), self.manager._history)
+
+    def test_stop_instance_not_started(self):
+        self.add_instance('1')
+        infos = self.manager.pop_instance('job', '1')
+        self.assertNotIn('pid', infos)
+        self.assertEqual(self.manager.get_instance('job', '1')['state'], 'stopped')
+        self.assertEqual(self.manager.get_instances_in_state('scheduled'), [])
+        self.assertEqual(self.manager.get_active_instances(), [])
+        self.assertIn(('job', '1'), self.manager._history)
+
+    def test_history_size(self):
+        self.manager.history_size = 3
+        for instance_id in range(5):
+            self.add_instance(str(instance_id))
+            self.manager.pop_instance('job', str(instance_id))
+        self.assertEqual(list(self.manager._history), [('job', '2'), ('job', '3'), ('job', '4')])
+        self.assertEqual(sorted(self.manager.instances), [('job', '2'), ('job', '3'), ('job', '4')])
+        self.assertEqual(self.manager._instances_by_job['job'], {'2', '3', '4'})
+
+    def test_history_retention(self):
+        self.manager.history_retention = 60
+        with mock.patch.object(openbach_agent.time, 'time', return_value=1000):
+            self.add_instance('1')
+            self.manager.pop_instance('job', '1')
+        with mock.patch.object(openbach_agent.time, 'time', return_value=1100):
+            self.add_instance('2')
+        self.assertNotIn(('job', '1'), self.manager.instances)
+        self.assertIn(('job', '2'), self.manager.instances)
+
+    def test_active_instances_are_kept(self):
+        self.manager.history_size = 1
+        for instance_id in range(3):
+            self.add_instance(str(instance_id), 'interval')
+            self.manager.set_instance_status('job', str(instance_id), 100 + instance_id)
+            self.manager.set_instance_status('job', str(instance_id), 100 + instance_id, 0)
+        self.assertEqual(len(self.manager.get_active_instances()), 3)
+        self.assertEqual(list(self.manager._history), [])
+
+
+class RecoveryJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        patcher = mock.patch.object(openbach_agent, 'INSTANCES_FOLDER', folder.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.close)
+        self.journal = openbach_agent.RecoveryJournal()
+        self.close()
+        self.later = int(time.time()) + 3600
+
+    def close(self):
+        journal = openbach_agent.RecoveryJournal()
+        if journal._file is not None:
+            journal._file.close()
+            journal._file = None
+        journal.orders.clear()
+        journal.records = 0
+
+    def replay(self):
+        self.close()
+        return self.journal.replay()
+
+    def test_replay(self):
+        self.journal.record_start('job', '1', '2', '3', self.later, 'arg')
+        self.journal.record_start('job', '4', '0', '0', self.later, '')
+        self.journal.record_stop('job', '1', self.later + 10)
+        self.journal.forget('job', '4')
+        self.journal.record_start('job', '1', '2', '3', self.later + 5, 'other')
+        self.assertEqual(self.replay(), [
+                ['stop', 'job', '1', self.later + 10],
+                ['start', 'job', '1', self.later + 5, '2', '3', 'other'],
+        ])
+        self.assertEqual(self.journal.records, 5)
+
+    def test_placement(self):
+        placement = openbach_agent.Placement(nice=5)
+        self.journal.record_start('job', '1', '0', '0', self.later, '', placement)
+        order, = self.replay()
+        self.assertEqual(order[-1], {'nice': 5})
+
+    def test_truncated_record(self):
+        self.journal.record_start('job', '1', '0', '0', self.later, '')
+        size = os.path.getsize(self.journal.path)
+        self.journal.record_start('job', '2', '0', '0', self.later, '')
+        os.truncate(self.journal.path, os.path.getsize(self.journal.path) - 1)
+        self.assertEqual(self.replay(), [['start', 'job', '1', self.later, '0', '0', '']])
+        self.assertEqual(os.path.getsize(self.journal.path), size)
+
+        # New records are appended right after the last valid one
+        self.journal.record_stop('job', '1', self.later)
+        self.assertEqual(len(self.replay()), 2)
+
+    def test_corrupted_record(self):
+        self.journal.record_start('job', '1', '0', '0', self.later, '')
+        size = os.path.getsize(self.journal.path)
+        self.journal.record_start('job', '2', '0', '0', self.later, '')
+        self.journal.record_start('job', '3', '0', '0', self.later, '')
+        with open(self.journal.path, 'r+b') as journal:
+            journal.seek(size + openbach_agent.JOURNAL_RECORD_HEADER.size + 2)
+            journal.write(b'#')
+        self.assertEqual(self.replay(), [['start', 'job', '1', self.later, '0', '0', '']])
+        self.assertEqual(os.path.getsize(self.journal.path), size)
+
+    def test_compaction(self):
+        with mock.patch.object(openbach_agent, 'JOURNAL_COMPACTION_THRESHOLD', 10):
+            for instance_id in range(20):
+                self.journal.record_start('job', '1', '0', '0', self.later + instance_id, '')
+        self.assertLessEqual(self.journal.records, 10)
+        self.assertEqual(self.replay(), [['start', 'job', '1', self.later + 19, '0', '0', '']])
+        # Only the records appended since the last compaction are left
+        self.assertLessEqual(self.journal.records, 10)
+
+    def test_compaction_drops_past_orders(self):
+        self.journal.record_start('job', '1', '0', '0', self.later, '')
+        self.journal.record_start('job', '2', '0', '0', 1000, '')
+        self.journal.compact()
+        self.assertEqual(self.replay(), [['start', 'job', '1', self.later, '0', '0', '']])
+
+
+@unittest.skipUnless(hasattr(os, 'sched_setaffinity'), 'CPU affinity is not supported')
+class LaunchJobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.manager = reset_job_manager()
+        self.manager.add_instance('job', '1', '', 'date', 'now')
+        self.cpu = min(os.sched_getaffinity(0))
+
+    def launch(self, placement, command='sleep', args='5'):
+        openbach_agent.launch_job('job', '1', '0', '0', command, args, placement)
+        pid = self.manager.get_instance('job', '1')['pid']
+        self.addCleanup(self.kill, pid)
+        return pid
+
+    def kill(self, pid):
+        try:
+            os.kill(pid, 9)
+        except OSError:
+            pass
+        supervisor = openbach_agent.ProcessSupervisor()
+        deadline = time.monotonic() + 5
+        while supervisor.is_running('job', '1') and time.monotonic() < deadline:
+            supervisor.wake_up()
+            time.sleep(0.01)
+
+    def wait_for_state(self, state, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.manager.get_instance('job', '1')['state'] != state:
+            if time.monotonic() > deadline:
+                self.fail('Job Instance not {} in {}s'.format(state, timeout))
+            openbach_agent.ProcessSupervisor().wake_up()
+            time.sleep(0.01)
+
+    def test_placement_applied(self):
+        pid = self.launch(openbach_agent.Placement(cpus=[self.cpu]))
+        self.assertEqual(os.sched_getaffinity(pid), {self.cpu})
+        self.assertEqual(openbach_agent.job_instance_status('job', '1'), 'Running')
+
+    def test_placement_before_exec(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        path = os.path.join(folder.name, 'niceness')
+        self.launch(openbach_agent.Placement(nice=os.getpriority(os.PRIO_PROCESS, 0) + 1),
+                    'sh', "-c 'nice > {}'".format(path))
+        self.wait_for_state('exited')
+        with open(path) as niceness:
+            self.assertEqual(int(niceness.read()), os.getpriority(os.PRIO_PROCESS, 0) + 1)
+
+    def test_placement_failure(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        path = os.path.join(folder.name, 'executed')
+        placement = openbach_agent.Placement(cpus=[self.cpu])
+        with mock.patch.object(placement, 'apply', side_effect=OSError('denied')):
+            self.launch(placement, 'touch', path)
+        self.wait_for_state('exited')
+        self.assertNotEqual(self.manager.get_instance('job', '1')['return_code'], 0)
+        self.assertEqual(openbach_agent.job_instance_status('job', '1'), 'Error')
+        self.assertFalse(os.path.exists(path))
+
+
+class ResourcesSamplerTestCase(unittest.TestCase):
+    def test_register_as_agent(self):
+        environment = dict(openbach_agent.os.environ)
+        collect_agent = mock.Mock()
+        collect_agent.register_collect.return_value = False
+        with mock.patch.object(openbach_agent, 'collect_agent', collect_agent):
+            openbach_agent.ResourcesSampler(1).run()
+        collect_agent.register_collect.assert_called_once_with(
+                openbach_agent.AGENT_FILTER_FILE, job_name='openbach_agent')
+        self.assertEqual(dict(openbach_agent.os.environ), environment)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,339 @@
+import json
+import time
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import rstats
+
+try:
+    import collect_agent
+except (ImportError, OSError):
+    # The Python bindings need the collect-agent library
+    collect_agent = None
+
+
+class UnreachableSender:
+    """Sender whose collector can be made (un)reachable at will"""
+
+    def __init__(self):
+        self.reachable = False
+        self.received = []
+        self.attempts = 0
+        self.background_attempts = 0
+
+    def __call__(self, *messages):
+        self.attempts += 1
+        if threading.current_thread() is not threading.main_thread():
+            self.background_attempts += 1
+        if not self.reachable:
+            raise rstats.BadRequest('KO collector unreachable')
+        self.received.extend(messages)
+
+    def statistics(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class StatisticsSpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = folder.name
+        self.sender = UnreachableSender()
+
+    def spool(self, **kwargs):
+        spool = rstats.StatisticsSpool(self.sender, self.path, **kwargs)
+        self.addCleanup(spool.close)
+        return spool
+
+    def wait_until(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail('condition not met in {}s'.format(timeout))
+            time.sleep(0.01)
+
+    def test_store_while_unreachable(self):
+        spool = self.spool()
+        spool('first', 'second')
+        spool('third')
+        statistics = spool.statistics()
+        self.assertEqual(statistics['messages_spooled'], 3)
+        self.assertEqual(statistics['spool_backlog'], 3)
+        self.assertEqual(self.sender.received, [])
+
+    def test_drain_once_reachable(self):
+        spool = self.spool()
+        messages = ['message {}'.format(i) for i in range(20)]
+        spool(*messages)
+        self.sender.reachable = True
+        self.wait_until(lambda: spool.statistics()['spool_backlog'] == 0)
+        self.assertEqual(self.sender.received, messages)
+        self.assertEqual(spool.statistics()['messages_drained'], 20)
+
+    def test_maximal_size(self):
+        spool = self.spool(max_size=100, segment_size=20)
+        for i in range(50):
+            spool('message {:03d}'.format(i))
+        statistics = spool.statistics()
+        self.assertLessEqual(statistics['spool_backlog_size'], 100)
+        self.assertGreater(statistics['messages_expired'], 0)
+        self.assertEqual(
+                statistics['spool_backlog'] + statistics['messages_expired'], 50)
+
+        # The newest messages are kept
+        self.sender.reachable = True
+        self.wait_until(lambda: spool.statistics()['spool_backlog'] == 0)
+        self.assertEqual(self.sender.received[-1], 'message 049')
+
+    def test_maximal_age(self):
+        spool = self.spool(max_age=0.2, segment_size=1)
+        spool('old')
+        time.sleep(0.3)
+        spool('new')
+        statistics = spool.statistics()
+        self.assertEqual(statistics['messages_expired'], 1)
+        self.assertEqual(statistics['spool_backlog'], 1)
+
+    def test_reload_on_restart(self):
+        spool = rstats.StatisticsSpool(self.sender, self.path)
+        spool('first', 'second')
+        spool.close()
+
+        spool = self.spool()
+        self.assertEqual(spool.statistics()['spool_backlog'], 2)
+        self.sender.reachable = True
+        self.wait_until(lambda: spool.statistics()['spool_backlog'] == 0)
+        self.assertEqual(self.sender.received, ['first', 'second'])
+
+    def test_backoff_while_unreachable(self):
+        spool = self.spool()
+        # Live messages keep failing and being stored, they
+        # must not make the drainer retry at once
+        deadline = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            spool('live message')
+            time.sleep(0.005)
+        # Backoff of 0.1s, 0.2s, 0.4s and so on: no more than 4 attempts
+        self.assertLessEqual(self.sender.background_attempts, 5)
+
+
+class RecordingSender(rstats.LogstashSender):
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0))
+        self.lines = []
+
+    def _send(self, lines):
+        self.lines.extend(lines)
+
+
+class InfluxDBSenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.broadcast = RecordingSender()
+        self.sender = rstats.InfluxDBSender(
+                ('127.0.0.1', 8086), 'openbach',
+                broadcast_sender=self.broadcast)
+
+    def test_broadcast(self):
+        message = json.dumps({
+            '_metadata': {'flag': 2, 'time': 1000, 'job_name': 'fping'},
+            'rtt': 1.5,
+        })
+        self.sender(message)
+        self.assertEqual(self.broadcast.lines, [message.encode() + b'\n'])
+        self.assertEqual(self.broadcast.statistics()['messages_sent'], 1)
+        self.assertEqual(self.sender.points_written, 0)
+
+    def test_store_and_broadcast(self):
+        message = json.dumps({
+            '_metadata': {'flag': 3, 'time': 1000, 'job_name': 'fping'},
+            'rtt': 1.5,
+        })
+        with mock.patch.object(self.sender, '_write') as write:
+            self.sender(message)
+        write.assert_called_once_with(b'fping rtt=1.5 1000')
+        line, = self.broadcast.lines
+        self.assertEqual(json.loads(line.decode()), {
+            '_metadata': {'flag': 2, 'time': 1000, 'job_name': 'fping'},
+            'rtt': 1.5,
+        })
+
+    def test_line_protocol(self):
+        point = self.sender._format_point({
+            '_metadata': {
+                'time': 1500, 'job_name': 'fping',
+                'agent_name': 'agent 1', 'suffix': '',
+            },
+            'rtt': 1.5,
+            'sent': 3,
+            'congested': False,
+            'state': 'up "now"',
+        })
+        self.assertEqual(
+                point,
+                'fping,@agent_name=agent\\ 1 rtt=1.5,sent=3i,'
+                'congested=false,state="up \\"now\\"" 1500')
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.samples = []
+
+    def send_stat(self, suffix, timestamp, statistics):
+        self.samples.append((timestamp, suffix, statistics))
+
+
+class SendSamplesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.connection = RecordingConnection()
+        self.timestamp = int(time.time() * 1000)
+
+    def test_valid_batch(self):
+        samples = [
+                (self.timestamp, None, {'rtt': 1.5}),
+                (self.timestamp + 1, 'eth0', {'rtt': 2.5}),
+        ]
+        rstats._send_samples(self.connection, samples)
+        self.assertEqual(self.connection.samples, samples)
+
+    def test_batch_rejected_as_a_whole(self):
+        samples = [
+                (self.timestamp, None, {'rtt': 1.5}),
+                (self.timestamp // 1000, None, {'rtt': 2.5}),
+        ]
+        with self.assertRaises(rstats.BadRequest):
+            rstats._send_samples(self.connection, samples)
+        self.assertEqual(self.connection.samples, [])
+
+
+def rstats_messager(message):
+    """Let RStats handle a request of collect_agent in-process"""
+    response = rstats.RstatsRequestHandler.process_request(message)
+    return response.split(b'\0', 1)[0].decode()
+
+
+@unittest.skipIf(collect_agent is None, 'collect_agent is not available')
+class CollectAgentTestCase(unittest.TestCase):
+    """Run collect_agent against an in-process RStats"""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.received = []
+        self.registrations = 0
+        patches = [
+                (rstats, 'DEFAULT_LOG_PATH', folder.name),
+                (rstats, 'get_statistics_sender', lambda: self.received.append),
+                (rstats, 'RING_BUFFER_FOLDER', folder.name),
+                (collect_agent, 'RING_BUFFER_FOLDER', folder.name),
+                (collect_agent, '_rstats_messager', rstats_messager),
+                (collect_agent, '_register_collect_as', self.register),
+                (collect_agent, '_registration', None),
+        ]
+        for target, attribute, value in patches:
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(rstats.StatsManager().evict_idle, -1)
+        self.addCleanup(collect_agent._detach_ring_buffer)
+        self.timestamp = int(time.time() * 1000)
+
+    def register(self, config_file, job_name, job_instance_id, scenario_instance_id,
+                 owner_scenario_instance_id, log_option, log_facility, new):
+        message = '1 "{}" "{}" {} {} {} "agent" {:d}'.format(
+                config_file.decode(), job_name.decode(), job_instance_id,
+                scenario_instance_id, owner_scenario_instance_id, new)
+        status, _, connection_id = rstats_messager(message.encode()).partition(' ')
+        self.assertEqual(status, 'OK')
+        collect_agent._connection_id.value = int(connection_id)
+        self.registrations += 1
+        return True
+
+    def sent(self):
+        return [json.loads(message)['value'] for message in self.received]
+
+
+class EvictedConnectionTestCase(CollectAgentTestCase):
+    def evict(self):
+        manager = rstats.StatsManager()
+        connection_id = collect_agent._connection_id.value
+        manager.evict_idle(-1)
+        self.assertNotIn(connection_id, manager)
+        return connection_id
+
+    def test_send_after_eviction(self):
+        self.assertTrue(collect_agent.register_collect('', job_name='job', job_instance_id=42))
+        self.assertEqual(collect_agent.send_stat(self.timestamp, value=1), 'OK')
+        evicted = self.evict()
+
+        self.assertEqual(collect_agent.send_stat(self.timestamp, value=2), 'OK')
+        self.assertEqual(collect_agent.send_stats([(self.timestamp, None, {'value': 3})]), 'OK')
+        self.assertEqual(self.registrations, 2)
+        self.assertNotEqual(collect_agent._connection_id.value, evicted)
+        self.assertIn(collect_agent._connection_id.value, rstats.StatsManager())
+        self.assertEqual(self.sent(), [1, 2, 3])
+
+    def test_ring_buffer_after_eviction(self):
+        self.assertTrue(collect_agent.register_collect(
+                '', ring_buffer_size=4096, job_name='job', job_instance_id=42))
+        ring = collect_agent._ring_buffer
+        self.assertIsNotNone(ring)
+        self.assertEqual(collect_agent.send_stat(self.timestamp, value=1), 'OK')
+        self.evict()
+        self.assertEqual(self.sent(), [1])
+
+        # The closed ring buffer is replaced along with the connection
+        self.assertEqual(collect_agent.send_stat(self.timestamp, value=2), 'OK')
+        self.assertEqual(self.registrations, 2)
+        self.assertIsNot(collect_agent._ring_buffer, ring)
+        self.assertEqual(collect_agent.send_stat(self.timestamp, value=3), 'OK')
+        rstats.StatsManager()[collect_agent._connection_id.value].drain_ring()
+        self.assertEqual(self.sent(), [1, 2, 3])
+
+
+class StatsBufferTestCase(CollectAgentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.assertTrue(collect_agent.register_collect('', job_name='job', job_instance_id=42))
+
+    def flush(self, samples):
+        stats_buffer = collect_agent._StatsBuffer(len(samples), 'block')
+        for sample in samples:
+            stats_buffer.put(sample)
+        # Started afterwards, so that samples are sent in a single batch
+        stats_buffer.start()
+        self.assertTrue(stats_buffer.stop(5))
+        return stats_buffer
+
+    def test_sent(self):
+        stats_buffer = self.flush([(self.timestamp + i, None, {'value': i}) for i in range(3)])
+        self.assertEqual((stats_buffer.sent, stats_buffer.failed, stats_buffer.errors), (3, 0, 0))
+        self.assertEqual(self.sent(), [0, 1, 2])
+
+    def test_batch_rejected(self):
+        samples = [(self.timestamp + i, None, {'value': i}) for i in range(3)]
+        # Timestamp in seconds
+        samples.append((self.timestamp // 1000, None, {'value': 3}))
+        stats_buffer = self.flush(samples)
+        self.assertEqual((stats_buffer.sent, stats_buffer.failed, stats_buffer.errors), (0, 4, 1))
+        self.assertEqual(self.sent(), [])
+
+    def test_samples_rejected(self):
+        with mock.patch.object(collect_agent, '_protocol_version', 1):
+            # Samples are sent one by one
+            stats_buffer = self.flush([
+                    (self.timestamp, None, {'value': 0}),
+                    (self.timestamp // 1000, None, {'value': 1}),
+                    (self.timestamp // 1000, None, {'value': 2}),
+                    (self.timestamp, None, {'value': 3}),
+            ])
+        self.assertEqual((stats_buffer.sent, stats_buffer.failed, stats_buffer.errors), (2, 2, 1))
+        self.assertEqual(self.sent(), [0, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+import rstats
+import shared_memory
+
+try:
+    import collect_agent
+except (ImportError, OSError):
+    # The Python bindings need the collect-agent library
+    collect_agent = None
+
+
+class InvalidRingTestCase(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'ring')
+
+    def write(self, content):
+        with open(self.path, 'wb') as ring:
+            ring.write(content)
+
+    def test_too_small(self):
+        self.write(b'\0' * shared_memory.RING_DATA_OFFSET)
+        with self.assertRaises(shared_memory.RingBufferError):
+            shared_memory.SharedMemoryRing(self.path)
+
+    def test_bad_magic(self):
+        header = shared_memory.RING_HEADER.pack(b'XXXX', shared_memory.RING_VERSION, 64)
+        self.write(header.ljust(shared_memory.RING_DATA_OFFSET + 64, b'\0'))
+        with self.assertRaises(shared_memory.RingBufferError):
+            shared_memory.SharedMemoryRing(self.path)
+
+    def test_capacity_larger_than_file(self):
+        header = shared_memory.RING_HEADER.pack(
+                shared_memory.RING_MAGIC, shared_memory.RING_VERSION, 128)
+        self.write(header.ljust(shared_memory.RING_DATA_OFFSET + 64, b'\0'))
+        with self.assertRaises(shared_memory.RingBufferError):
+            shared_memory.SharedMemoryRing(self.path)
+
+
+@unittest.skipIf(collect_agent is None, 'collect_agent is not available')
+class SharedMemoryRingTestCase(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        patcher = mock.patch.object(collect_agent, 'RING_BUFFER_FOLDER', folder.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rings(self, capacity):
+        producer = collect_agent._RingBuffer(capacity)
+        self.addCleanup(producer.close)
+        consumer = shared_memory.SharedMemoryRing(producer.path)
+        self.addCleanup(consumer.close)
+        return producer, consumer
+
+    def test_records_in_order(self):
+        producer, consumer = self.rings(1024)
+        self.assertEqual(consumer.read(), [])
+        records = [str(i).encode() * i for i in range(1, 10)]
+        for record in records:
+            self.assertTrue(producer.write(record))
+        self.assertEqual(consumer.pending, sum(len(r) + 4 for r in records))
+        self.assertEqual(consumer.read(), records)
+        self.assertEqual(consumer.pending, 0)
+        self.assertEqual(consumer.records_read, len(records))
+
+    def test_wrap_around(self):
+        producer, consumer = self.rings(100)
+        for i in range(50):
+            record = bytes([i]) * 30
+            self.assertTrue(producer.write(record))
+            self.assertTrue(producer.write(record[::2]))
+            self.assertEqual(consumer.read(), [record, record[::2]])
+        self.assertEqual(consumer.overflows, 0)
+
+    def test_full(self):
+        producer, consumer = self.rings(64)
+        self.assertTrue(producer.write(b'a' * 28))
+        self.assertTrue(producer.write(b'b' * 28))
+        self.assertFalse(producer.write(b'c'))
+        self.assertEqual(consumer.overflows, 1)
+        self.assertEqual(consumer.read(), [b'a' * 28, b'b' * 28])
+        self.assertTrue(producer.write(b'c'))
+        self.assertEqual(consumer.read(), [b'c'])
+
+    def test_corrupted_indexes(self):
+        producer, consumer = self.rings(64)
+        producer.head.value = 65
+        with self.assertRaises(shared_memory.RingBufferError):
+            consumer.read()
+
+    def test_stat_payload(self):
+        producer, consumer = self.rings(1024)
+        payload = collect_agent._encode_stat_payload(5, 1000, 'suffix', {'value': 1.5})
+        producer.write(payload)
+        record, = consumer.read()
+        self.assertEqual(
+                rstats.decode_binary_stat(record, 0),
+                (5, 1000, 'suffix', {'value': 1.5}))
+
+    def test_closed(self):
+        producer, consumer = self.rings(64)
+        producer.write(b'a')
+        consumer.close()
+        consumer.close()
+        self.assertEqual(consumer.read(), [])
+        self.assertEqual(consumer.pending, 0)
+
+
+@unittest.skipIf(collect_agent is None, 'collect_agent is not available')
+class AttachRingBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        self.received = []
+        patches = [
+                (collect_agent, 'RING_BUFFER_FOLDER', self.folder),
+                (rstats, 'RING_BUFFER_FOLDER', self.folder),
+                (rstats, 'DEFAULT_LOG_PATH', self.folder),
+                (rstats, 'get_statistics_sender', lambda: self.received.append),
+                (rstats.RingBuffersDrainer, '_connections', set()),
+                (rstats.RingBuffersDrainer, '_attached', rstats.threading.Event()),
+        ]
+        for target, attribute, value in patches:
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        manager = rstats.StatsManager()
+        self.connection_id = manager.statistic_lookup(4242, 0)
+        manager[self.connection_id] = rstats.Rstats(self.connection_id, job_instance_id=4242)
+        self.addCleanup(manager.evict_idle, -1)
+
+        self.producer = collect_agent._RingBuffer(1024)
+        self.addCleanup(self.producer.close)
+
+    def attach(self, path):
+        rstats.attach_ring_buffer(self.connection_id, path)
+
+    def test_attached(self):
+        self.attach(self.producer.path)
+        self.assertTrue(rstats.StatsManager()[self.connection_id].ring_attached)
+
+    def test_outside_of_folder(self):
+        with tempfile.NamedTemporaryFile(prefix='openbach_rstats_') as ring:
+            with self.assertRaises(rstats.BadRequest):
+                self.attach(ring.name)
+        with self.assertRaises(rstats.BadRequest):
+            self.attach(os.path.join(self.folder, 'nested', '..', '..', 'openbach_rstats_x'))
+
+    def test_bad_prefix(self):
+        path = os.path.join(self.folder, 'ring')
+        os.link(self.producer.path, path)
+        with self.assertRaises(rstats.BadRequest):
+            self.attach(path)
+
+    def test_symbolic_link(self):
+        with tempfile.TemporaryDirectory() as other:
+            target = os.path.join(other, 'openbach_rstats_target')
+            os.link(self.producer.path, target)
+            path = os.path.join(self.folder, 'openbach_rstats_link')
+            os.symlink(target, path)
+            with self.assertRaises(rstats.BadRequest):
+                self.attach(path)
+        self.assertFalse(rstats.StatsManager()[self.connection_id].ring_attached)
+
+    def test_drainer(self):
+        mutex = rstats.StatsManager().mutex
+        drainer = rstats.RingBuffersDrainer(0.001, 0.05)
+        drainer.start()
+        self.addCleanup(drainer.join, 5)
+        self.addCleanup(drainer.stop)
+
+        # Without ring buffers, the drainer sleeps
+        acquisitions = mutex.acquisitions
+        time.sleep(0.05)
+        self.assertEqual(mutex.acquisitions, acquisitions)
+
+        self.attach(self.producer.path)
+        timestamp = int(time.time() * 1000)
+        self.producer.write(collect_agent._encode_stat_payload(self.connection_id, timestamp, None, {'value': 1}))
+        deadline = time.monotonic() + 5
+        while not self.received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.received), 1)
+
+        # Empty ring buffers are polled less often
+        while drainer.delay < drainer.max_interval and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(drainer.delay, drainer.max_interval)
+
+        # Connections are forgotten along with their ring buffer
+        del rstats.StatsManager()[self.connection_id]
+        while rstats.RingBuffersDrainer._connections and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(rstats.RingBuffersDrainer._connections, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
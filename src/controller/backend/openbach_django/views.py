@@ -606,7 +606,8 @@ class JobInstancesView(BaseJobInstanceView):
                 name=job_name, address=agent_ip,
                 arguments=instance_args,
                 date=self.request.JSON.get('date'),
-                interval=self.request.JSON.get('interval'))
+                interval=self.request.JSON.get('interval'),
+                placement=self.request.JSON.get('placement'))
 
     def _action_kill(self):
         """stop all the scenario instances and job instances"""
@@ -656,7 +657,8 @@ class JobInstanceView(BaseJobInstanceView):
                 command='restart_job_instance',
                 instance_id=id, arguments=instance_args,
                 date=self.request.JSON.get('date'),
-                interval=self.request.JSON.get('interval'))
+                interval=self.request.JSON.get('interval'),
+                placement=self.request.JSON.get('placement'))
 
 
 class ScenariosView(GenericView):
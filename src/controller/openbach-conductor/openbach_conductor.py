@@ -55,6 +55,7 @@ import time
 import queue
 import shutil
 import signal
+import struct
 import syslog
 import tarfile
 import inspect
@@ -79,6 +80,7 @@ from apscheduler.jobstores.base import JobLookupError
 
 from utils import errors, external_jobs
 from utils.openbach_baton import OpenBachBaton
+from utils.notifications import AgentNotifications, NOTIFICATIONS_PORT, NOTIFICATIONS_TIMEOUT
 from utils.playbook_builder import start_playbook, setup_playbook_manager
 from data_access.elasticsearch_tools import ElasticSearchConnection
 from data_access.influxdb_tools import InfluxDBConnection
@@ -119,6 +121,8 @@ syslog.openlog('openbach_conductor', syslog.LOG_PID, syslog.LOG_USER)
 
 
 DEFAULT_JOBS = '/opt/openbach/controller/ansible/roles/install_job/defaults/main.yml'
+STATUS_POLL_INTERVAL = 2
+STATUS_FALLBACK_POLL_INTERVAL = 30
 TOPOLOGY_WORKERS = 10
 _SEVERITY_MAPPING = {
     1: 3,   # Error
@@ -1568,6 +1572,14 @@ class JobInstanceAction(ConductorAction):
                     'The requested Job Instance is not in the database',
                     job_instance_id=self.instance_id)
 
+    def _check_placement(self, **details):
+        if self.placement is not None and not isinstance(self.placement, dict):
+            raise errors.BadRequestError(
+                    'The placement of a JobInstance should be a mapping '
+                    'of hints such as cpus, nice, sched_fifo, io_class, '
+                    'io_priority, memory_max or cpu_max',
+                    placement=self.placement, **details)
+
     def _start_job_instance(self, method):
         job_instance = self.get_job_instance_or_not_found_error()
         scenario_id = job_instance.scenario_id
@@ -1587,7 +1599,8 @@ class JobInstanceAction(ConductorAction):
                     job_instance.id,
                     scenario_id, owner_id,
                     job_instance.arguments,
-                    date, self.interval)
+                    date, self.interval,
+                    self.placement)
         except (AttributeError, errors.ConductorError):
             job_instance.delete()
             raise
@@ -1598,9 +1611,10 @@ class JobInstanceAction(ConductorAction):
 class StartJobInstance(OpenbachFunctionMixin, ThreadedAction, JobInstanceAction):
     """Action responsible for launching a Job on an Agent"""
 
-    def __init__(self, address, name, arguments, date=None, interval=None, offset=0):
+    def __init__(self, address, name, arguments, date=None, interval=None, offset=0, placement=None):
         super().__init__(address=address, name=name, arguments=arguments,
-                         date=date, interval=interval, offset=offset)
+                         date=date, interval=interval, offset=offset,
+                         placement=placement)
 
     def _create_command_result(self):
         command_result, _ = JobInstanceCommandResult.objects.get_or_create(job_instance_id=self.instance_id)
@@ -1622,7 +1636,8 @@ class StartJobInstance(OpenbachFunctionMixin, ThreadedAction, JobInstanceAction)
                 scenario.id,
                 openbach_function_instance.id,
                 waiters)
-        StatusManager().add(scenario.id, self.instance_id, self.connected_user.get_username())
+        StatusManager().add(scenario.id, self.instance_id, self.connected_user.get_username(), self.address)
+        AgentNotifications().subscribe(self.address)
         return super().openbach_function(openbach_function_instance, waiters)
 
     @require_connected_user()
@@ -1641,6 +1656,7 @@ class StartJobInstance(OpenbachFunctionMixin, ThreadedAction, JobInstanceAction)
         """
         if date is None:
             date = self.date
+        self._check_placement(job_name=self.name, agent_address=self.address)
 
         installed_infos = InfosInstalledJob(self.address, self.name)
         self.share_user(installed_infos)
@@ -1803,9 +1819,9 @@ class StopJobInstances(OpenbachFunctionMixin, ConductorAction):
 class RestartJobInstance(OpenbachFunctionMixin, ThreadedAction, JobInstanceAction):
     """Action responsible for restarting a launched Job"""
 
-    def __init__(self, instance_id, arguments, date=None, interval=None):
+    def __init__(self, instance_id, arguments, date=None, interval=None, placement=None):
         super().__init__(instance_id=instance_id, arguments=arguments,
-                         date=date, interval=interval)
+                         date=date, interval=interval, placement=placement)
 
     def _create_command_result(self):
         command_result, _ = JobInstanceCommandResult.objects.get_or_create(job_instance_id=self.instance_id)
@@ -1820,6 +1836,7 @@ class RestartJobInstance(OpenbachFunctionMixin, ThreadedAction, JobInstanceActio
         job_instance = self.get_job_instance_or_not_found_error()
         owner = job_instance.started_by
         self._assert_user_in([owner])
+        self._check_placement(job_instance_id=self.instance_id)
 
         with db.transaction.atomic():
             try:
@@ -1885,25 +1902,38 @@ class ListJobInstance(JobInstanceAction):
         agent_infos._check_user_can_use_agent()
         agent = agent_infos.get_agent_or_not_found_error()
 
-        jobs = [
-                self._status_instances(installed_job)
+        job_instances = {
+                installed_job.job.name: list(JobInstance.objects.filter(
+                    agent=agent, job_name=installed_job.job.name, is_stopped=False))
                 for installed_job in agent.installed_jobs.all()
+        }
+        if self.update:
+            # Refresh the whole Agent in a single request
+            refresh_job_instances_status(self.address, [
+                job_instance
+                for instances in job_instances.values()
+                for job_instance in instances
+            ])
+
+        jobs = [
+                self._status_instances(job_name, instances)
+                for job_name, instances in job_instances.items()
         ]
         return {
                 'address': self.address,
                 'installed_jobs': jobs,
         }, 200
 
-    def _status_instances(self, installed_job):
+    def _status_instances(self, job_name, job_instances):
         return {
-                'job_name': installed_job.job.name,
-                'instances': list(self._status_instances_helper(installed_job)),
+                'job_name': job_name,
+                'instances': list(self._status_instances_helper(job_instances)),
         }
 
-    def _status_instances_helper(self, installed_job):
-        for job_instance in installed_job.instances.filter(is_stopped=False):
+    def _status_instances_helper(self, job_instances):
+        for job_instance in job_instances:
             with suppress(errors.ConductorError):
-                status = StatusJobInstance(job_instance.id, self.update)
+                status = StatusJobInstance(job_instance.id)
                 self.share_user(status)
                 yield status.action()[0]
 
@@ -3689,10 +3719,15 @@ class WaitingQueueManager:
 class StatusManager:
     """Manage watches on the conductor to regularly check in
     agents for JobInstances statuses.
+
+    Agents pushing state notifications are only polled every
+    STATUS_FALLBACK_POLL_INTERVAL seconds, as a safety net.
     """
 
     __state = {
             'scenarios': {},
+            'watches': {},
+            '_last_poll': {},
             '_mutex': threading.Lock(),
             'scheduler': None,
     }
@@ -3706,14 +3741,22 @@ class StatusManager:
                 self.scheduler.start()
 
     def _stop_watch(self, job_id):
+        self.watches.pop(job_id, None)
+        self._last_poll.pop(job_id, None)
         with suppress(JobLookupError):
             self.scheduler.remove_job('watch_{}'.format(job_id))
 
     def remove(self, scenario_id, job_id):
+        """Stop watching a job instance and return whether it was
+        still watched, so its termination is handled only once.
+        """
         with self._mutex:
             jobs = self.scenarios.get(scenario_id, set())
+            if job_id not in jobs:
+                return False
             jobs.remove(job_id)
             self._stop_watch(job_id)
+            return True
 
     def cancel(self, scenario_id):
         with self._mutex:
@@ -3721,42 +3764,179 @@ class StatusManager:
             for job_id in jobs:
                 self._stop_watch(job_id)
 
-    def add(self, scenario_id, job_id, username):
+    def add(self, scenario_id, job_id, username, address):
         with self._mutex:
             self.scenarios.setdefault(scenario_id, set()).add(job_id)
+            self.watches[job_id] = (scenario_id, username, address)
+            self._last_poll[job_id] = time.time()
             self.scheduler.add_job(
-                    status_manager, 'interval', seconds=2,
+                    status_manager, 'interval', seconds=STATUS_POLL_INTERVAL,
                     args=(job_id, scenario_id, username),
                     id='watch_{}'.format(job_id))
 
+    def get(self, job_id):
+        """Return the scenario instance ID and the user
+        watching a job instance, or None.
+        """
+        with self._mutex:
+            try:
+                scenario_id, username, _ = self.watches[job_id]
+            except KeyError:
+                return None
+            return scenario_id, username
+
+    def due_watches(self, job_id):
+        """Return the watches to poll now, along with the address
+        of their Agent: none if the given job instance was polled
+        recently, otherwise every watch on the same Agent so it is
+        refreshed in a single request.
+
+        Agents pushing state notifications are only polled every
+        STATUS_FALLBACK_POLL_INTERVAL seconds.
+        """
+        with self._mutex:
+            try:
+                _, _, address = self.watches[job_id]
+            except KeyError:
+                return {}, None
+
+        interval = STATUS_FALLBACK_POLL_INTERVAL
+        notifications = AgentNotifications()
+        if not notifications.is_pushing(address):
+            notifications.subscribe(address)
+            interval = STATUS_POLL_INTERVAL
+
+        now = time.time()
+        with self._mutex:
+            # Leave some slack for the jitter of the scheduler
+            elapsed = now - self._last_poll.get(job_id, 0)
+            if elapsed < interval - STATUS_POLL_INTERVAL / 2:
+                return {}, address
+
+            watches = {}
+            for watched_id, (scenario_id, username, agent) in self.watches.items():
+                if agent == address:
+                    self._last_poll[watched_id] = now
+                    watches[watched_id] = (scenario_id, username)
+            return watches, address
+
+
+def refresh_job_instances_status(address, job_instances):
+    """Update the status of several JobInstances running
+    on the same Agent using a single request.
+    """
+    if not job_instances:
+        return
+
+    try:
+        statuses = OpenBachBaton(address).status_job_instances(
+                (job_instance.job_name, job_instance.id)
+                for job_instance in job_instances)
+    except errors.UnprocessableError as e:
+        if 'Unknown action' not in e.error.get('agent_message', ''):
+            for job_instance in job_instances:
+                job_instance.set_status('Error Agent')
+            return
+
+        # Older Agent: ask for each JobInstance in turn, through
+        # a single connection if the Agent allows it
+        try:
+            baton = OpenBachBaton(address, persistent=True, pipelined=True)
+            statuses = baton.status_job_instance_many(
+                    (job_instance.job_name, job_instance.id)
+                    for job_instance in job_instances)
+            baton.close()
+        except errors.UnprocessableError:
+            statuses = [None] * len(job_instances)
+        for job_instance, status in zip(job_instances, statuses):
+            job_instance.set_status(status or 'Error Agent')
+    else:
+        for job_instance, details in zip(job_instances, statuses):
+            job_instance.set_status(details['status'] or 'Error Agent')
+
 
 def status_manager(job_instance_id, scenario_instance_id, username):
-    """Check and update the status of a job instance based
-    on the informations stored in the database.
+    """Check and update the status of the job instances watched
+    on the Agent of the given one, based on the informations
+    stored in the database.
 
     When jobs finish, update scenarios informations as well
     and stop StatusManager watches.
     """
 
-    # Check JobInstance status in database
-    job_status_manager = StatusJobInstance(job_instance_id, update=True)
+    watches, address = StatusManager().due_watches(job_instance_id)
+    if not watches:
+        return
+
+    job_instances = list(JobInstance.objects.filter(id__in=watches))
+    refresh_job_instances_status(address, [
+        # Agents uninstalled since can not be updated
+        job_instance for job_instance in job_instances
+        if job_instance.agent_id is not None
+    ])
+
+    for job_instance in job_instances:
+        scenario_id, username = watches[job_instance.id]
+        job_status_manager = StatusJobInstance(job_instance.id)
+        job_status_manager.configure_user(username)
+        try:
+            job_instance_updated(job_status_manager, job_instance, scenario_id)
+        except errors.ConductorError as e:
+            syslog.syslog(syslog.LOG_ERR, '{}'.format(e.json))
+
+
+def job_instance_status_changed(address, job_name, job_instance_id, status):
+    """Apply the status of a job instance pushed by
+    the Agent at the given address.
+    """
+    if status is None:
+        # The Agent could not tell, polling will
+        return
+
+    try:
+        job_instance = JobInstance.objects.get(id=int(job_instance_id))
+    except (ValueError, JobInstance.DoesNotExist):
+        return
+    if job_instance.job_name != job_name:
+        # Instance started directly on the Agent
+        return
+    if job_instance.agent is None or job_instance.agent.address != address:
+        # Instance of an other Agent, the ID is local to the Agent
+        return
+
+    watch = StatusManager().get(job_instance.id)
+    if watch is None:
+        if not job_instance.is_stopped:
+            job_instance.set_status(status)
+        return
+
+    scenario_instance_id, username = watch
+    job_status_manager = StatusJobInstance(job_instance.id)
     job_status_manager.configure_user(username)
-    job_status_manager.action()
-    job_instance = job_status_manager.get_job_instance_or_not_found_error()
+    job_instance.set_status(status)
+    job_instance_updated(job_status_manager, job_instance, scenario_instance_id)
+
+
+def job_instance_updated(job_status_manager, job_instance, scenario_instance_id):
+    """Update scenarios informations when a watched job instance
+    finished and stop its StatusManager watch.
+    """
     if job_instance.status in ('Scheduled', 'Running'):
         return
 
     # Update JobInstance as being stopped and stop watches
+    if not StatusManager().remove(scenario_instance_id, job_instance.id):
+        # Already handled by a notification or a previous poll
+        return
     job_instance.is_stopped = True
     job_instance.save()
-    StatusManager().remove(scenario_instance_id, job_instance_id)
     if job_instance.status.startswith('Error'):
         stop_scenario = StopScenarioInstance(scenario_instance_id)
         job_status_manager.share_user(stop_scenario)
         stop_scenario.action()
         scenario = stop_scenario.get_scenario_instance_or_not_found_error()
         scenario.stop(stop_status='Finished KO')
-    si_id = WaitingQueueManager().remove_job(job_instance_id)
+    si_id = WaitingQueueManager().remove_job(job_instance.id)
     assert scenario_instance_id == si_id
     scenario_instance = ScenarioInstance.objects.get(id=si_id)
     if scenario_instance.is_stopped:
@@ -3782,6 +3962,86 @@ class ConductorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
 
 
+class NotificationsHandler(socketserver.BaseRequestHandler):
+    """Receive the state transitions pushed by an Agent"""
+
+    def _read_all(self, amount):
+        buffer = bytearray(amount)
+        view = memoryview(buffer)
+        while amount > 0:
+            received = self.request.recv_into(view[-amount:])
+            if not received:
+                raise ConnectionError('Connection closed by the Agent')
+            amount -= received
+        return buffer
+
+    def finish(self):
+        self.request.close()
+
+    def handle(self):
+        # Trust the connection, not the content of the messages
+        address = self.client_address[0]
+        try:
+            known_agent = Agent.objects.filter(address=address).exists()
+        finally:
+            db.connection.close()
+        if not known_agent:
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Refusing notifications from {}: not '
+                    'an installed Agent'.format(address))
+            return
+
+        self.request.settimeout(NOTIFICATIONS_TIMEOUT)
+        # Reacting to a transition may take a while (stopping a
+        # scenario): leave it to a worker so the connection keeps
+        # being read, a single worker preserving their order
+        transitions = queue.Queue()
+        worker = threading.Thread(
+                target=self._apply_transitions,
+                args=(address, transitions), daemon=True)
+        worker.start()
+        try:
+            while True:
+                length, = struct.unpack('>I', self._read_all(4))
+                message = json.loads(self._read_all(length).decode())
+                if not AgentNotifications().received(address, message):
+                    continue
+                if message['type'] == 'event':
+                    instances = [message]
+                else:
+                    instances = message['instances']
+                for instance in instances:
+                    transitions.put((
+                        instance['job_name'],
+                        instance['job_instance_id'],
+                        instance['status']))
+        except (OSError, ValueError, KeyError) as e:
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Notifications from {} interrupted: {}'
+                    .format(address, e))
+        finally:
+            transitions.put(None)
+            AgentNotifications().disconnected(address)
+
+    @staticmethod
+    def _apply_transitions(address, transitions):
+        try:
+            for job_name, job_instance_id, status in iter(transitions.get, None):
+                try:
+                    job_instance_status_changed(address, job_name, job_instance_id, status)
+                except errors.ConductorError as e:
+                    syslog.syslog(syslog.LOG_ERR, '{}'.format(e.json))
+                except Exception as e:
+                    syslog.syslog(
+                            syslog.LOG_ERR,
+                            'Cannot apply the status {} of {} {}: {}'
+                            .format(status, job_name, job_instance_id, e))
+        finally:
+            db.connection.close()
+
+
 class BackendHandler(socketserver.BaseRequestHandler):
     def finish(self):
         """Close the connection after handling a request"""
@@ -3845,6 +4105,9 @@ class BackendHandler(socketserver.BaseRequestHandler):
 if __name__ == '__main__':
     signal.signal(signal.SIGTERM, signal_term_handler)
 
+    notifications_server = ConductorServer(('', NOTIFICATIONS_PORT), NotificationsHandler)
+    threading.Thread(target=notifications_server.serve_forever, daemon=True).start()
+
     backend_server = ConductorServer(('', 1113), BackendHandler)
     try:
         backend_server.serve_forever()
@@ -0,0 +1,4 @@
+"""Unit tests of the conductor helpers that do not need Django.
+
+Run them from the openbach-conductor folder with `python3 -m unittest`.
+"""
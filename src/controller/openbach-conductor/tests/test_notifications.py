@@ -0,0 +1,97 @@
+import unittest
+from unittest import mock
+
+from utils import notifications
+from utils.notifications import AgentNotifications
+
+
+class AgentNotificationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.notifications = AgentNotifications()
+        self.notifications.agents.clear()
+        self.notifications._subscriptions.clear()
+
+    def event(self, sequence, epoch=1, address='10.0.0.1'):
+        return self.notifications.received(address, {
+            'type': 'event', 'epoch': epoch, 'sequence': sequence,
+            'agent': address, 'job_name': 'fping',
+            'job_instance_id': '1', 'status': 'Running',
+        })
+
+    def resync(self, sequence, epoch=1, address='10.0.0.1'):
+        return self.notifications.received(address, {
+            'type': 'resync', 'epoch': epoch, 'sequence': sequence,
+            'agent': address, 'instances': [],
+        })
+
+    def test_in_order(self):
+        self.assertTrue(self.event(1))
+        self.assertTrue(self.event(2))
+        # A gap in the sequence is not an error
+        self.assertTrue(self.event(5))
+
+    def test_duplicated_and_stale(self):
+        self.assertTrue(self.event(1))
+        self.assertTrue(self.event(2))
+        self.assertFalse(self.event(2))
+        self.assertFalse(self.event(1))
+        self.assertTrue(self.event(3))
+
+    def test_resync(self):
+        self.assertTrue(self.event(1))
+        self.assertTrue(self.resync(10))
+        self.assertFalse(self.event(9))
+        self.assertTrue(self.event(11))
+
+    def test_agent_restarted(self):
+        self.assertTrue(self.event(1))
+        self.assertTrue(self.event(2))
+        self.assertTrue(self.event(1, epoch=2))
+        self.assertFalse(self.event(1, epoch=2))
+        self.assertTrue(self.event(2, epoch=2))
+
+    def test_agents_are_independent(self):
+        self.assertTrue(self.event(5, address='10.0.0.1'))
+        self.assertTrue(self.event(1, address='10.0.0.2'))
+        self.assertFalse(self.event(5, address='10.0.0.1'))
+
+    def test_other_messages(self):
+        address = '10.0.0.1'
+        self.assertFalse(self.notifications.is_pushing(address))
+        keepalive = {'type': 'keepalive', 'epoch': 1, 'sequence': 0, 'agent': address}
+        self.assertFalse(self.notifications.received(address, keepalive))
+        self.assertTrue(self.notifications.is_pushing(address))
+
+    def test_silent_agent(self):
+        address = '10.0.0.1'
+        self.event(1, address=address)
+        self.assertTrue(self.notifications.is_pushing(address))
+        later = notifications.time.time() + notifications.NOTIFICATIONS_TIMEOUT + 1
+        with mock.patch.object(notifications.time, 'time', return_value=later):
+            self.assertFalse(self.notifications.is_pushing(address))
+
+    def test_disconnected(self):
+        address = '10.0.0.1'
+        self.event(1, address=address)
+        self.notifications.disconnected(address)
+        self.assertFalse(self.notifications.is_pushing(address))
+        # Sequence starts over on a new connection
+        self.assertTrue(self.event(1, address=address))
+
+    def test_subscribe_once(self):
+        with mock.patch.object(notifications, 'OpenBachBaton') as baton:
+            self.notifications.subscribe('10.0.0.1')
+            self.notifications.subscribe('10.0.0.1')
+        baton.assert_called_once_with('10.0.0.1')
+        baton.return_value.subscribe_notifications.assert_called_once_with(
+                notifications.NOTIFICATIONS_PORT, '10.0.0.1')
+
+    def test_no_subscription_while_pushing(self):
+        self.event(1)
+        with mock.patch.object(notifications, 'OpenBachBaton') as baton:
+            self.notifications.subscribe('10.0.0.1')
+        baton.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
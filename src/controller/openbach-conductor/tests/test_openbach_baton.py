@@ -0,0 +1,157 @@
+import time
+import socket
+import struct
+import threading
+import socketserver
+import unittest
+
+from utils import errors
+from utils.openbach_baton import OpenBachBaton
+
+
+class FakeAgent(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Speak the protocol of the Agent, recording the requests
+    it executes. Connections are closed after answering
+    `requests_per_connection` requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, persistence=True):
+        super().__init__(('127.0.0.1', 0), FakeAgentHandler)
+        self.persistence = persistence
+        self.executed = []
+        self.connections = 0
+        self.requests_per_connection = None
+        self.reset_on = None
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def execute(self, message):
+        self.executed.append(message)
+        action, *arguments = message.split()
+        if action == 'status_job_instance_agent':
+            return 'OK Running' if arguments[0] == 'job' else 'KO No job installed'
+        return 'OK'
+
+
+class FakeAgentHandler(socketserver.BaseRequestHandler):
+    def _read_all(self, amount):
+        data = b''
+        while len(data) < amount:
+            received = self.request.recv(amount - len(data))
+            if not received:
+                raise ConnectionError
+            data += received
+        return data
+
+    def read(self):
+        length, = struct.unpack('>I', self._read_all(4))
+        return self._read_all(length).decode()
+
+    def send(self, message):
+        message = message.encode()
+        self.request.sendall(struct.pack('>I', len(message)) + message)
+
+    def reset(self):
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.request.close()
+
+    def handle(self):
+        agent = self.server
+        agent.connections += 1
+        message = self.read()
+        action, *arguments = message.split()
+        if action != 'persistent_connection_agent':
+            self.send(agent.execute(message))
+            return
+        if not agent.persistence:
+            self.send('KO Unknown action: {}'.format(action))
+            return
+        self.send('OK')
+
+        pipelined = arguments == ['pipelined']
+        handled = 0
+        while handled != agent.requests_per_connection:
+            try:
+                message = self.read()
+            except ConnectionError:
+                return
+            request_id = None
+            if pipelined:
+                request_id, message = message.split(' ', 1)
+            response = agent.execute(message)
+            if message == agent.reset_on:
+                self.reset()
+                return
+            if request_id is not None:
+                response = '{} {}'.format(request_id, response)
+            self.send(response)
+            handled += 1
+
+
+class OpenBachBatonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.agent = FakeAgent()
+        self.addCleanup(self.agent.server_close)
+        self.addCleanup(self.agent.shutdown)
+
+    def baton(self, **kwargs):
+        baton = OpenBachBaton('127.0.0.1', self.agent.port, **kwargs)
+        self.addCleanup(baton.close)
+        return baton
+
+    def test_single_request(self):
+        baton = self.baton()
+        self.assertEqual(baton.check_connection(), 'OK')
+        self.assertEqual(baton.check_connection(), 'OK')
+        self.assertEqual(self.agent.connections, 2)
+
+    def test_persistent(self):
+        baton = self.baton(persistent=True)
+        self.assertTrue(baton.persistent)
+        for _ in range(3):
+            baton.check_connection()
+        self.assertEqual(self.agent.connections, 1)
+        self.assertEqual(self.agent.executed, ['check_connection'] * 3)
+
+    def test_pipelined(self):
+        baton = self.baton(persistent=True, pipelined=True)
+        statuses = baton.status_job_instance_many([('job', 1), ('other', 2), ('job', 3)])
+        self.assertEqual(statuses, ['Running', None, 'Running'])
+        self.assertEqual(self.agent.connections, 1)
+
+    def test_older_agent(self):
+        self.agent.persistence = False
+        baton = self.baton(persistent=True, pipelined=True)
+        self.assertFalse(baton.persistent)
+        statuses = baton.status_job_instance_many([('job', 1), ('job', 2)])
+        self.assertEqual(statuses, ['Running', 'Running'])
+        self.assertEqual(len(self.agent.executed), 2)
+
+    def test_idle_connection_closed(self):
+        self.agent.requests_per_connection = 1
+        for pipelined in (False, True):
+            baton = self.baton(persistent=True, pipelined=pipelined)
+            baton.check_connection()
+            # Let the Agent close the connection
+            while not baton._is_closed_by_agent():
+                time.sleep(0.01)
+            self.assertEqual(baton.check_connection(), 'OK')
+            self.assertTrue(baton.persistent)
+            self.assertEqual(baton.pipelined, pipelined)
+        self.assertEqual(self.agent.executed, ['check_connection'] * 4)
+
+    def test_no_retry_once_sent(self):
+        self.agent.reset_on = 'restart_agent'
+        for pipelined in (False, True):
+            baton = self.baton(persistent=True, pipelined=pipelined)
+            with self.assertRaises(errors.UnprocessableError):
+                baton.restart_agent()
+        self.assertEqual(self.agent.executed, ['restart_agent'] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
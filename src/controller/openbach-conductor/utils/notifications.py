@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Bookkeeping of the Agents pushing the state transitions
+of their JobInstances to the conductor.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import time
+import syslog
+import threading
+
+from . import errors
+from .openbach_baton import OpenBachBaton
+
+
+NOTIFICATIONS_PORT = 1114
+NOTIFICATIONS_TIMEOUT = 30
+
+
+class AgentNotifications:
+    """Keep track of the Agents pushing the state transitions
+    of their JobInstances to the conductor.
+
+    Messages of an Agent carry its epoch and a sequence number
+    so stale or duplicated notifications are discarded.
+    """
+
+    __state = {
+            'agents': {},
+            '_subscriptions': {},
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        """Implement the Borg pattern so any instance share the same state"""
+        self.__dict__ = self.__class__.__state
+
+    def is_pushing(self, address):
+        with self._mutex:
+            try:
+                infos = self.agents[address]
+            except KeyError:
+                return False
+            return time.time() - infos['last_message'] < NOTIFICATIONS_TIMEOUT
+
+    def subscribe(self, address):
+        """Ask an Agent to push its notifications, unless
+        it already does or was asked recently.
+        """
+        now = time.time()
+        with self._mutex:
+            if now - self._subscriptions.get(address, 0) < NOTIFICATIONS_TIMEOUT:
+                return
+            self._subscriptions[address] = now
+
+        if self.is_pushing(address):
+            return
+
+        try:
+            OpenBachBaton(address).subscribe_notifications(NOTIFICATIONS_PORT, address)
+        except errors.ConductorError as e:
+            # Older agents: keep on polling them
+            syslog.syslog(syslog.LOG_WARNING, '{}'.format(e.json))
+
+    def received(self, address, message):
+        """Record a message from an Agent and return
+        whether it should be processed.
+        """
+        with self._mutex:
+            infos = self.agents.setdefault(address, {'epoch': None, 'sequence': 0})
+            infos['last_message'] = time.time()
+            epoch = message.get('epoch')
+            if epoch != infos['epoch']:
+                # The Agent restarted, its sequence starts over
+                infos['epoch'] = epoch
+                infos['sequence'] = 0
+
+            if message['type'] == 'resync':
+                infos['sequence'] = message['sequence']
+                return True
+            if message['type'] != 'event':
+                return False
+            if message['sequence'] <= infos['sequence']:
+                return False
+            infos['sequence'] = message['sequence']
+            return True
+
+    def disconnected(self, address):
+        with self._mutex:
+            self.agents.pop(address, None)
@@ -36,34 +36,122 @@ __credits__ = '''Contributors:
 '''
 
 
+import json
 import shlex
 import struct
 import socket
+import select
 
 from . import errors
 
 
+class ConnectionClosedError(ConnectionError):
+    """Raised when the Agent closed the connection before answering"""
+
+
+def _format_placement(placement):
+    """Encode the placement hints of a job instance (CPUs,
+    priorities and cgroup limits) as understood by the Agent.
+    """
+    if not placement:
+        return ''
+    return 'placement {} '.format(shlex.quote(json.dumps(placement)))
+
+
 class OpenBachBaton:
-    def __init__(self, agent_ip, agent_port=1112):
-        address = (agent_ip, agent_port)
+    """Send requests to an Agent.
+
+    By default, the Agent closes the connection after answering the
+    first request. Using `persistent=True`, the connection is kept
+    open so several requests can be sent without reconnecting; using
+    `pipelined=True` as well, `communicate_many` sends a whole batch
+    of requests before reading any response. Agents that do not
+    support persistent connections fall back to one connection per
+    request.
+
+    A request is sent again on a new connection only if the Agent
+    closed the previous one before anything was written to it: once
+    sent, a request may have been executed and is never repeated.
+    """
+
+    def __init__(self, agent_ip, agent_port=1112, persistent=False, pipelined=False):
+        self.address = (agent_ip, agent_port)
         self.socket = None
+        self.persistent = False
+        self.pipelined = False
+        self._connect()
+        if persistent:
+            self._negotiate_persistence(pipelined)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _connect(self):
+        self.close()
         try:
-            self.socket = socket.create_connection(address)
+            self.socket = socket.create_connection(self.address)
         except OSError as e:
             raise errors.UnprocessableError(
                     'Cannot connect to the agent {}: {}'
-                    .format(agent_ip, e))
+                    .format(self.address[0], e))
 
-    def __del__(self):
-        if self.socket is not None:
-            self.socket.close()
+    def _reconnect(self):
+        """Open a new connection, negotiating again the
+        persistence of the previous one.
+        """
+        persistent, pipelined = self.persistent, self.pipelined
+        self.persistent = self.pipelined = False
+        self._connect()
+        if persistent:
+            self._negotiate_persistence(pipelined)
+
+    def _is_closed_by_agent(self):
+        """Check, without blocking, whether the Agent closed
+        the connection since the last response.
+        """
+        try:
+            readable, _, _ = select.select([self.socket], [], [], 0)
+            return bool(readable) and not self.socket.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def _ensure_connection(self):
+        if self.socket is None or (self.persistent and self._is_closed_by_agent()):
+            self._reconnect()
+
+    def _negotiate_persistence(self, pipelined):
+        message = 'persistent_connection_agent'
+        if pipelined:
+            message += ' pipelined'
+        try:
+            self.send_message(message)
+            response = self.recv_message()
+        except OSError as e:
+            raise errors.UnprocessableError(
+                    'Sending message to the agent failed: {}'
+                    .format(e))
+
+        if response.startswith('OK'):
+            self.persistent = True
+            self.pipelined = pipelined
+        else:
+            # Older Agent: it closed the connection after refusing
+            self._connect()
 
     def _recv_all(self, amount):
+        expected = amount
         buffer = bytearray(amount)
         view = memoryview(buffer)
         while amount > 0:
             received = self.socket.recv_into(view[-amount:])
             if not received:
+                if amount == expected:
+                    raise ConnectionClosedError('Connection closed by the agent')
                 break
             amount -= received
         return buffer
@@ -71,22 +159,40 @@ class OpenBachBaton:
     def send_message(self, message):
         message = message.encode()
         length = struct.pack('>I', len(message))
-        self.socket.sendall(length)
-        self.socket.sendall(message)
+        self.socket.sendall(length + message)
 
     def recv_message(self):
         size = self._recv_all(4)
         length, = struct.unpack('>I', size)
         return self._recv_all(length).decode()
 
-    def communicate(self, message):
+    def _exchange(self, message):
         try:
-            self.send_message(message)
-            response = self.recv_message()
-        except OSError as e:
+            self._ensure_connection()
+            try:
+                self.send_message(message)
+            except ConnectionError:
+                if not self.persistent:
+                    raise
+                # The Agent closed the idle connection before we could
+                # write our request: it has not been processed, try again
+                self._reconnect()
+                self.send_message(message)
+            return self.recv_message()
+        except (OSError, struct.error) as e:
+            self.close()
             raise errors.UnprocessableError(
                     'Sending message to the agent failed: {}'
                     .format(e))
+        finally:
+            if not self.persistent:
+                self.close()
+
+    def communicate(self, message):
+        if self.pipelined:
+            response, = self._communicate_pipelined([message])
+        else:
+            response = self._exchange(message)
 
         if not response.startswith('OK'):
             raise errors.UnprocessableError(
@@ -95,11 +201,59 @@ class OpenBachBaton:
 
         return response
 
-    def start_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None):
+    def communicate_many(self, messages):
+        """Send several requests to the Agent and return the
+        raw responses, in the same order than the requests.
+        """
+        if self.pipelined:
+            return self._communicate_pipelined(messages)
+        return [self._exchange(message) for message in messages]
+
+    def _communicate_pipelined(self, messages):
+        responses = {}
+        try:
+            self._ensure_connection()
+            if not self.pipelined:
+                # The Agent refused pipelining on the new connection
+                return [self._exchange(message) for message in messages]
+            sent = self._send_pipeline(messages)
+            if not sent:
+                # The Agent closed the idle connection before we could
+                # write our first request: nothing was processed, try again
+                self._reconnect()
+                if not self.pipelined:
+                    return [self._exchange(message) for message in messages]
+                sent = self._send_pipeline(messages)
+            if sent < len(messages):
+                raise ConnectionError('Connection closed by the agent')
+            while len(responses) < len(messages):
+                request_id, _, response = self.recv_message().partition(' ')
+                responses[int(request_id)] = response
+        except (OSError, struct.error, ValueError) as e:
+            self.close()
+            self.persistent = self.pipelined = False
+            raise errors.UnprocessableError(
+                    'Sending message to the agent failed: {}'
+                    .format(e))
+        return [responses[request_id] for request_id in range(len(messages))]
+
+    def _send_pipeline(self, messages):
+        """Send the requests without waiting for their responses
+        and return how many of them could be written.
+        """
+        for request_id, message in enumerate(messages):
+            try:
+                self.send_message('{} {}'.format(request_id, message))
+            except ConnectionError:
+                return request_id
+        return len(messages)
+
+    def start_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None, placement=None):
         assert sum(time is not None for time in (date, interval)) == 1
 
-        message = 'start_job_instance_agent {} {} {} {} {}{} {}'.format(
+        message = 'start_job_instance_agent {} {} {} {} {}{}{} {}'.format(
                 shlex.quote(job_name), job_id, scenario_id, owner_id,
+                _format_placement(placement),
                 '' if date is None else 'date {}'.format(date),
                 '' if interval is None else 'interval {}'.format(interval),
                 arguments)
@@ -114,11 +268,12 @@ class OpenBachBaton:
 
         return self.communicate(message)
 
-    def restart_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None):
+    def restart_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None, placement=None):
         assert sum(time is not None for time in (date, interval)) == 1
 
-        message = 'restart_job_instance_agent {} {} {} {} {}{} {}'.format(
+        message = 'restart_job_instance_agent {} {} {} {} {}{}{} {}'.format(
                 shlex.quote(job_name), job_id, scenario_id, owner_id,
+                _format_placement(placement),
                 '' if date is None else 'date {}'.format(date),
                 '' if interval is None else 'interval {}'.format(interval),
                 arguments)
@@ -129,6 +284,34 @@ class OpenBachBaton:
         message = 'status_job_instance_agent {} {}'.format(shlex.quote(job_name), job_id)
         return self.communicate(message)[3:]
 
+    def status_job_instance_many(self, instances):
+        """Retrieve the status of several job instances (an iterable
+        of job name and job instance ID pairs) using one request each,
+        for Agents not supporting `status_job_instances`. Statuses that
+        could not be retrieved are None.
+        """
+        responses = self.communicate_many([
+            'status_job_instance_agent {} {}'.format(shlex.quote(job_name), job_id)
+            for job_name, job_id in instances
+        ])
+        return [
+                response[3:] if response.startswith('OK') else None
+                for response in responses
+        ]
+
+    def status_job_instances(self, instances=None):
+        """Retrieve the status of several job instances at once,
+        all of them if `instances` (an iterable of job name and
+        job instance ID pairs) is not provided.
+        """
+        message = 'status_job_instances_agent'
+        if instances is not None:
+            message = ' '.join([message] + [
+                '{} {}'.format(shlex.quote(job_name), job_id)
+                for job_name, job_id in instances
+            ])
+        return json.loads(self.communicate(message)[3:])
+
     def list_jobs(self):
         response = self.communicate('status_jobs_agent')
         return shlex.split(response[3:])
@@ -144,3 +327,7 @@ class OpenBachBaton:
 
     def check_connection(self):
         return self.communicate('check_connection')
+
+    def subscribe_notifications(self, port, agent_address):
+        message = 'subscribe_notifications_agent {} {}'.format(port, shlex.quote(agent_address))
+        return self.communicate(message)
@@ -43,12 +43,19 @@ import subprocess
 import argparse
 from os import rename
 
+import collect_agent
+
 
 def main(file_id, job_name):
     template = '/opt/openbach/agent/jobs/{0}/{0}{1}_rstats_filter.conf'
-    path = template.format(job_name, file_id)
-    rename(path + '.locked', path)
-    subprocess.check_call(['systemctl', 'restart', 'rstats.service'])
+    path = template.format(job_name, '')
+    rename(template.format(job_name, file_id) + '.locked', path)
+
+    # Reload the rules of the running instances of the job only,
+    # restart rstats if it does not support it
+    response = collect_agent.reload_job_stats(job_name)
+    if not response.startswith('OK'):
+        subprocess.check_call(['systemctl', 'restart', 'rstats.service'])
 
 
 if __name__ == "__main__":
@@ -63,4 +70,4 @@ if __name__ == "__main__":
             help='The name of the Job you want to change the logs policy')
 
     args = parser.parse_args()
-    main(args.transfert_id, args.job_name)
+    main(args.transfer_id, args.job_name)
@@ -37,16 +37,17 @@ __credits__ = '''Contributors:
 
 
 import os
+import sys
 import argparse
 import datetime
-from contextlib import suppress
-try:
-    import simplejson as json
-except ImportError:
-    import json
+from itertools import groupby
+from operator import itemgetter
 
 import collect_agent
 
+sys.path.insert(0, '/opt/openbach/agent/rstats/')
+import stats_store
+
 
 ENVIRON_METADATA = (
         'job_name',
@@ -56,40 +57,31 @@ ENVIRON_METADATA = (
 )
 
 
-def send_stats(filename):
+def send_stats(statistics):
     conf_file = '/opt/openbach/agent/jobs/send_stats/send_stats_rstats_filter.conf'
 
-    with open(filename) as statistics:
-        first_line = json.loads(next(statistics))
-        metadata = first_line.pop('_metadata')
-        timestamp = metadata['time']
-        suffix = metadata.get('suffix')
+    for key, samples in groupby(map(_split_metadata, statistics), key=itemgetter(0)):
         # Setup for register_collect to work properly
-        for name in ENVIRON_METADATA:
-            os.environ[name.upper()] = metadata[name]
+        for name, value in zip(ENVIRON_METADATA, key):
+            os.environ[name.upper()] = str(value)
         # Recreate connection with rstats
         success = collect_agent.register_collect(conf_file, new=True)
         if not success:
             raise ConnectionError('cannot communicate with rstats')
-        collect_agent.send_stat(timestamp, suffix=suffix, **first_line)
+        collect_agent.send_stats(sample for _, sample in samples)
 
-        for line in statistics:
-            line_json = json.loads(line)
-            metadata = line_json.pop('_metadata')
-            timestamp = metadata['time']
-            suffix = metadata.get('suffix')
-            collect_agent.send_stat(timestamp, suffix=suffix, **line_json)
 
+def _split_metadata(statistic):
+    metadata = statistic.pop('_metadata')
+    key = tuple(metadata[name] for name in ENVIRON_METADATA)
+    return key, (metadata['time'], metadata.get('suffix'), statistic)
 
-def main(job_name, date, stats_folder='/var/openbach_stats/'):
-    from_date = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S.%f')
-    date_format = '{}_%Y-%m-%dT%H%M%S.stats'.format(job_name)
 
-    for filename in os.listdir(os.path.join(stats_folder, job_name)):
-        with suppress(ValueError):
-            file_date = datetime.datetime.strptime(filename, date_format)
-            if file_date >= from_date:
-                send_stats(os.path.join(stats_folder, job_name, filename))
+def main(job_name, date, job_instance_id=None, stats_folder='/var/openbach_stats/'):
+    from_date = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S.%f')
+    start = int(from_date.timestamp() * 1000)
+    folder = os.path.join(stats_folder, job_name)
+    send_stats(stats_store.read_statistics(folder, job_instance_id, start))
 
 
 if __name__ == "__main__":
@@ -99,9 +91,12 @@ if __name__ == "__main__":
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('job_name', help='Name of the Job')
     parser.add_argument('date', nargs=2, help='Date of the execution')
+    parser.add_argument(
+            '-i', '--job-instance-id', type=int,
+            help='Only send the statistics of this Job Instance')
 
     # get args
     args = parser.parse_args()
     job_name = args.job_name
     date = '{} {}'.format(*args.date)
-    main(job_name, date)
+    main(job_name, date, args.job_instance_id)
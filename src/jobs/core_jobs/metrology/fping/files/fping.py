@@ -42,7 +42,6 @@ import time
 import syslog
 import argparse
 import subprocess
-from statistics import mean
 import collect_agent
 
 
@@ -80,7 +79,11 @@ def main(destination_ip, count, interval, interface, packetsize, ttl, n_mean):
 
     collect_agent.send_log(syslog.LOG_DEBUG, 'Starting job fping')
 
-    measurements = []
+    # Keep sending the mean as `rtt` and summarize
+    # its variations when averaging several packets
+    measurements = collect_agent.StatsAggregator(
+            'rtt', count=n_mean, names={'mean': 'rtt'},
+            functions=collect_agent.SUMMARY_FUNCTIONS if n_mean > 1 else ('mean',))
 
     # launch command
     p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
@@ -100,10 +103,7 @@ def main(destination_ip, count, interval, interface, packetsize, ttl, n_mean):
             message = handle_exception(ex, timestamp)
             sys.exit(message)
 
-        measurements.append(rtt_data)
-        if len(measurements) == n_mean:
-            collect_agent.send_stat(timestamp, rtt=mean(measurements))
-            measurements = []
+        measurements.add(rtt_data, timestamp)
 
 
 if __name__ == "__main__":
@@ -42,7 +42,6 @@ import shlex
 import syslog
 import argparse
 from subprocess import Popen, PIPE, STDOUT
-from statistics import mean
 
 import collect_agent
 
@@ -66,7 +65,11 @@ def main(destination_ip, count, interval, n_mean, destport):
         sys.exit(message)
     collect_agent.send_log(syslog.LOG_DEBUG, 'Starting job hping')
 
-    measurements = []
+    # Keep sending the mean as `rtt` and summarize
+    # its variations when averaging several packets
+    measurements = collect_agent.StatsAggregator(
+            'rtt', count=n_mean, names={'mean': 'rtt'},
+            functions=collect_agent.SUMMARY_FUNCTIONS if n_mean > 1 else ('mean',))
 
     # launch command
     p = Popen(cmd, stdout=PIPE, stderr=STDOUT)
@@ -96,10 +99,7 @@ def main(destination_ip, count, interval, n_mean, destport):
         if rtt_data is None:
             continue
 
-        measurements.append(rtt_data)
-        if len(measurements) == n_mean:
-            collect_agent.send_stat(timestamp, rtt=mean(measurements))
-            measurements = []
+        measurements.add(rtt_data, timestamp)
 
 
 if __name__ == "__main__":
@@ -50,11 +50,24 @@ from threading import Thread, Event
 import collect_agent
 
 
+STATS_BUFFER_SIZE = 4096
+LOAD_TIME_SUMMARIES = ('count', 'mean', 'min', 'max', 'stddev', 'p50', 'p90', 'p99')
+
+# Summarize page load times instead of sending each of them
+load_times = None
+
+
 def signal_term_handler(stop_event, signal, frame):
     stop_event.set()
+    flush_load_times()
     exit(0)
 
 
+def flush_load_times():
+    if load_times is not None:
+        load_times.flush()
+
+
 def worker_loop(q, server_address, page, stop_event):
     try:
         while not stop_event.is_set():
@@ -91,24 +104,35 @@ def get_url(server_address, page):
             'The Page Load Time (sec) is = {}'.format(conntime))
     try:
         # Send stat to rstats
-        collect_agent.send_stat(timestamp, value=conntime)
+        if load_times is None:
+            collect_agent.send_stat(timestamp, value=conntime)
+        else:
+            load_times.add(conntime, timestamp)
     except Exception as ex:
         collect_agent.send_log(
                 syslog.LOG_ERR,
                 'ERROR sending stat: {}'.format(ex))
 
 
-def main(server_address, port, mode, lambd, sim_t, n_req, page):
+def main(server_address, port, mode, lambd, sim_t, n_req, page, summary_interval=None):
     # Connexion au service de collecte de l'agent
     success = collect_agent.register_collect(
             '/opt/openbach/agent/jobs/http2_client_plt/'
-            'http2_client_plt_rstats_filter.conf')
+            'http2_client_plt_rstats_filter.conf',
+            # Do not delay workers while rstats processes statistics
+            buffer_size=STATS_BUFFER_SIZE)
     if not success:
         message = 'ERROR connecting to collect-agent'
         collect_agent.send_log(syslog.LOG_ERR, message)
         exit(message)
 
     server_address = "{}:{}".format(server_address, port)
+    global load_times
+    if summary_interval:
+        load_times = collect_agent.StatsAggregator(
+                'load_time', period=summary_interval,
+                functions=LOAD_TIME_SUMMARIES)
+
     stop_event = Event()
     signal.signal(signal.SIGTERM, partial(signal_term_handler, stop_event))
 
@@ -162,6 +186,8 @@ def main(server_address, port, mode, lambd, sim_t, n_req, page):
                 syslog.LOG_ERR,
                 'ERROR: mode value not known (mode must be 0 or 1)')
 
+    flush_load_times()
+
 
 if __name__ == '__main__':
     # Define Usage
@@ -191,6 +217,11 @@ if __name__ == '__main__':
     parser.add_argument(
             '-p', '--page', type=int, default=1,
             help='Page number')
+    parser.add_argument(
+            '-s', '--summary-interval', type=float,
+            help='Send, every *summary_interval* seconds, summaries '
+            '(mean, min, max, standard deviation and percentiles) of '
+            'the page load times instead of each of them')
 
     # get args
     args = parser.parse_args()
@@ -202,4 +233,4 @@ if __name__ == '__main__':
     n_req = args.n_req
     page = args.page
 
-    main(server_address, port, mode, lambd, sim_t, n_req, page)
+    main(server_address, port, mode, lambd, sim_t, n_req, page, args.summary_interval)
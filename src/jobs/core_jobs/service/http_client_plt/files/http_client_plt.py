@@ -55,11 +55,24 @@ from lxml import html
 import collect_agent
 
 
+STATS_BUFFER_SIZE = 4096
+LOAD_TIME_SUMMARIES = ('count', 'mean', 'min', 'max', 'stddev', 'p50', 'p90', 'p99')
+
+# Summarize page load times instead of sending each of them
+load_times = None
+
+
 def signal_term_handler(stop_event, signal, frame):
     stop_event.set()
+    flush_load_times()
     exit(0)
 
 
+def flush_load_times():
+    if load_times is not None:
+        load_times.flush()
+
+
 def worker_loop(q, server_address, page, measure, stop_event):
     try:
         while not stop_event.is_set():
@@ -113,7 +126,10 @@ def get_url(server_address, port, page, measure):
         timestamp = int(time.time() * 1000)
         try:
             # Send the stat to the Collector
-            collect_agent.send_stat(timestamp, load_time=conntime)
+            if load_times is None:
+                collect_agent.send_stat(timestamp, load_time=conntime)
+            else:
+                load_times.add(conntime, timestamp)
         except Exception as ex:
             collect_agent.send_log(
                     syslog.LOG_ERR,
@@ -124,16 +140,24 @@ def get_url(server_address, port, page, measure):
                 'ERROR getting url (the server might not be running)')
 
 
-def main(server_address, port, mode, lambd, sim_t, n_req, page, measure):
+def main(server_address, port, mode, lambd, sim_t, n_req, page, measure, summary_interval=None):
     # Connect to the collect-agent service
     success = collect_agent.register_collect(
             '/opt/openbach/agent/jobs/http_client_plt/'
-            'http_client_plt_rstats_filter.conf')
+            'http_client_plt_rstats_filter.conf',
+            # Do not delay workers while rstats processes statistics
+            buffer_size=STATS_BUFFER_SIZE)
     if not success:
         message = 'ERROR connecting to collect-agent'
         collect_agent.send_log(syslog.LOG_ERR, message)
         exit(message)
 
+    global load_times
+    if summary_interval:
+        load_times = collect_agent.StatsAggregator(
+                'load_time', period=summary_interval,
+                functions=LOAD_TIME_SUMMARIES)
+
     stop_event = Event()
     signal.signal(signal.SIGTERM, partial(signal_term_handler, stop_event))
 
@@ -187,6 +211,8 @@ def main(server_address, port, mode, lambd, sim_t, n_req, page, measure):
                 syslog.LOG_ERR,
                 'ERROR: mode value not known (mode must be 0 or 1)')
 
+    flush_load_times()
+
 
 if __name__ == '__main__':
     # Define Usage
@@ -219,6 +245,11 @@ if __name__ == '__main__':
     parser.add_argument(
             '-t', '--measure-time', action='store_true', 
             help='Measure page loading time')
+    parser.add_argument(
+            '-s', '--summary-interval', type=float,
+            help='Send, every *summary_interval* seconds, summaries '
+            '(mean, min, max, standard deviation and percentiles) of '
+            'the page load times instead of each of them')
 
     # get args
     args = parser.parse_args()
@@ -231,4 +262,4 @@ if __name__ == '__main__':
     page = args.page
     measure = args.measure_time
 
-    main(server_address, port, mode, lambd, sim_t, n_req, page, measure)
+    main(server_address, port, mode, lambd, sim_t, n_req, page, measure, args.summary_interval)
@@ -118,7 +118,14 @@ def server(interval, window_size, port, udp, rate_compute_time, num_flows,
     if udp:
         cmd.append('-u')
         
-    total_rate = []
+    total_rate = collect_agent.StatsAggregator(
+            'total_rate', functions=('mean', 'max', 'min', 'stddev'),
+            names={
+                'mean': 'mean_total_rate',
+                'max': 'max_total_rate',
+                'min': 'min_total_rate',
+                'stddev': 'stddev_total_rate',
+            })
     for i in range(iterations):
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                              stderr=subprocess.PIPE)
@@ -168,7 +175,7 @@ def server(interval, window_size, port, udp, rate_compute_time, num_flows,
                 if flow.upper() != "SUM":
                     continue
                 elif flow.upper() == "SUM" and elapsed > rate_compute_time:
-                    total_rate.append(bandwidth * multiplier(bandwidth_units, 'bits/sec'))
+                    total_rate.add(bandwidth * multiplier(bandwidth_units, 'bits/sec'), timestamp)
 
             statistics = {
                     'sent_data': transfer * multiplier(transfer_units, 'Bytes'),
@@ -180,7 +187,7 @@ def server(interval, window_size, port, udp, rate_compute_time, num_flows,
                 statistics['sent_pkts'] = total
                 statistics['plr'] = datagrams
             if num_flows == 1 and elapsed > rate_compute_time:
-                total_rate.append(bandwidth * multiplier(bandwidth_units, 'bits/sec'))
+                total_rate.add(bandwidth * multiplier(bandwidth_units, 'bits/sec'), timestamp)
             
             collect_agent.send_stat(timestamp, suffix=flow_number, **statistics)
         error_log = p.stderr.readline()
@@ -188,10 +195,7 @@ def server(interval, window_size, port, udp, rate_compute_time, num_flows,
             collect_agent.send_log(syslog.LOG_ERR, 'Error when launching iperf: {}'.format(error_log))
             sys.exit(1)
         p.wait()
-        statistics = {}
-        statistics['mean_total_rate'] = sum(total_rate)/len(total_rate)
-        statistics['max_total_rate'] = max(total_rate)
-        collect_agent.send_stat(timestamp, **statistics)
+        total_rate.flush(timestamp)
         time.sleep(3)
 
 if __name__ == "__main__":